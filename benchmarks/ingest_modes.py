@@ -0,0 +1,61 @@
+# Compares upload throughput with timestamps normalized by the backend and by the `<index>-pipeline` ingest pipeline.
+# Runs against the cluster configured in `.env`, using two throwaway indices:
+#
+#     poetry run python -m benchmarks.ingest_modes [rows]
+
+import asyncio
+import sys
+from collections.abc import AsyncIterator
+from datetime import datetime, timedelta
+
+from elasticsearch import AsyncElasticsearch
+
+from sl_statistics_backend import config
+from sl_statistics_backend.log_database import LogDatabase
+from sl_statistics_backend.log_stream import parse_log_stream
+
+HEADER = (
+    "PC DateTime: 25.02.2022 14:23:21\r\n"
+    "UPS DateTime: 25.02.2022 14:23:20\r\n"
+    "INI File name :  unit.ini; Unit=1 - SubUnit=0\r\n"
+    "INI File name :  module.ini; Unit=1 - SubUnit=1\r\n"
+    "Date ; Time ; Unit  ; SubUnit ; Code ; Description ; Value ; Type/UM ; Snapshot ; Color\r\n"
+)
+
+
+async def synthetic_log(rows: int) -> AsyncIterator[bytes]:
+    yield HEADER.encode("cp1252")
+    timestamp = datetime(2022, 2, 25, 14, 23, 17)
+    for start in range(0, rows, 10000):
+        lines = []
+        for i in range(start, min(start + 10000, rows)):
+            timestamp -= timedelta(milliseconds=137)
+            value, type_um = ("ON", "BIN") if i % 3 else ("0x0000", "Hex")
+            lines.append(
+                f"{timestamp:%d/%m/%Y} ; {timestamp:%H:%M:%S.%f}"[:-3]
+                + f" ; 1 ; {i % 2} ; code{i % 40} ; description {i % 40} ; {value} ; {type_um} ; 0 ; 0xFFADFF2F\r\n"
+            )
+        yield "".join(lines).encode("cp1252")
+
+
+async def run(rows: int) -> None:
+    elastic = AsyncElasticsearch(str(config.ELASTICSEARCH_URL), verify_certs=False, ssl_show_warn=False)
+    try:
+        for use_pipeline in (True, False):
+            log_db = LogDatabase(
+                elastic, f"benchmark-{'pipeline' if use_pipeline else 'client'}", use_pipeline=use_pipeline
+            )
+            await log_db.drop_indices()
+            await log_db.ensure_index_exists()
+            stats = await log_db.upload("benchmark.csv", parse_log_stream("benchmark.csv", synthetic_log(rows)))
+            print(
+                f"{'pipeline' if use_pipeline else 'client'}: {stats.count} docs in {stats.elapsed_seconds:.2f}s, "
+                f"{stats.docs_per_second:.0f} docs/s, {stats.mb_per_second:.2f} MB/s"
+            )
+            await log_db.drop_indices()
+    finally:
+        await elastic.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000))
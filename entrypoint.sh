@@ -1,4 +1,6 @@
 #!/usr/bin/env sh
 
 . ./.venv/bin/activate
+# gunicorn workers share cached query results through this database
+export QUERY_CACHE_PATH="${QUERY_CACHE_PATH-/tmp/sl_statistics_backend-query_cache.sqlite3}"
 ./.venv/bin/gunicorn -k uvicorn.workers.UvicornWorker -b 0.0.0.0:8000 --access-logfile - sl_statistics_backend:app
\ No newline at end of file
@@ -1,5 +1,7 @@
 import contextlib
 from collections.abc import AsyncGenerator
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
 
 from elasticsearch import AsyncElasticsearch
 from spectree import SpecTree
@@ -7,18 +9,65 @@ from starlette.applications import Starlette
 from starlette.middleware.cors import CORSMiddleware
 
 from . import config
-from .log_database import LogDatabase
+from .bulk_indexer import BulkIndexer
+from .bulk_load import BulkLoadSettings
+from .ingest_jobs import IngestJobQueue
+from .log_database import IndexLayout, LogDatabase
+from .query_cache import QueryCache, SharedQueryCache
+from .single_flight import SingleFlight
 
 spec = SpecTree("starlette")
 elastic = AsyncElasticsearch(str(config.ELASTICSEARCH_URL), verify_certs=False, ssl_show_warn=False)
-log_db = LogDatabase(elastic)
+
+query_cache: QueryCache | None = None
+if config.QUERY_CACHE_SIZE > 0:
+    # with several worker processes, only a shared cache sees the uploads handled by the other workers
+    query_cache = (
+        SharedQueryCache(config.QUERY_CACHE_PATH, config.QUERY_CACHE_SIZE, config.QUERY_CACHE_TTL)
+        if config.QUERY_CACHE_PATH
+        else QueryCache(config.QUERY_CACHE_SIZE, config.QUERY_CACHE_TTL)
+    )
+log_db = LogDatabase(
+    elastic,
+    bulk_indexer=BulkIndexer(
+        elastic,
+        chunk_size=config.BULK_CHUNK_SIZE,
+        max_chunk_bytes=config.BULK_MAX_CHUNK_BYTES,
+        max_concurrency=config.BULK_MAX_CONCURRENCY,
+        max_retries=config.BULK_MAX_RETRIES,
+        initial_backoff=config.BULK_INITIAL_BACKOFF,
+    ),
+    use_pipeline=config.INGEST_USE_PIPELINE,
+    query_cache=query_cache,
+    index_layout=IndexLayout(config.INDEX_LAYOUT),
+    bulk_load=(
+        BulkLoadSettings(
+            elastic, disable_refresh=config.INGEST_DISABLE_REFRESH, disable_replicas=config.INGEST_DISABLE_REPLICAS
+        )
+        if config.INGEST_DISABLE_REFRESH or config.INGEST_DISABLE_REPLICAS
+        else None
+    ),
+    wait_for_refresh=config.INGEST_REFRESH == "wait_for",
+    composite_page_size=config.COMPOSITE_PAGE_SIZE,
+    composite_partitions=config.COMPOSITE_PARTITIONS,
+    stale_claim_timeout=timedelta(seconds=config.UPLOAD_CLAIM_TIMEOUT),
+)
+
+# with no parser processes, log parsing falls back to the event loop's default thread pool
+parser_pool = ProcessPoolExecutor(max_workers=config.PARSER_POOL_SIZE) if config.PARSER_POOL_SIZE > 0 else None
+ingest_jobs = IngestJobQueue(concurrency=config.INGEST_JOB_CONCURRENCY, max_queued=config.INGEST_JOB_QUEUE_SIZE)
+# identical chart and aggregation queries running at the same time share a single `log_db` call
+query_flights = SingleFlight()
 
 
 @contextlib.asynccontextmanager
 async def app_lifespan(app: Starlette) -> AsyncGenerator:
     await log_db.ensure_index_exists()
     yield
+    await ingest_jobs.close()
     await log_db.close()
+    if parser_pool is not None:
+        parser_pool.shutdown(cancel_futures=True)
 
 
 from .api import ApiMount  # noqa: E402
@@ -1,5 +1,6 @@
 from starlette.routing import Mount
 
+from .cache import CacheMount
 from .charts import ChartMount
 from .log_aggregation import LogAggregationMount
 from .log_management import LogManagementMount
@@ -7,6 +8,7 @@ from .log_management import LogManagementMount
 ApiMount = Mount(
     "/api",
     routes=[
+        CacheMount,
         ChartMount,
         LogAggregationMount,
         LogManagementMount,
@@ -0,0 +1,27 @@
+from spectree import Response as SpectreeResponse
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+
+from sl_statistics_backend import spec
+from sl_statistics_backend.models import QueryCacheStats, SingleFlightStats
+from sl_statistics_backend.services import cache_service
+
+
+@spec.validate(resp=SpectreeResponse(HTTP_200=QueryCacheStats), tags=["Query cache"])
+async def query_cache_stats(_: Request) -> Response:
+    return JSONResponse(cache_service.query_cache_stats().dict())
+
+
+@spec.validate(resp=SpectreeResponse(HTTP_200=SingleFlightStats), tags=["Query cache"])
+async def coalesced_query_stats(_: Request) -> Response:
+    return JSONResponse(cache_service.coalesced_query_stats().dict())
+
+
+CacheMount = Mount(
+    "/cache",
+    routes=[
+        Route("/stats", query_cache_stats),
+        Route("/coalescing", coalesced_query_stats),
+    ],
+)
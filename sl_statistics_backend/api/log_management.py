@@ -4,25 +4,59 @@ from starlette.responses import JSONResponse, Response
 from starlette.routing import Mount, Route
 
 from sl_statistics_backend import spec
-from sl_statistics_backend.models import StoredLogList
+from sl_statistics_backend.ingest_jobs import IngestQueueFullError
+from sl_statistics_backend.models import IngestJob, IngestStats, LogDeletion, StoredLogList
 from sl_statistics_backend.schemas import (
-    CountResponse,
     ErrorResponse,
+    IngestJobResponse,
+    LogBatchUpload,
+    LogBatchUploadResult,
     LogDelete,
+    LogDeletionResponse,
     LogUpload,
 )
 from sl_statistics_backend.services import log_management_service
-from sl_statistics_backend.services.log_management_service import LogUploadError
+from sl_statistics_backend.services.log_management_service import LogDeleteError, LogUploadError
 
 
 @spec.validate(
-    form=LogUpload, resp=SpectreeResponse(HTTP_200=CountResponse, HTTP_400=ErrorResponse), tags=["Log file management"]
+    form=LogUpload,
+    resp=SpectreeResponse(
+        HTTP_200=IngestStats, HTTP_202=IngestJobResponse, HTTP_400=ErrorResponse, HTTP_503=ErrorResponse
+    ),
+    tags=["Log file management"],
 )
 async def upload_log(request: Request) -> Response:
     form_data = await request.form()
     try:
-        count = await log_management_service.upload_log(form_data)
-        return JSONResponse({"count": count})
+        result = await log_management_service.upload_log(form_data)
+    except LogUploadError as e:
+        return JSONResponse({"errors": [e.message]}, status_code=400)
+    except IngestQueueFullError as e:
+        return JSONResponse({"errors": [e.message]}, status_code=503, headers={"Retry-After": "30"})
+    if isinstance(result, IngestJob):
+        return JSONResponse({"job_id": result.job_id}, status_code=202)
+    return JSONResponse(result.dict())
+
+
+@spec.validate(resp=SpectreeResponse(HTTP_200=IngestJob, HTTP_404=ErrorResponse), tags=["Log file management"])
+async def upload_job_status(request: Request) -> Response:
+    job = log_management_service.get_ingest_job(request.path_params["job_id"])
+    if job is None:
+        return JSONResponse({"errors": ["Unknown upload job"]}, status_code=404)
+    return Response(job.json(), media_type="application/json")
+
+
+@spec.validate(
+    form=LogBatchUpload,
+    resp=SpectreeResponse(HTTP_200=LogBatchUploadResult, HTTP_400=ErrorResponse),
+    tags=["Log file management"],
+)
+async def upload_log_batch(request: Request) -> Response:
+    form_data = await request.form()
+    try:
+        result = await log_management_service.upload_log_batch(form_data)
+        return JSONResponse(result.dict())
     except LogUploadError as e:
         return JSONResponse({"errors": [e.message]}, status_code=400)
 
@@ -32,11 +66,26 @@ async def list_logs(_: Request) -> Response:
     return Response((await log_management_service.list_log_files()).json(), media_type="application/json")
 
 
-@spec.validate(json=LogDelete, resp=SpectreeResponse(HTTP_200=CountResponse), tags=["Log file management"])
+@spec.validate(
+    json=LogDelete,
+    resp=SpectreeResponse(HTTP_202=LogDeletionResponse, HTTP_404=ErrorResponse),
+    tags=["Log file management"],
+)
 async def delete_log(request: Request) -> Response:
     data = await request.json()
-    count = await log_management_service.delete_log_file(data)
-    return JSONResponse({"count": count})
+    try:
+        task_id = await log_management_service.delete_log_file(data)
+    except LogDeleteError as e:
+        return JSONResponse({"errors": [e.message]}, status_code=404)
+    return JSONResponse({"task_id": task_id}, status_code=202)
+
+
+@spec.validate(resp=SpectreeResponse(HTTP_200=LogDeletion, HTTP_404=ErrorResponse), tags=["Log file management"])
+async def log_deletion_status(request: Request) -> Response:
+    deletion = await log_management_service.get_log_deletion(request.path_params["task_id"])
+    if deletion is None:
+        return JSONResponse({"errors": ["Unknown deletion task"]}, status_code=404)
+    return Response(deletion.json(), media_type="application/json")
 
 
 LogManagementMount = Mount(
@@ -44,6 +93,9 @@ LogManagementMount = Mount(
     routes=[
         Route("/log", upload_log, methods=["PUT"]),
         Route("/log", delete_log, methods=["DELETE"]),
+        Route("/log_batch", upload_log_batch, methods=["PUT"]),
+        Route("/log/jobs/{job_id}", upload_job_status),
+        Route("/log/deletions/{task_id}", log_deletion_status),
         Route("/log_list", list_logs),
     ],
 )
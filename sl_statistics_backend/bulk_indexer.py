@@ -0,0 +1,144 @@
+from asyncio import FIRST_COMPLETED, Task, create_task, gather, sleep, wait
+from collections.abc import AsyncIterable, AsyncIterator, Callable
+from itertools import count
+from time import perf_counter
+from typing import Any
+
+from elasticsearch import ApiError, AsyncElasticsearch, ConnectionTimeout
+from elasticsearch.helpers import BulkIndexError
+from typing_extensions import Self
+
+from sl_statistics_backend.models import IngestStats
+
+_TOO_MANY_REQUESTS = 429
+# errors of single documents telling that ElasticSearch can't keep up (sent back with a 429 status)
+_OVERLOAD_ERRORS = {"es_rejected_execution_exception", "circuit_breaking_exception"}
+# a document created with the same ID by an earlier attempt
+_CONFLICT_ERROR = "version_conflict_engine_exception"
+
+
+def _error_type(item: dict[str, Any]) -> str:
+    return next(iter(item.values()))["error"]["type"]
+
+
+def is_overloaded(error: BaseException) -> bool:
+    """Whether `error` comes from ElasticSearch being overloaded, rather than from the documents themselves."""
+    if isinstance(error, ConnectionTimeout):
+        return True
+    if isinstance(error, ApiError):
+        return error.meta.status == _TOO_MANY_REQUESTS
+    if isinstance(error, BulkIndexError):
+        return all(_error_type(item) in _OVERLOAD_ERRORS for item in error.errors)
+    return False
+
+
+def _check_response(response: Any) -> None:  # noqa: ANN401
+    if not response["errors"]:
+        return
+    errors = [
+        item
+        for item in response["items"]
+        if "error" in next(iter(item.values())) and _error_type(item) != _CONFLICT_ERROR
+    ]
+    if errors:
+        raise BulkIndexError(f"{len(errors)} document(s) failed to index.", errors)
+
+
+class BulkIndexer:
+    """Sends bulk requests of at most `chunk_size` actions / `max_chunk_bytes` bytes, `max_concurrency` at a time.
+
+    Actions come already encoded as NDJSON (metadata and optional source lines), in batches. They're expected to
+    `create` documents with fixed IDs: a request that is rejected or times out while ElasticSearch is overloaded is
+    sent again (up to `max_retries` times, backing off exponentially), and only stores the documents still missing.
+    """
+
+    elastic: AsyncElasticsearch
+    chunk_size: int
+    max_chunk_bytes: int
+    max_concurrency: int
+    max_retries: int
+    initial_backoff: float
+    max_backoff: float
+
+    def __init__(  # noqa: PLR0913
+        self: Self,
+        elastic: AsyncElasticsearch,
+        chunk_size: int = 1000,
+        max_chunk_bytes: int = 10 * 1024 * 1024,
+        max_concurrency: int = 4,
+        max_retries: int = 3,
+        initial_backoff: float = 1,
+        max_backoff: float = 30,
+    ) -> None:
+        self.elastic = elastic
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+
+    async def _chunks(self: Self, action_batches: AsyncIterable[list[bytes]]) -> AsyncIterator[tuple[list[bytes], int]]:
+        chunk: list[bytes] = []
+        chunk_bytes = 0
+        async for actions in action_batches:
+            for action in actions:
+                if chunk and (len(chunk) >= self.chunk_size or chunk_bytes + len(action) > self.max_chunk_bytes):
+                    yield chunk, chunk_bytes
+                    chunk, chunk_bytes = [], 0
+                chunk.append(action)
+                chunk_bytes += len(action)
+        if chunk:
+            yield chunk, chunk_bytes
+
+    async def _send(
+        self: Self,
+        chunk: list[bytes],
+        on_indexed: Callable[[int], None] | None,
+        wait_for_refresh: bool,
+        is_counted: Callable[[bytes], bool] | None,
+    ) -> int:
+        for attempt in count():
+            try:
+                # only errors are sent back, rather than a full report for each of the indexed documents
+                response = await self.elastic.bulk(
+                    operations=chunk,
+                    filter_path=["errors", "items.*.error"],
+                    refresh="wait_for" if wait_for_refresh else None,
+                )
+                _check_response(response)
+                break
+            except Exception as e:
+                if attempt >= self.max_retries or not is_overloaded(e):
+                    raise
+            await sleep(min(self.initial_backoff * 2**attempt, self.max_backoff))
+        if on_indexed is not None:
+            on_indexed(len(chunk) if is_counted is None else sum(1 for action in chunk if is_counted(action)))
+        return len(chunk)
+
+    async def index(
+        self: Self,
+        action_batches: AsyncIterable[list[bytes]],
+        on_indexed: Callable[[int], None] | None = None,
+        wait_for_refresh: bool = False,
+        is_counted: Callable[[bytes], bool] | None = None,
+    ) -> IngestStats:
+        # with `wait_for_refresh`, each request only returns once its documents can be searched. `on_indexed` is
+        # told how many actions each request indexed, only counting those `is_counted` accepts (if given)
+        start = perf_counter()
+        count = 0
+        size_bytes = 0
+        in_flight: set[Task[int]] = set()
+        try:
+            async for chunk, chunk_bytes in self._chunks(action_batches):
+                if len(in_flight) >= self.max_concurrency:
+                    done, in_flight = await wait(in_flight, return_when=FIRST_COMPLETED)
+                    count += sum(task.result() for task in done)
+                in_flight.add(create_task(self._send(chunk, on_indexed, wait_for_refresh, is_counted)))
+                size_bytes += chunk_bytes
+            count += sum(await gather(*in_flight))
+        except BaseException:
+            # let the requests already sent complete, so that callers can reliably clean up after a failure
+            await gather(*in_flight, return_exceptions=True)
+            raise
+        return IngestStats.from_measurements(count, size_bytes, perf_counter() - start)
@@ -0,0 +1,79 @@
+from asyncio import Lock
+from collections import Counter
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Any
+
+from elasticsearch import AsyncElasticsearch
+from typing_extensions import Self
+
+_REFRESH_INTERVAL = "index.refresh_interval"
+_REPLICAS = "index.number_of_replicas"
+
+
+class BulkLoadSettings:
+    """Turns off periodic refreshes (and optionally replicas) of the indices uploads are writing to.
+
+    Settings are changed when the first upload starts writing to an index and restored when the last one is done, and
+    only the settings actually changed here are restored: an index already loading in another process is left alone.
+    """
+
+    elastic: AsyncElasticsearch
+    disable_refresh: bool
+    disable_replicas: bool
+    _users: Counter[str]
+    _restore: dict[str, dict[str, dict[str, Any]]]
+    _lock: Lock
+
+    def __init__(
+        self: Self, elastic: AsyncElasticsearch, disable_refresh: bool = True, disable_replicas: bool = False
+    ) -> None:
+        self.elastic = elastic
+        self.disable_refresh = disable_refresh
+        self.disable_replicas = disable_replicas
+        self._users = Counter()
+        self._restore = {}
+        self._lock = Lock()
+
+    async def _disable(self: Self, index: str) -> dict[str, dict[str, Any]]:
+        # `index` may be a pattern, so the settings to restore are kept for each of the indices it matches
+        response = await self.elastic.indices.get_settings(index=index, flat_settings=True)
+        restore = {}
+        for name in response:
+            settings = response[name]["settings"]
+            # settings missing from the response have their default value, which is restored by setting them to None
+            changes = {}
+            if self.disable_refresh and settings.get(_REFRESH_INTERVAL) != "-1":
+                changes[_REFRESH_INTERVAL] = "-1"
+            if self.disable_replicas and settings.get(_REPLICAS) != "0":
+                changes[_REPLICAS] = "0"
+            if changes:
+                await self.elastic.indices.put_settings(index=name, settings=changes)
+                restore[name] = {setting: settings.get(setting) for setting in changes}
+        return restore
+
+    async def _enable(self: Self, restore: dict[str, dict[str, Any]]) -> None:
+        for name, settings in restore.items():
+            try:
+                await self.elastic.indices.put_settings(index=name, settings=settings)
+            except Exception as e:  # the upload itself went fine
+                print(f"couldn't restore the settings of {name}: {e!r}")
+
+    @asynccontextmanager
+    async def apply(self: Self, indices: list[str]) -> AsyncIterator[None]:
+        applied = []
+        try:
+            async with self._lock:
+                for index in indices:
+                    if not self._users[index]:
+                        self._restore[index] = await self._disable(index)
+                    self._users[index] += 1
+                    applied.append(index)
+            yield
+        finally:
+            async with self._lock:
+                for index in applied:
+                    self._users[index] -= 1
+                    if not self._users[index]:
+                        del self._users[index]
+                        await self._enable(self._restore.pop(index))
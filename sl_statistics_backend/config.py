@@ -6,3 +6,32 @@ config = Config(".env")
 DEBUG = config("DEBUG", cast=bool, default=False)
 DISABLE_CORS = config("DISABLE_CORS", cast=bool, default=False)
 ELASTICSEARCH_URL = config("ELASTICSEARCH_URL", cast=URL)
+UPLOAD_CHUNK_SIZE = config("UPLOAD_CHUNK_SIZE", cast=int, default=1024 * 1024)
+BULK_CHUNK_SIZE = config("BULK_CHUNK_SIZE", cast=int, default=1000)
+BULK_MAX_CHUNK_BYTES = config("BULK_MAX_CHUNK_BYTES", cast=int, default=10 * 1024 * 1024)
+BULK_MAX_CONCURRENCY = config("BULK_MAX_CONCURRENCY", cast=int, default=4)
+# bulk requests rejected (429) or timed out are sent again this many times, waiting twice as long each time
+BULK_MAX_RETRIES = config("BULK_MAX_RETRIES", cast=int, default=3)
+BULK_INITIAL_BACKOFF = config("BULK_INITIAL_BACKOFF", cast=float, default=1)
+# buckets per page of composite aggregations, and partitions fetched concurrently by full scans (the backfills)
+COMPOSITE_PAGE_SIZE = config("COMPOSITE_PAGE_SIZE", cast=int, default=1000)
+COMPOSITE_PARTITIONS = config("COMPOSITE_PARTITIONS", cast=int, default=1)
+PARSER_POOL_SIZE = config("PARSER_POOL_SIZE", cast=int, default=2)
+INGEST_JOB_CONCURRENCY = config("INGEST_JOB_CONCURRENCY", cast=int, default=2)
+INGEST_JOB_QUEUE_SIZE = config("INGEST_JOB_QUEUE_SIZE", cast=int, default=16)
+# logs claimed by an upload for this many seconds without being stored are from killed uploads, and are reclaimed
+UPLOAD_CLAIM_TIMEOUT = config("UPLOAD_CLAIM_TIMEOUT", cast=float, default=3600)
+# normalize timestamps with the `smartlog-pipeline` ingest pipeline instead of doing it before indexing
+INGEST_USE_PIPELINE = config("INGEST_USE_PIPELINE", cast=bool, default=False)
+# stop refreshing (and replicating, with INGEST_DISABLE_REPLICAS) the indices being written to while uploading
+INGEST_DISABLE_REFRESH = config("INGEST_DISABLE_REFRESH", cast=bool, default=False)
+INGEST_DISABLE_REPLICAS = config("INGEST_DISABLE_REPLICAS", cast=bool, default=False)
+# uploads are made searchable by an "explicit" refresh, or "wait_for" the next scheduled one (not with the above)
+INGEST_REFRESH = config("INGEST_REFRESH", default="explicit")
+# "single" stores all the log entries in one index, "file" each log in its own, "month" each month (see `IndexLayout`)
+INDEX_LAYOUT = config("INDEX_LAYOUT", default="single")
+# results of chart and aggregation queries are cached for QUERY_CACHE_TTL seconds, or until logs are added or removed
+QUERY_CACHE_SIZE = config("QUERY_CACHE_SIZE", cast=int, default=1024)
+QUERY_CACHE_TTL = config("QUERY_CACHE_TTL", cast=float, default=300)
+# SQLite database shared by all the worker processes caching query results, in memory and per process if empty
+QUERY_CACHE_PATH = config("QUERY_CACHE_PATH", default="")
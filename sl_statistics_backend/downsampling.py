@@ -0,0 +1,70 @@
+from enum import Enum
+
+import numpy as np
+import numpy.typing as npt
+
+# LTTB always keeps the first and the last point, and needs at least one bucket in between
+MIN_POINTS = 3
+
+
+def max_buckets(values: npt.ArrayLike, points: int) -> npt.NDArray[np.intp]:
+    """Indices of the largest of `values` in each of `points` runs of consecutive values, so that no peak is lost.
+
+    Ties go to the first value of the run. All the indices are returned if there are no more than `points` values.
+    """
+    values = np.asarray(values)
+    if len(values) <= points:
+        return np.arange(len(values))
+    starts = np.linspace(0, len(values), points, endpoint=False).astype(np.intp)
+    runs = np.repeat(np.arange(points), np.diff(starts, append=len(values)))
+    # sorted by run and then by decreasing value (stably), the first of each run is its largest value
+    order = np.lexsort((-values, runs))
+    return order[starts]
+
+
+def lttb(x: npt.ArrayLike, y: npt.ArrayLike, points: int) -> npt.NDArray[np.intp]:
+    """Indices of the `points` points of the line `(x, y)` picked by Largest-Triangle-Three-Buckets.
+
+    The points in between the first and the last one are split into `points - 2` buckets, and the point kept from each
+    bucket is the one making the largest triangle with the point kept from the previous bucket and the average of the
+    next one, which keeps the shape of the line. All the indices are returned if there are no more than `points` points.
+    """
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    if points < MIN_POINTS:
+        raise ValueError(f"LTTB needs at least {MIN_POINTS} points, not {points}")
+    if len(y) <= points:
+        return np.arange(len(y))
+    edges = np.linspace(1, len(y) - 1, points - 1).astype(np.intp)
+    sizes = np.diff(edges)
+    # averages of all the buckets at once, and the last point acting as the bucket after the last one
+    avg_x = np.append(np.add.reduceat(x[: edges[-1]], edges[:-1]) / sizes, x[-1])
+    avg_y = np.append(np.add.reduceat(y[: edges[-1]], edges[:-1]) / sizes, y[-1])
+    selected = np.empty(points, dtype=np.intp)
+    selected[0], selected[-1] = 0, len(y) - 1
+    previous = 0
+    # each bucket depends on the point picked from the one before, so only the bucket itself is vectorized
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        areas = np.abs(
+            (x[previous] - avg_x[bucket + 1]) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (avg_y[bucket + 1] - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+
+class Downsampling(str, Enum):
+    """How values are picked when there are more of them than can be shown."""
+
+    # the largest of each run of values, so that peaks always show
+    MAX = "max"
+    # Largest-Triangle-Three-Buckets, so that the line keeps its shape
+    LTTB = "lttb"
+
+
+def downsample(values: npt.ArrayLike, points: int, method: Downsampling = Downsampling.MAX) -> npt.NDArray[np.intp]:
+    """Indices of the (at most) `points` of `values`, evenly spaced, picked by `method`."""
+    if method == Downsampling.LTTB:
+        return lttb(np.arange(len(np.asarray(values))), values, points)
+    return max_buckets(values, points)
@@ -0,0 +1,21 @@
+import asyncio
+from collections.abc import Callable
+from typing import Any
+
+from elasticsearch import AsyncElasticsearch
+
+
+async def wait_for_task(
+    elastic: AsyncElasticsearch,
+    task_id: str,
+    poll_interval: float = 5,
+    report: Callable[[dict[str, Any]], None] | None = None,
+) -> dict[str, Any]:
+    """Polls the ElasticSearch task `task_id` until it completes, passing its status to `report` meanwhile."""
+    while True:
+        task = await elastic.tasks.get(task_id=task_id)
+        if task["completed"]:
+            return task
+        if report is not None:
+            report(task["task"]["status"])
+        await asyncio.sleep(poll_interval)
@@ -0,0 +1,56 @@
+from typing import Any
+
+from elasticsearch import AsyncElasticsearch, NotFoundError
+
+# bumped whenever `DATA_MAPPINGS` or `DATA_SETTINGS` change, so that `index_migration` can move the entries over
+DATA_MAPPING_VERSION = 2
+
+DATA_MAPPINGS: dict[str, Any] = {
+    "_meta": {"version": DATA_MAPPING_VERSION},
+    "properties": {
+        "@timestamp": {"type": "date_nanos"},
+        "append_id": {"type": "keyword"},
+        # filtered and aggregated by every chart, so their ordinals are built on refresh rather than on first query
+        "code": {"type": "keyword", "eager_global_ordinals": True},
+        # only ever shown, never searched
+        "description": {"type": "text", "index": False},
+        "file": {"type": "keyword"},
+        "ini_filename": {"type": "keyword", "eager_global_ordinals": True},
+        "subunit": {"type": "long"},
+        "timestamp": {"type": "date_nanos", "format": "iso8601"},
+        "type_um": {"type": "keyword"},
+        "unit": {"type": "long"},
+        "unit_subunit_id": {"type": "long"},
+        "value": {"type": "keyword"},
+    },
+}
+
+# entries are always read by time range, so keeping segments sorted by time lets searches skip most of them
+DATA_SETTINGS: dict[str, Any] = {"index": {"sort.field": "@timestamp", "sort.order": "desc"}}
+
+# the BIN events turning ON, which are all that charts look at, with just the fields they filter and aggregate on
+EVENTS_MAPPINGS: dict[str, Any] = {
+    "properties": {
+        "@timestamp": {"type": "date_nanos"},
+        "append_id": {"type": "keyword"},
+        "code": {"type": "keyword", "eager_global_ordinals": True},
+        "file": {"type": "keyword"},
+        "ini_filename": {"type": "keyword", "eager_global_ordinals": True},
+        "unit_subunit_id": {"type": "long"},
+    },
+}
+
+EVENTS_SETTINGS: dict[str, Any] = DATA_SETTINGS
+
+
+async def mapping_version(elastic: AsyncElasticsearch, index: str) -> int | None:
+    """Version of the mappings of `index` (an index, alias or pattern), None if it doesn't exist.
+
+    Indices created before mappings were versioned are version 1; with several indices, the oldest version is returned.
+    """
+    try:
+        mappings = await elastic.indices.get_mapping(index=index, allow_no_indices=False)
+    except NotFoundError:
+        return None
+    versions = [mappings[name]["mappings"].get("_meta", {}).get("version", 1) for name in mappings]
+    return min(versions, default=None)
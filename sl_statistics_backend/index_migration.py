@@ -0,0 +1,159 @@
+import argparse
+import asyncio
+from collections.abc import Callable
+from typing import Any
+
+from elasticsearch import AsyncElasticsearch
+from typing_extensions import Self
+
+from sl_statistics_backend import config
+from sl_statistics_backend.bulk_indexer import BulkIndexer
+from sl_statistics_backend.elastic_tasks import wait_for_task
+from sl_statistics_backend.index_mappings import DATA_MAPPING_VERSION, DATA_MAPPINGS, DATA_SETTINGS, mapping_version
+from sl_statistics_backend.log_database import IndexLayout, LogDatabase
+
+
+class IndexMigrationError(Exception):
+    message: str
+
+    def __init__(self: Self, message: str, *args: object) -> None:
+        super().__init__(*args)
+        self.message = message
+
+
+def _check_reindexed(result: dict[str, Any]) -> None:
+    if "error" in result or result["response"]["failures"]:
+        raise IndexMigrationError(f"reindexing failed: {result.get('error') or result['response']['failures'][0]}")
+
+
+async def migrate(
+    elastic: AsyncElasticsearch,
+    index: str,
+    requests_per_second: float | None = None,
+    poll_interval: float = 5,
+    report: Callable[[str], None] = print,
+) -> bool:
+    """Moves the entries in `index` to a new index with the current mappings, which then takes over its name.
+
+    The entries are reindexed in the background (throttled to `requests_per_second`, if given) and the new index
+    replaces the old one through an alias, in a single step. Searches keep working throughout, while uploads fail until
+    the migration is over: the old index is made read-only, so that no entries get lost in the switch.
+
+    Returns False if `index` was already up to date.
+    """
+    version = await mapping_version(elastic, index)
+    if version is None:
+        raise IndexMigrationError(f"{index} doesn't exist")
+    if version >= DATA_MAPPING_VERSION:
+        return False
+    # `index` is the index itself the first time, and an alias of the index holding the entries afterwards
+    sources = list(await elastic.indices.get(index=index))
+    if len(sources) != 1:
+        raise IndexMigrationError(f"{index} points to several indices: {', '.join(sources)}")
+    source = sources[0]
+    target = f"{index}-v{DATA_MAPPING_VERSION}"
+    report(f"migrating {source} (version {version}) to {target}")
+
+    settings = await elastic.indices.get_settings(index=source, name="index.number_of_replicas")
+    replicas = settings[source]["settings"]["index"]["number_of_replicas"]
+    # left behind by a migration that was killed halfway through
+    await elastic.options(ignore_status=404).indices.delete(index=target)
+    # replicas and refreshes only slow the copy down, they're restored once it's done
+    await elastic.indices.create(
+        index=target,
+        mappings=DATA_MAPPINGS,
+        settings={"index": DATA_SETTINGS["index"] | {"number_of_replicas": 0, "refresh_interval": "-1"}},
+    )
+    await elastic.indices.put_settings(index=source, settings={"index.blocks.write": True})
+    task_id = None
+    try:
+        task = await elastic.reindex(
+            source={"index": source},
+            dest={"index": target},
+            wait_for_completion=False,
+            requests_per_second=requests_per_second or -1,
+            slices="auto",
+        )
+        task_id = task["task"]
+        result = await wait_for_task(
+            elastic,
+            task_id,
+            poll_interval,
+            lambda status: report(f"reindexed {status['created']} of {status['total']} entries"),
+        )
+        task_id = None
+        _check_reindexed(result)
+        await elastic.indices.put_settings(
+            index=target, settings={"index": {"number_of_replicas": replicas, "refresh_interval": None}}
+        )
+        await elastic.indices.refresh(index=target)
+        # dropping the old index and pointing its name to the new one is atomic, so searches never miss the entries
+        await elastic.indices.update_aliases(
+            actions=[{"add": {"index": target, "alias": index}}, {"remove_index": {"index": source}}]
+        )
+    except BaseException:
+        if task_id is not None:
+            await elastic.tasks.cancel(task_id=task_id)
+        await elastic.options(ignore_status=404).indices.delete(index=target)
+        await elastic.indices.put_settings(index=source, settings={"index.blocks.write": None})
+        raise
+    report(f"{index} now points to {target}")
+    return True
+
+
+async def _run(index: str, requests_per_second: float | None) -> None:
+    elastic = AsyncElasticsearch(str(config.ELASTICSEARCH_URL), verify_certs=False, ssl_show_warn=False)
+    try:
+        if not await migrate(elastic, index, requests_per_second):
+            print(f"{index} is already up to date")
+    except IndexMigrationError as e:
+        raise SystemExit(e.message) from e
+    finally:
+        await elastic.close()
+
+
+async def _backfill(index: str) -> None:
+    elastic = AsyncElasticsearch(str(config.ELASTICSEARCH_URL), verify_certs=False, ssl_show_warn=False)
+    log_db = LogDatabase(
+        elastic,
+        index,
+        bulk_indexer=BulkIndexer(
+            elastic,
+            chunk_size=config.BULK_CHUNK_SIZE,
+            max_chunk_bytes=config.BULK_MAX_CHUNK_BYTES,
+            max_concurrency=config.BULK_MAX_CONCURRENCY,
+            max_retries=config.BULK_MAX_RETRIES,
+            initial_backoff=config.BULK_INITIAL_BACKOFF,
+        ),
+        index_layout=IndexLayout(config.INDEX_LAYOUT),
+        composite_page_size=config.COMPOSITE_PAGE_SIZE,
+        composite_partitions=config.COMPOSITE_PARTITIONS,
+    )
+    try:
+        if not await log_db.backfill():
+            print("nothing to backfill")
+    finally:
+        await log_db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Migrates the log entries index to the current mappings.")
+    parser.add_argument("--index", default="smartlog", help="name of the index (or alias) to migrate")
+    parser.add_argument("--requests-per-second", type=float, help="throttles reindexing, unlimited by default")
+    parser.add_argument(
+        "--backfill",
+        action="store_true",
+        help="fills the rollup, events and registry indices in with the logs uploaded before they existed instead",
+    )
+    args = parser.parse_args()
+    if args.backfill:
+        asyncio.run(_backfill(args.index))
+        return
+    if config.INDEX_LAYOUT != "single":
+        # with templates, only the indices created from now on get the current mappings
+        raise SystemExit(f"Only the single index layout can be migrated, not {config.INDEX_LAYOUT!r}")
+    asyncio.run(_run(args.index, args.requests_per_second))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+from asyncio import CancelledError, Queue, QueueFull, Task, create_task, gather
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from datetime import datetime
+from uuid import uuid4
+
+from typing_extensions import Self
+
+from sl_statistics_backend.models import IngestJob, IngestJobStatus, IngestStats
+
+JobRunner = Callable[[IngestJob], Awaitable[IngestStats]]
+
+
+class IngestQueueFullError(Exception):
+    message: str
+
+    def __init__(self: Self, message: str, *args: object) -> None:
+        super().__init__(*args)
+        self.message = message
+
+
+class IngestJobQueue:
+    """In-process queue running at most `concurrency` ingestion jobs at a time, with room for `max_queued` more."""
+
+    concurrency: int
+    max_queued: int
+    max_finished: int
+    _jobs: OrderedDict[str, IngestJob]
+    _queue: Queue[tuple[IngestJob, JobRunner]] | None
+    _workers: list[Task[None]]
+
+    def __init__(self: Self, concurrency: int = 2, max_queued: int = 16, max_finished: int = 1000) -> None:
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+        self.max_finished = max_finished
+        self._jobs = OrderedDict()
+        self._queue = None
+        self._workers = []
+
+    def submit(self: Self, file_name: str, run: JobRunner) -> IngestJob:
+        if self._queue is None:
+            # created on first use, so that both the queue and the workers belong to the running event loop
+            self._queue = Queue(maxsize=self.max_queued)
+            self._workers = [create_task(self._worker()) for _ in range(self.concurrency)]
+        job = IngestJob(job_id=uuid4().hex, file_name=file_name, submitted_at=datetime.now())
+        try:
+            self._queue.put_nowait((job, run))
+        except QueueFull as e:
+            raise IngestQueueFullError("Too many uploads in progress, retry later") from e
+        self._jobs[job.job_id] = job
+        return job
+
+    def get(self: Self, job_id: str) -> IngestJob | None:
+        return self._jobs.get(job_id)
+
+    def _forget_finished(self: Self) -> None:
+        finished = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.status in {IngestJobStatus.COMPLETED, IngestJobStatus.FAILED}
+        ]
+        for job_id in finished[: max(len(finished) - self.max_finished, 0)]:
+            del self._jobs[job_id]
+
+    async def _run(self: Self, job: IngestJob, run: JobRunner) -> None:
+        job.status = IngestJobStatus.RUNNING
+        job.started_at = datetime.now()
+        try:
+            job.stats = await run(job)
+            job.status = IngestJobStatus.COMPLETED
+        except CancelledError:
+            job.errors.append("Upload cancelled")
+            job.status = IngestJobStatus.FAILED
+            raise
+        except Exception as e:
+            job.errors.append(getattr(e, "message", None) or repr(e))
+            job.status = IngestJobStatus.FAILED
+        finally:
+            job.finished_at = datetime.now()
+            self._forget_finished()
+
+    async def _worker(self: Self) -> None:
+        assert self._queue is not None
+        while True:
+            job, run = await self._queue.get()
+            try:
+                await self._run(job, run)
+            finally:
+                self._queue.task_done()
+
+    async def close(self: Self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await gather(*self._workers, return_exceptions=True)
+        self._queue = None
+        self._workers = []
@@ -0,0 +1,74 @@
+import tarfile
+import zipfile
+from pathlib import PurePosixPath
+from typing import IO
+
+from typing_extensions import Self
+
+
+class LogArchiveError(Exception):
+    message: str
+
+    def __init__(self: Self, message: str, *args: object) -> None:
+        super().__init__(*args)
+        self.message = message
+
+
+def _is_log(member_name: str) -> bool:
+    name = PurePosixPath(member_name)
+    # skip metadata like the `__MACOSX/._log.csv` entries added by macOS' archiver
+    return name.suffix.lower() == ".csv" and not name.name.startswith(".") and "__MACOSX" not in name.parts
+
+
+class LogArchive:
+    """Zip or (optionally compressed) tar archive of log files, keyed by the base name of each log.
+
+    Logs named like one earlier in the archive (in another directory) are listed, by path, in `duplicates` instead.
+    """
+
+    _zip: zipfile.ZipFile | None
+    _tar: tarfile.TarFile | None
+    _members: dict[str, str | tarfile.TarInfo]
+    duplicates: list[str]
+
+    def __init__(self: Self, file: IO[bytes]) -> None:
+        self._zip = self._tar = None
+        try:
+            if zipfile.is_zipfile(file):
+                file.seek(0)
+                self._zip = zipfile.ZipFile(file)
+                members: list[tuple[str, str | tarfile.TarInfo]] = [
+                    (info.filename, info.filename) for info in self._zip.infolist() if not info.is_dir()
+                ]
+            else:
+                file.seek(0)
+                self._tar = tarfile.open(fileobj=file, mode="r:*")
+                members = [(info.name, info) for info in self._tar.getmembers() if info.isfile()]
+        except (zipfile.BadZipFile, tarfile.TarError) as e:
+            raise LogArchiveError("Invalid log archive") from e
+        self._members = {}
+        self.duplicates = []
+        for member_name, member in members:
+            if not _is_log(member_name):
+                continue
+            name = PurePosixPath(member_name).name
+            if name in self._members:
+                self.duplicates.append(member_name)
+            else:
+                self._members[name] = member
+
+    @property
+    def names(self: Self) -> list[str]:
+        return list(self._members)
+
+    def open(self: Self, name: str) -> IO[bytes]:
+        member = self._members[name]
+        if self._zip is not None:
+            return self._zip.open(member)  # type: ignore
+        return self._tar.extractfile(member)  # type: ignore
+
+    def close(self: Self) -> None:
+        if self._zip is not None:
+            self._zip.close()
+        if self._tar is not None:
+            self._tar.close()
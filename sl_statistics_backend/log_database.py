@@ -1,25 +1,243 @@
-from asyncio import gather
-from collections.abc import AsyncIterable, Iterable
-from datetime import datetime
+import hashlib
+import math
+import re
+from asyncio import Queue, Semaphore, create_task, gather, shield
+from collections import Counter, defaultdict
+from collections.abc import AsyncIterable, AsyncIterator, Awaitable, Callable
+from contextlib import AsyncExitStack, asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from itertools import pairwise
 from typing import Any
+from uuid import uuid4
 
-from elasticsearch import AsyncElasticsearch
+import numpy as np
+import orjson
+from elasticsearch import AsyncElasticsearch, BadRequestError, ConflictError, NotFoundError
 from elasticsearch._async.client.ingest import IngestClient
-from elasticsearch.helpers import async_bulk
-from sl_parser import LogFile
 from typing_extensions import Self
 
+from sl_statistics_backend.bulk_indexer import BulkIndexer, is_overloaded
+from sl_statistics_backend.bulk_load import BulkLoadSettings
+from sl_statistics_backend.downsampling import Downsampling, downsample
+from sl_statistics_backend.elastic_tasks import wait_for_task
+from sl_statistics_backend.index_mappings import (
+    DATA_MAPPING_VERSION,
+    DATA_MAPPINGS,
+    DATA_SETTINGS,
+    EVENTS_MAPPINGS,
+    EVENTS_SETTINGS,
+    mapping_version,
+)
+from sl_statistics_backend.log_documents import (
+    LOG_TIMEZONE,
+    LogSummary,
+    RollupKey,
+    event_actions,
+    index_actions,
+    registry_document,
+    rollup_actions,
+)
+from sl_statistics_backend.log_stream import LogRecord
 from sl_statistics_backend.models import (
     ChartFilterData,
     HistogramEntry,
+    IngestStats,
+    LogDeletion,
     LogFrequencyEntry,
     LogOverview,
     MaxCountEntry,
     StoredLogFile,
     StoredLogList,
 )
+from sl_statistics_backend.query_cache import QueryCache, cached_query
 
 _max_timestamp = datetime(2100, 12, 31, 23, 59, 59).timestamp() * 1000
+_REGISTRY_PAGE_SIZE = 1000
+_MONTHS_IN_YEAR = 12
+# fields with up to this many distinct values are aggregated in a single `terms` aggregation
+_TERMS_SIZE = 1000
+# `_meta` flag of the companion indices, false until they're filled in with the logs uploaded before they existed
+_BACKFILLED = "backfilled"
+# action of the tasks started by `start_deletion`
+_DELETE_BY_QUERY = "indices:data/write/delete/byquery"
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_INTERVAL_PATTERN = re.compile(r"(\d+)(ms|s|m|h|d)")
+_INTERVAL_UNITS = {
+    "ms": timedelta(milliseconds=1),
+    "s": timedelta(seconds=1),
+    "m": timedelta(minutes=1),
+    "h": timedelta(hours=1),
+    "d": timedelta(days=1),
+}
+# fixed interval histograms are fetched, and cached, in tiles of this many buckets, a few tiles at a time
+_TILE_BUCKETS = 1000
+_TILE_CONCURRENCY = 4
+# finer intervals are widened to a multiple of themselves, so that a histogram never has many more buckets than this
+_MAX_HISTOGRAM_BUCKETS = 50_000
+
+
+class IndexLayout(str, Enum):
+    """How the log entries are spread over ElasticSearch indices."""
+
+    # all of them in the `<index_name>` index
+    SINGLE = "single"
+    # each log in its own `<index_name>-data-<file>` index, so that deleting a log just drops its index
+    FILE = "file"
+    # each month of entries in its own `<index_name>-data-<yyyy.mm>` index, so that queries only search their range
+    MONTH = "month"
+
+
+def _file_index_key(file_name: str) -> str:
+    # index names are lowercase and can't contain most punctuation, so a hash tells apart names that look the same
+    slug = re.sub(r"[^a-z0-9]+", "-", file_name.lower()).strip("-")[:64]
+    return f"{slug}-{hashlib.sha1(file_name.encode()).hexdigest()[:8]}"
+
+
+def _utc(timestamp: datetime) -> datetime:
+    # like ElasticSearch does, naive datetimes are taken as UTC
+    return timestamp.astimezone(timezone.utc) if timestamp.tzinfo else timestamp.replace(tzinfo=timezone.utc)
+
+
+def _local_datetime(timestamp: str) -> datetime:
+    return datetime.fromtimestamp(datetime.fromisoformat(timestamp).timestamp())
+
+
+def _utc_isoformat(epoch_millis: float) -> str:
+    return datetime.fromtimestamp(epoch_millis / 1000, timezone.utc).isoformat()
+
+
+def _log_datetime(timestamp: str) -> datetime:
+    # naive log time, like the parsed records', of a stored `@timestamp`
+    return datetime.fromisoformat(timestamp).astimezone(LOG_TIMEZONE).replace(tzinfo=None)
+
+
+async def _newer_records(
+    record_batches: AsyncIterable[list[LogRecord]], last_timestamp: datetime, stored_at_last: int
+) -> AsyncIterator[list[LogRecord]]:
+    """Records of a newer copy of a log that aren't stored yet.
+
+    Logs are written newest first, so those are the records before `last_timestamp`, the newest one stored, plus the
+    ones at `last_timestamp` exceeding the `stored_at_last` already stored. Reading stops at the first older record.
+    """
+    at_last: list[LogRecord] = []
+    async for batch in record_batches:
+        newer = [record for record in batch if record.timestamp > last_timestamp]
+        if newer:
+            yield newer
+        at_last += [record for record in batch if record.timestamp == last_timestamp]
+        if any(record.timestamp < last_timestamp for record in batch):
+            break
+    if len(at_last) > stored_at_last:
+        yield at_last[: len(at_last) - stored_at_last]
+
+
+def _split_time_range(start: datetime, end: datetime) -> tuple[dict[str, Any], dict[str, Any] | None]:
+    """Splits `start`-`end` into the partial hours at its edges and the whole hours in between.
+
+    Returns the `@timestamp` queries for the raw entries at the edges and for the hourly rollups (None if there aren't
+    any whole hours).
+    """
+    start, end = _utc(start), _utc(end)
+    first_hour = start.replace(minute=0, second=0, microsecond=0)
+    if first_hour < start:
+        first_hour += timedelta(hours=1)
+    last_hour = end.replace(minute=0, second=0, microsecond=0)
+    if first_hour >= last_hour:
+        return {"range": {"@timestamp": {"gte": start.isoformat(), "lte": end.isoformat()}}}, None
+    edges = {
+        "bool": {
+            "should": [
+                {"range": {"@timestamp": {"gte": start.isoformat(), "lt": first_hour.isoformat()}}},
+                {"range": {"@timestamp": {"gte": last_hour.isoformat(), "lte": end.isoformat()}}},
+            ]
+        }
+    }
+    return edges, {"range": {"@timestamp": {"gte": first_hour.isoformat(), "lt": last_hour.isoformat()}}}
+
+
+def _entry_stats(stats: IngestStats, entry_count: int) -> IngestStats:
+    # the bulk requests also carry a copy of each event, which shouldn't count as an entry of the log
+    return IngestStats.from_measurements(entry_count, stats.size_bytes, stats.elapsed_seconds)
+
+
+def _months_between(start: datetime, end: datetime) -> list[tuple[int, int]]:
+    # months of log time (see `_split_time_range` about naive datetimes) overlapping `start`-`end`
+    start, end = _utc(start).astimezone(LOG_TIMEZONE), _utc(end).astimezone(LOG_TIMEZONE)
+    return [
+        (month // 12, month % 12 + 1) for month in range(start.year * 12 + start.month - 1, end.year * 12 + end.month)
+    ]
+
+
+def _range_partitions(field: str, splits: list[Any]) -> list[dict[str, Any]]:
+    # splits documents by ranges of the values of `field` between `splits`: keyword ranges are looked up in the terms
+    # dictionary, rather than checked document by document
+    if not splits:
+        return []
+    return [
+        {"range": {field: ({"gte": low} if low is not None else {}) | ({"lt": high} if high is not None else {})}}
+        for low, high in pairwise([None, *splits, None])
+    ]
+
+
+def _code_counts(codes: list[str]) -> dict[str, Any]:
+    # counts of `codes` within each histogram bucket
+    return {
+        "filtered": {
+            # `or 1` is needed to prevent Elastic complaining about failed query parsing in
+            # case `codes` is empty (0 isn't a valid size)
+            "aggs": {"code": {"terms": {"field": "code", "size": len(codes) or 1}}},
+            "filter": {"terms": {"code": codes}},
+        },
+    }
+
+
+def _histogram_entries(buckets: list[Any], codes: list[str]) -> list[HistogramEntry]:
+    default_zero = {code: "0" for code in codes}
+    return [
+        (
+            {"timestamp": bucket["key_as_string"], "total": bucket["doc_count"]}
+            | default_zero
+            | {code["key"]: code["doc_count"] for code in bucket["filtered"]["code"]["buckets"]}
+        )
+        for bucket in buckets
+    ]
+
+
+def parse_interval(interval: str) -> timedelta:
+    """Width of a fixed `interval`, written like ElasticSearch's `fixed_interval` (`<count><ms|s|m|h|d>`)."""
+    match = _INTERVAL_PATTERN.fullmatch(interval)
+    if match is None or int(match[1]) == 0:
+        raise ValueError(f"invalid interval: {interval!r}")
+    return int(match[1]) * _INTERVAL_UNITS[match[2]]
+
+
+def _epoch_millis(timestamp: datetime) -> int:
+    return (timestamp - _EPOCH) // timedelta(milliseconds=1)
+
+
+def _histogram_tiles(start: datetime, end: datetime, interval: timedelta) -> list[tuple[datetime, datetime, bool]]:
+    """Splits `start`-`end` along the tiles of `_TILE_BUCKETS` buckets `interval` wide, aligned to the epoch.
+
+    Returns the part of `start`-`end` within each tile, and whether it's closed (it ends at `end`, included).
+    """
+    width = interval * _TILE_BUCKETS
+    tile = _EPOCH + (start - _EPOCH) // width * width
+    tiles = []
+    while tile <= end:
+        tiles.append((max(tile, start), min(tile + width, end), tile + width > end))
+        tile += width
+    return tiles
+
+
+def _filtered(query: dict[str, Any] | None, filters: list[dict[str, Any]] | None) -> dict[str, Any] | None:
+    if not filters:
+        return query
+    return {"bool": {"must": [query] if query is not None else [], "filter": filters}}
+
+
+async def _collect(pages: AsyncIterator[list[Any]]) -> list[Any]:
+    return [bucket async for page in pages for bucket in page]
 
 
 class LogDatabaseError(Exception):
@@ -33,39 +251,117 @@ class LogDatabaseError(Exception):
 class LogDatabase:
     elastic: AsyncElasticsearch
     index_name: str
+    rollup_index_name: str
+    events_index_name: str
+    registry_index_name: str
+    index_layout: IndexLayout
+    bulk_indexer: BulkIndexer
+    use_pipeline: bool
+    query_cache: QueryCache | None
+    bulk_load: BulkLoadSettings | None
+    wait_for_refresh: bool
+    composite_page_size: int
+    composite_partitions: int
+    stale_claim_timeout: timedelta
     _pipeline_name: str
+    _events_action_prefix: bytes
     _index_exists: bool
 
-    def __init__(self: Self, elastic: AsyncElasticsearch, index_name: str = "smartlog") -> None:
+    def __init__(  # noqa: PLR0913
+        self: Self,
+        elastic: AsyncElasticsearch,
+        index_name: str = "smartlog",
+        bulk_indexer: BulkIndexer | None = None,
+        use_pipeline: bool = False,
+        query_cache: QueryCache | None = None,
+        index_layout: IndexLayout = IndexLayout.SINGLE,
+        bulk_load: BulkLoadSettings | None = None,
+        wait_for_refresh: bool = False,
+        composite_page_size: int = 1000,
+        composite_partitions: int = 1,
+        stale_claim_timeout: timedelta = timedelta(hours=1),
+    ) -> None:
+        if wait_for_refresh and bulk_load is not None and bulk_load.disable_refresh:
+            raise ValueError("Uploads can't wait for refreshes while refreshes are disabled")
         self.elastic = elastic
         self.index_name = index_name
+        self.rollup_index_name = index_name + "-rollup"
+        self.events_index_name = index_name + "-events"
+        self.registry_index_name = index_name + "-files"
+        self.index_layout = index_layout
+        self.bulk_indexer = bulk_indexer or BulkIndexer(elastic)
+        self.use_pipeline = use_pipeline
+        self.query_cache = query_cache
+        self.bulk_load = bulk_load
+        self.wait_for_refresh = wait_for_refresh
+        self.composite_page_size = composite_page_size
+        # full scans of the entries (the backfills) split their composite aggregations into this many partitions
+        self.composite_partitions = composite_partitions
+        # logs claimed by an upload for longer than this without being stored are from uploads killed on the way
+        self.stale_claim_timeout = stale_claim_timeout
         self._pipeline_name = index_name + "-pipeline"
+        self._events_action_prefix = orjson.dumps({"create": {"_index": self.events_index_name}})[:-2] + b","
         self._index_exists = False
 
+    @property
+    def data_indices(self: Self) -> str:
+        """Index, or pattern of the indices, holding the entries of all the logs."""
+        if self.index_layout is IndexLayout.SINGLE:
+            return self.index_name
+        return self.index_name + "-data-*"
+
+    def _data_index(self: Self, file_name: str) -> str:
+        # index (or pattern of the indices) holding the entries of `file_name`
+        if self.index_layout is IndexLayout.FILE:
+            return f"{self.index_name}-data-{_file_index_key(file_name)}"
+        return self.data_indices
+
+    def _month_index(self: Self, year: int, month: int) -> str:
+        return f"{self.index_name}-data-{year:04}.{month:02}"
+
+    def _search_indices(self: Self, start: datetime, end: datetime) -> str:
+        """Indices holding the entries between `start` and `end`: only the monthly ones in range with `MONTH`."""
+        if self.index_layout is not IndexLayout.MONTH:
+            return self.data_indices
+        months = _months_between(start, end)
+        years = Counter(year for year, _ in months)
+        # whole years are searched with a wildcard, to keep the URL short even for ranges spanning decades
+        indices = [f"{self.index_name}-data-{year:04}.*" for year, count in years.items() if count == _MONTHS_IN_YEAR]
+        indices += [self._month_index(year, month) for year, month in months if years[year] < _MONTHS_IN_YEAR]
+        return ",".join(indices)
+
     async def close(self: Self) -> None:
         await self.elastic.close()
 
-    async def ensure_index_exists(self: Self) -> None:
-        if not await self.elastic.indices.exists(index=self.index_name):
+    async def _ensure_data_indices_exist(self: Self) -> bool:
+        # returns whether there were already entries stored
+        if self.index_layout is IndexLayout.SINGLE:
+            if await self.elastic.indices.exists(index=self.index_name):
+                version = await mapping_version(self.elastic, self.index_name)
+                if version is not None and version < DATA_MAPPING_VERSION:
+                    print(
+                        f"{self.index_name} mappings are at version {version} of {DATA_MAPPING_VERSION}, "
+                        "migrate them with `python -m sl_statistics_backend.index_migration`"
+                    )
+                return True
             print("creating index")
-            await self.elastic.indices.create(
-                index=self.index_name,
-                mappings={
-                    "properties": {
-                        "@timestamp": {"type": "date_nanos"},
-                        "code": {"type": "keyword"},
-                        "description": {"type": "text"},
-                        "file": {"type": "keyword"},
-                        "ini_filename": {"type": "keyword"},
-                        "subunit": {"type": "long"},
-                        "timestamp": {"type": "date_nanos", "format": "iso8601"},
-                        "type_um": {"type": "keyword"},
-                        "unit": {"type": "long"},
-                        "unit_subunit_id": {"type": "long"},
-                        "value": {"type": "keyword"},
-                    }
-                },
-            )
+            await self.elastic.indices.create(index=self.index_name, mappings=DATA_MAPPINGS, settings=DATA_SETTINGS)
+            return False
+        index_existed = await self.elastic.indices.exists(index=self.data_indices, allow_no_indices=False)
+        # the indices are created as logs get uploaded, and the template is always updated to the current mappings
+        await self.elastic.indices.put_index_template(
+            name=self.index_name + "-data",
+            index_patterns=[self.data_indices],
+            template={
+                "settings": {"index": DATA_SETTINGS["index"] | {"number_of_shards": 1}},
+                "mappings": DATA_MAPPINGS,
+            },
+        )
+        return index_existed
+
+    async def ensure_index_exists(self: Self) -> None:
+        index_existed = await self._ensure_data_indices_exist()
+        if not index_existed:
             await IngestClient(self.elastic).put_pipeline(
                 id=self._pipeline_name,
                 processors=[
@@ -80,184 +376,1062 @@ class LogDatabase:
                     {"remove": {"field": ["color", "snapshot"]}},
                 ],
             )
+        # with entries already stored, the new indices miss the logs uploaded before they existed until `backfill`
+        # fills them in: that can take a long while, and doesn't belong to the startup of the workers serving requests
+        pending = []
+        if await self._ensure_companion_index(
+            self.rollup_index_name,
+            {
+                "properties": {
+                    "@timestamp": {"type": "date"},
+                    "append_id": {"type": "keyword"},
+                    "code": {"type": "keyword"},
+                    "count": {"type": "long"},
+                    "file": {"type": "keyword"},
+                    "ini_filename": {"type": "keyword"},
+                    "unit_subunit_id": {"type": "long"},
+                }
+            },
+            backfill=index_existed,
+        ):
+            pending.append(self.rollup_index_name)
+        if await self._ensure_companion_index(
+            self.events_index_name, EVENTS_MAPPINGS, EVENTS_SETTINGS, backfill=index_existed
+        ):
+            pending.append(self.events_index_name)
+        if await self._ensure_companion_index(
+            self.registry_index_name,
+            {
+                "properties": {
+                    "content_hash": {"type": "keyword"},
+                    "entry_count": {"type": "long"},
+                    "file": {"type": "keyword"},
+                    "firmwares": {"type": "keyword"},
+                    "first_entry_timestamp": {"type": "date"},
+                    "deleting": {"type": "keyword"},
+                    "interrupted": {"type": "boolean"},
+                    "last_entry_timestamp": {"type": "date"},
+                    "uploaded_at": {"type": "date"},
+                }
+            },
+            backfill=index_existed,
+        ):
+            pending.append(self.registry_index_name)
+        if pending:
+            print(
+                f"{', '.join(pending)} miss the logs already uploaded, "
+                "fill them in with `python -m sl_statistics_backend.index_migration --backfill`"
+            )
 
-    async def _composite_paginate(
-        self: Self, index: str, agg: dict[str, dict[str, Any]], query: dict[str, dict[str, Any]] | None = None
-    ) -> list[Any]:
-        response = await self.elastic.search(index=index, size=0, query=query, aggs={"agg": agg})
-        data = response["aggregations"]["agg"]["buckets"]
-        while "after_key" in response["aggregations"]["agg"]:
-            agg["composite"]["after"] = response["aggregations"]["agg"]["after_key"]
-            response = await self.elastic.search(
-                index=index,
-                size=0,
-                query=query,
-                aggs={"agg": agg},
+    async def _ensure_companion_index(
+        self: Self,
+        index: str,
+        mappings: dict[str, Any],
+        settings: dict[str, Any] | None = None,
+        backfill: bool = False,
+    ) -> bool:
+        # returns whether the index was created needing a backfill, which is marked in its `_meta` until it's done
+        if await self.elastic.indices.exists(index=index):
+            return False
+        print(f"creating {index} index")
+        await self.elastic.indices.create(
+            index=index, mappings=mappings | {"_meta": {_BACKFILLED: not backfill}}, settings=settings
+        )
+        return backfill
+
+    async def drop_indices(self: Self) -> None:
+        """Deletes all the indices of this database (entries, rollups, events and registry), with everything in them."""
+        # wildcard deletions are usually forbidden (`action.destructive_requires_name`), so the names are listed first
+        data_indices = list(await self.elastic.indices.get(index=self.data_indices, ignore_unavailable=True))
+        await self.elastic.indices.delete(
+            index=",".join([*data_indices, self.rollup_index_name, self.events_index_name, self.registry_index_name]),
+            ignore_unavailable=True,
+        )
+        self._data_changed()
+
+    async def pending_backfills(self: Self) -> list[str]:
+        """Companion indices (rollups, events and registry) still missing the logs uploaded before they existed."""
+        indices = [self.rollup_index_name, self.events_index_name, self.registry_index_name]
+        mappings = await self.elastic.indices.get_mapping(index=",".join(indices), ignore_unavailable=True)
+        # indices created before backfills were marked were backfilled when created
+        return [
+            index
+            for index in indices
+            if index in mappings and not mappings[index]["mappings"].get("_meta", {}).get(_BACKFILLED, True)
+        ]
+
+    async def backfill(self: Self, report: Callable[[str], None] = print) -> list[str]:
+        """Fills the companion indices in with the logs uploaded before they existed, returning the ones filled.
+
+        Each index is marked as done only once its backfill succeeds, and backfills can be run again safely, so an
+        interrupted backfill is just run again.
+        """
+        backfills = {
+            self.rollup_index_name: self._backfill_rollups,
+            self.events_index_name: self._backfill_events,
+            self.registry_index_name: self._backfill_registry,
+        }
+        pending = await self.pending_backfills()
+        for index in pending:
+            report(f"backfilling {index}")
+            await backfills[index]()
+            await self.elastic.indices.put_mapping(index=index, meta={_BACKFILLED: True})
+        if pending:
+            self._data_changed()
+        return pending
+
+    async def _backfill_rollups(self: Self) -> None:
+        # rolls up the logs uploaded before the rollup index existed, writing each page of buckets as it arrives
+        events: dict[str, Any] = {
+            "bool": {"must": [{"term": {"type_um": {"value": "BIN"}}}, {"term": {"value": {"value": "ON"}}}]}
+        }
+        # uploads since then write their own rollups (under other IDs), even the ones still running
+        files, append_ids = await self._rolled_up()
+        must_not = [
+            {"terms": {field: values}} for field, values in (("file", files), ("append_id", append_ids)) if values
+        ]
+        if must_not:
+            events["bool"]["must_not"] = must_not
+        pages = self._composite_pages(
+            self.data_indices,
+            {
+                "composite": {
+                    "sources": [
+                        {"file": {"terms": {"field": "file"}}},
+                        {"ini_filename": {"terms": {"field": "ini_filename"}}},
+                        {"code": {"terms": {"field": "code"}}},
+                        {"unit_subunit_id": {"terms": {"field": "unit_subunit_id"}}},
+                        {"@timestamp": {"date_histogram": {"field": "@timestamp", "fixed_interval": "1h"}}},
+                    ],
+                }
+            },
+            events,
+            partitions=await self._key_partitions(self.data_indices, "file", events),
+        )
+
+        async def actions() -> AsyncIterator[list[bytes]]:
+            async for buckets in pages:
+                yield [
+                    # IDs made from the keys, so that requests sent again don't count any events twice
+                    orjson.dumps(
+                        {
+                            "create": {
+                                "_index": self.rollup_index_name,
+                                "_id": hashlib.sha1(orjson.dumps(bucket["key"])).hexdigest(),
+                            }
+                        }
+                    )
+                    + b"\n"
+                    + orjson.dumps(bucket["key"] | {"count": bucket["doc_count"]})
+                    + b"\n"
+                    for bucket in buckets
+                ]
+
+        await self.bulk_indexer.index(actions())
+        await self.elastic.indices.refresh(index=self.rollup_index_name)
+
+    async def _rolled_up(self: Self) -> tuple[list[str], list[str]]:
+        # the logs registered and the appends rolled up since the rollup index was created
+        settings = await self.elastic.indices.get_settings(
+            index=self.rollup_index_name, name="index.creation_date", flat_settings=True
+        )
+        created = _utc_isoformat(int(settings[self.rollup_index_name]["settings"]["index.creation_date"]))
+        files = await _collect(
+            self._composite_pages(
+                self.registry_index_name,
+                {"composite": {"sources": [{"file": {"terms": {"field": "file"}}}]}},
+                {"range": {"uploaded_at": {"gte": created}}},
             )
-            data += response["aggregations"]["agg"]["buckets"]
-        return data
+        )
+        append_ids = await _collect(
+            self._composite_pages(
+                self.rollup_index_name,
+                {"composite": {"sources": [{"append_id": {"terms": {"field": "append_id"}}}]}},
+                {"exists": {"field": "append_id"}},
+            )
+        )
+        return [bucket["key"]["file"] for bucket in files], [bucket["key"]["append_id"] for bucket in append_ids]
 
-    @property
-    async def uploaded_file_list(self: Self) -> StoredLogList:
-        log_files = await self._composite_paginate(
-            self.index_name,
+    async def _backfill_events(self: Self) -> None:
+        # copies the events of the logs uploaded before the events index existed
+        task = await self.elastic.reindex(
+            source={
+                "index": self.data_indices,
+                "query": {
+                    "bool": {"must": [{"term": {"type_um": {"value": "BIN"}}}, {"term": {"value": {"value": "ON"}}}]}
+                },
+                "_source": list(EVENTS_MAPPINGS["properties"]),
+            },
+            dest={"index": self.events_index_name},
+            wait_for_completion=False,
+        )
+        await wait_for_task(self.elastic, task["task"])
+        await self.elastic.indices.refresh(index=self.events_index_name)
+
+    async def _backfill_registry(self: Self) -> None:
+        # registers the logs uploaded before the registry existed, whose upload time is unknown
+        pages = self._composite_pages(
+            self.data_indices,
             {
-                "composite": {"size": 1000, "sources": [{"filename": {"terms": {"field": "file"}}}]},
+                "composite": {"sources": [{"file": {"terms": {"field": "file"}}}]},
                 "aggs": {
                     "min_timestamp": {"min": {"field": "@timestamp"}},
                     "max_timestamp": {"max": {"field": "@timestamp"}},
+                    "firmwares": {"terms": {"field": "ini_filename", "size": 1000}},
                 },
             },
+            partitions=await self._key_partitions(self.data_indices, "file"),
+        )
+
+        async def actions() -> AsyncIterator[list[bytes]]:
+            async for log_files in pages:
+                yield [
+                    # logs registered by uploads in the meantime are left as they are
+                    orjson.dumps({"create": {"_index": self.registry_index_name, "_id": log_file["key"]["file"]}})
+                    + b"\n"
+                    + orjson.dumps(
+                        {
+                            "file": log_file["key"]["file"],
+                            "entry_count": log_file["doc_count"],
+                            "first_entry_timestamp": _utc_isoformat(log_file["min_timestamp"]["value"]),
+                            "last_entry_timestamp": _utc_isoformat(log_file["max_timestamp"]["value"]),
+                            "firmwares": sorted(bucket["key"] for bucket in log_file["firmwares"]["buckets"]),
+                            "content_hash": None,
+                            "uploaded_at": None,
+                        }
+                    )
+                    + b"\n"
+                    for log_file in log_files
+                ]
+
+        await self.bulk_indexer.index(actions())
+        await self.elastic.indices.refresh(index=self.registry_index_name)
+
+    async def _key_partitions(
+        self: Self, index: str, field: str, query: dict[str, Any] | None = None
+    ) -> list[dict[str, Any]]:
+        """Filters splitting the documents matching `query` into `composite_partitions` parts of about the same size.
+
+        The parts are ranges of values of the keyword `field`, split after counting the documents of each value: a
+        single source aggregation, far cheaper than the ones split.
+        """
+        if self.composite_partitions <= 1:
+            return []
+        counts = await _collect(
+            self._composite_pages(index, {"composite": {"sources": [{"key": {"terms": {"field": field}}}]}}, query)
         )
-        min_max = await self.elastic.search(
-            index=self.index_name,
+        total = sum(bucket["doc_count"] for bucket in counts)
+        splits: list[Any] = []
+        seen = 0
+        for bucket in counts:
+            # a part ends before the value whose documents are mostly past its share
+            target = total * (len(splits) + 1) / self.composite_partitions
+            if len(splits) < self.composite_partitions - 1 and seen and seen + bucket["doc_count"] / 2 >= target:
+                splits.append(bucket["key"]["key"])
+            seen += bucket["doc_count"]
+        return _range_partitions(field, splits)
+
+    async def _composite_paginate(
+        self: Self, index: str, agg: dict[str, dict[str, Any]], query: dict[str, dict[str, Any]] | None = None
+    ) -> list[Any]:
+        return [bucket async for page in self._composite_pages(index, agg, query) for bucket in page]
+
+    async def _composite_pages(
+        self: Self,
+        index: str,
+        agg: dict[str, dict[str, Any]],
+        query: dict[str, Any] | None = None,
+        *,
+        page_size: int | None = None,
+        partitions: list[dict[str, Any]] | None = None,
+        first_page: Any = None,  # noqa: ANN401
+    ) -> AsyncIterator[list[Any]]:
+        """Pages of buckets of the composite aggregation `agg`, yielded as they arrive.
+
+        Pages hold `page_size` buckets, or the size set in `agg`, or `composite_page_size`. With several `partitions`
+        (query filters splitting the documents by the value of one of the sources, like `_key_partitions`), each
+        partition is paged through concurrently and their pages are interleaved. `first_page` is a response already
+        fetched for the first page. Stopping the iteration early stops fetching pages.
+        """
+        page_size = page_size or agg["composite"].get("size") or self.composite_page_size
+        agg = agg | {"composite": agg["composite"] | {"size": page_size}}
+        if not partitions or len(partitions) == 1:
+            async for page in self._partition_pages(index, agg, _filtered(query, partitions), first_page):
+                yield page
+            return
+        if first_page is not None:
+            raise ValueError("The first page of a partitioned aggregation can't be fetched beforehand")
+        pages: Queue[list[Any] | Exception | None] = Queue(maxsize=len(partitions))
+
+        async def fetch(partition: dict[str, Any]) -> None:
+            try:
+                async for page in self._partition_pages(index, agg, _filtered(query, [partition])):
+                    await pages.put(page)
+            except Exception as e:
+                await pages.put(e)
+            else:
+                await pages.put(None)
+
+        fetching = [create_task(fetch(partition)) for partition in partitions]
+        error = None
+        try:
+            remaining = len(fetching)
+            while remaining:
+                page = await pages.get()
+                if page is None:
+                    remaining -= 1
+                elif isinstance(page, Exception):
+                    error = page
+                    break
+                else:
+                    yield page
+        finally:
+            # the other partitions are stopped on errors, and when the caller stops early
+            for task in fetching:
+                task.cancel()
+            await gather(*fetching, return_exceptions=True)
+        if error is not None:
+            raise error
+
+    async def _partition_pages(
+        self: Self,
+        index: str,
+        agg: dict[str, dict[str, Any]],
+        query: dict[str, Any] | None,
+        response: Any = None,  # noqa: ANN401
+    ) -> AsyncIterator[list[Any]]:
+        while True:
+            if response is None:
+                # monthly indices in the searched range may not exist, if there weren't any entries in those months
+                response = await self.elastic.search(
+                    index=index, ignore_unavailable=True, size=0, query=query, aggs={"agg": agg}
+                )
+            if "aggregations" not in response:  # none of the indices searched exist yet
+                return
+            result = response["aggregations"]["agg"]
+            if result["buckets"]:
+                yield list(result["buckets"])
+            # a page that isn't full is the last one, even though it comes with an `after_key` too
+            if "after_key" not in result or len(result["buckets"]) < agg["composite"]["size"]:
+                return
+            agg = agg | {"composite": agg["composite"] | {"after": result["after_key"]}}
+            response = None
+
+    async def _msearch(self: Self, searches: list[tuple[str, dict[str, Any]]]) -> list[Any]:
+        """Runs the `(index, body)` searches in a single round trip, returning their responses in the same order."""
+        response = await self.elastic.msearch(
+            searches=[line for index, body in searches for line in ({"index": index, "ignore_unavailable": True}, body)]
+        )
+        responses = list(response["responses"])
+        for result in responses:
+            if "error" in result:
+                raise LogDatabaseError(f"Search failed: {result['error'].get('reason', result['error'])}")
+        return responses
+
+    async def _composites(
+        self: Self, searches: list[tuple[str, dict[str, Any], dict[str, Any] | None]]
+    ) -> list[list[Any]]:
+        """Buckets of the `(index, agg, query)` composite aggregations, whose first pages share a single round trip.
+
+        Only the aggregations with more than a page of buckets need requests of their own.
+        """
+        if not searches:
+            return []
+        # the first pages have to be as large as the following ones, or they'd be taken for the last
+        searches = [
+            (
+                index,
+                agg
+                | {"composite": agg["composite"] | {"size": agg["composite"].get("size") or self.composite_page_size}},
+                query,
+            )
+            for index, agg, query in searches
+        ]
+        first_pages = await self._msearch(
+            [
+                (index, {"size": 0, "aggs": {"agg": agg}} | ({"query": query} if query is not None else {}))
+                for index, agg, query in searches
+            ]
+        )
+        return list(
+            await gather(
+                *(
+                    _collect(self._composite_pages(index, agg, query, first_page=page))
+                    for (index, agg, query), page in zip(searches, first_pages, strict=True)
+                )
+            )
+        )
+
+    async def _terms(self: Self, index: str, query: dict[str, Any], fields: dict[str, str]) -> dict[str, list[Any]]:
+        """Sorted distinct values of each of the `fields` (by name) among the documents matching `query`.
+
+        All the fields are aggregated by the same search. Only those with more than `_TERMS_SIZE` distinct values
+        are paged through with composite aggregations afterwards.
+        """
+        response = await self.elastic.search(
+            index=index,
+            ignore_unavailable=True,
             size=0,
-            aggs={"min_timestamp": {"min": {"field": "@timestamp"}}, "max_timestamp": {"max": {"field": "@timestamp"}}},
+            query=query,
+            aggs={
+                name: {"terms": {"field": field, "size": _TERMS_SIZE, "order": {"_key": "asc"}}}
+                for name, field in fields.items()
+            },
         )
+        aggregations = response["aggregations"] if "aggregations" in response else {}
+        values: dict[str, list[Any]] = {}
+        overflowing = []
+        for name in fields:
+            if name not in aggregations:
+                values[name] = []
+            elif aggregations[name]["sum_other_doc_count"]:
+                overflowing.append(name)
+            else:
+                values[name] = [bucket["key"] for bucket in aggregations[name]["buckets"]]
+        paginated = await self._composites(
+            [
+                (index, {"composite": {"sources": [{name: {"terms": {"field": fields[name]}}}]}}, query)
+                for name in overflowing
+            ]
+        )
+        for name, buckets in zip(overflowing, paginated, strict=True):
+            values[name] = [bucket["key"][name] for bucket in buckets]
+        return values
+
+    def _data_changed(self: Self) -> None:
+        if self.query_cache is not None:
+            self.query_cache.bump_generation()
+
+    async def _registered_files(self: Self) -> AsyncIterator[dict[str, Any]]:
+        # files still being uploaded don't have any timestamps yet
+        search_after = None
+        while True:
+            response = await self.elastic.search(
+                index=self.registry_index_name,
+                size=_REGISTRY_PAGE_SIZE,
+                query={
+                    "bool": {
+                        "must": {"exists": {"field": "first_entry_timestamp"}},
+                        "must_not": {"exists": {"field": "deleting"}},
+                    }
+                },
+                sort=["file"],
+                search_after=search_after,
+            )
+            hits = response["hits"]["hits"]
+            for hit in hits:
+                yield hit["_source"]
+            if len(hits) < _REGISTRY_PAGE_SIZE:
+                return
+            search_after = hits[-1]["sort"]
+
+    @property
+    @cached_query
+    async def uploaded_file_list(self: Self) -> StoredLogList:
+        log_files = [
+            StoredLogFile(
+                file_name=log_file["file"],
+                first_entry_timestamp=_local_datetime(log_file["first_entry_timestamp"]),
+                last_entry_timestamp=_local_datetime(log_file["last_entry_timestamp"]),
+                entry_count=log_file["entry_count"],
+            )
+            async for log_file in self._registered_files()
+        ]
         return StoredLogList(
-            log_files=[
-                StoredLogFile(
-                    file_name=log_file["key"]["filename"],
-                    first_entry_timestamp=datetime.fromtimestamp(log_file["min_timestamp"]["value"] / 1000),
-                    last_entry_timestamp=datetime.fromtimestamp(log_file["max_timestamp"]["value"] / 1000),
-                    entry_count=log_file["doc_count"],
-                )
-                for log_file in log_files
-            ],
-            min_timestamp=datetime.fromtimestamp(
-                (min_max["aggregations"]["min_timestamp"]["value"] or 0) / 1000,
+            log_files=log_files,
+            min_timestamp=min(
+                (log_file.first_entry_timestamp for log_file in log_files), default=datetime.fromtimestamp(0)
             ),
-            max_timestamp=datetime.fromtimestamp(
-                (min_max["aggregations"]["max_timestamp"]["value"] or _max_timestamp) / 1000,
+            max_timestamp=max(
+                (log_file.last_entry_timestamp for log_file in log_files),
+                default=datetime.fromtimestamp(_max_timestamp / 1000),
             ),
         )
 
-    async def _log_already_uploaded(self: Self, file_name: str) -> bool:
+    @property
+    def _write_refresh(self: Self) -> str | None:
+        # `refresh` parameter of the writes done while uploading
+        return "wait_for" if self.wait_for_refresh else None
+
+    async def _register(self: Self, file_name: str, document: dict[str, object], *, overwrite: bool) -> None:
+        try:
+            if overwrite:
+                await self.elastic.index(
+                    index=self.registry_index_name, id=file_name, document=document, refresh=self._write_refresh
+                )
+            else:
+                # creating the document fails if it already exists, so the same log can't be uploaded twice at once
+                await self.elastic.create(
+                    index=self.registry_index_name, id=file_name, document=document, refresh=self._write_refresh
+                )
+        except ConflictError as e:
+            raise LogDatabaseError("Log file already uploaded!") from e
+
+    async def _registered(self: Self, file_name: str) -> dict[str, Any] | None:
+        # registry document of a log, with the `_seq_no` and `_primary_term` needed to update it safely
+        try:
+            return dict(await self.elastic.get(index=self.registry_index_name, id=file_name))
+        except NotFoundError:
+            return None
+
+    async def _claim(self: Self, file_name: str, document: dict[str, object]) -> None:
+        # always claimed by creating the registry document, even after checking that the log isn't stored yet, so
+        # that only one of the uploads of the same log running at once gets it
+        registered = await self._deletion_settled(file_name, await self._registered(file_name))
+        if registered is not None and self._stale_claim(registered["_source"]):
+            # resumed or rolled back below like an interrupted upload, by whichever upload marks it first
+            await self._index_registered(file_name, registered["_source"] | {"interrupted": True}, registered)
+            registered = await self._registered(file_name)
+        if registered is None or not registered["_source"].get("interrupted"):
+            await self._register(file_name, document, overwrite=False)
+            return
+        content_hash = registered["_source"]["content_hash"]
+        if content_hash is None or content_hash != document["content_hash"]:
+            # another file with the same name: the entries stored before the interruption aren't its own
+            await self._roll_back(file_name)
+            await self._register(file_name, document, overwrite=False)
+            return
+        # the same file again, whose entries already stored are skipped since they get the same IDs
+        await self._index_registered(file_name, document, registered)
+
+    async def _deletion_settled(self: Self, file_name: str, registered: dict[str, Any] | None) -> dict[str, Any] | None:
+        # the registry document `registered` once the deletion of the log, if any, is over
+        if registered is None or not (task_id := registered["_source"].get("deleting")):
+            return registered
+        if not await self._settle_deletion(file_name, task_id):
+            raise LogDatabaseError("Log file still being deleted!")
+        return await self._registered(file_name)
+
+    async def _settle_deletion(self: Self, file_name: str, task_id: str) -> bool:
+        # whether the deletion `task_id` of `file_name` is over, finishing it then even if nobody polled it
+        deletion = await self.deletion(task_id)
+        if deletion is None:
+            # the task is gone along with its result, so whatever it may have left behind is deleted right away
+            await self.delete_log(file_name)
+            return True
+        return deletion.completed
+
+    async def _index_registered(
+        self: Self, file_name: str, document: dict[str, object], registered: dict[str, Any]
+    ) -> None:
+        # replaces the registry document `registered`, unless another upload changed it since
+        try:
+            await self.elastic.index(
+                index=self.registry_index_name,
+                id=file_name,
+                document=document,
+                if_seq_no=registered["_seq_no"],
+                if_primary_term=registered["_primary_term"],
+                refresh=self._write_refresh,
+            )
+        except ConflictError as e:
+            raise LogDatabaseError("Log file already uploaded!") from e
+
+    def _stale_claim(self: Self, stored: dict[str, Any]) -> bool:
+        # claimed by an upload that never stored the log nor cleaned up after itself (the process was killed)
+        return (
+            stored["last_entry_timestamp"] is None
+            and stored["uploaded_at"] is not None
+            and not stored.get("interrupted")
+            and not stored.get("deleting")
+            and datetime.now().astimezone() - datetime.fromisoformat(stored["uploaded_at"]) > self.stale_claim_timeout
+        )
+
+    async def _interrupt(self: Self, file_name: str, uploaded_at: datetime, content_hash: str) -> bool:
+        # keeps the entries stored so far, for the same file to be uploaded again later on (without them)
+        document = registry_document(file_name, LogSummary(), uploaded_at, content_hash) | {"interrupted": True}
+        try:
+            await self._register(file_name, document, overwrite=True)
+        except Exception:
+            return False
+        return True
+
+    async def _abandon(self: Self, file_name: str, uploaded_at: datetime, content_hash: str | None) -> None:
+        # an upload cancelled on the way: its claim mustn't outlive it, marked interrupted (quick, and resumable) if the
+        # same file can be recognized later on, otherwise rolled back
+        if content_hash is None or not await self._interrupt(file_name, uploaded_at, content_hash):
+            await self._roll_back(file_name)
+
+    async def uploaded_logs(self: Self, file_names: list[str]) -> set[str]:
+        if not file_names:
+            return set()
         res = await self.elastic.search(
-            index=self.index_name,
-            size=0,
+            index=self.registry_index_name,
+            size=len(file_names),
+            # interrupted uploads are resumed by uploading the same file again
             query={
-                "term": {"file": {"value": file_name}},
+                "bool": {
+                    "must": {"terms": {"file": file_names}},
+                    "must_not": {"term": {"interrupted": {"value": True}}},
+                }
             },
+            source=["file", "deleting"],
         )
-        return res["hits"]["total"]["value"] != 0
+        logs = {hit["_source"]["file"]: hit["_source"].get("deleting") for hit in res["hits"]["hits"]}
+        deleting = {file_name: task_id for file_name, task_id in logs.items() if task_id}
+        # logs being deleted are gone already: uploading them again fails in `_claim` until the deletion is over
+        await gather(*(self._settle_deletion(file_name, task_id) for file_name, task_id in deleting.items()))
+        return logs.keys() - deleting.keys()
 
-    async def _call_async_bulk(self: Self, actions: Iterable[Any] | AsyncIterable[Any]) -> tuple[int, int | list[Any]]:
-        return await async_bulk(client=self.elastic, actions=actions)
+    async def uploaded_content(self: Self, content_hashes: list[str]) -> dict[str, str]:
+        # maps the hashes of the logs already stored to their file name
+        if not content_hashes:
+            return {}
+        res = await self.elastic.search(
+            index=self.registry_index_name,
+            size=len(content_hashes),
+            query={
+                "bool": {
+                    "must": {"terms": {"content_hash": content_hashes}},
+                    "must_not": [{"term": {"interrupted": {"value": True}}}, {"exists": {"field": "deleting"}}],
+                }
+            },
+            source=["file", "content_hash"],
+        )
+        return {hit["_source"]["content_hash"]: hit["_source"]["file"] for hit in res["hits"]["hits"]}
 
-    async def upload(self: Self, log_file: LogFile) -> int:
-        if await self._log_already_uploaded(log_file.filename):
-            raise LogDatabaseError("Log file already uploaded!")
-        entries = ((e.dict() | {"file": log_file.filename}) for e in log_file.log_entries)
-        count = (
-            await self._call_async_bulk(
-                {"_index": self.index_name, "_source": entry, "pipeline": self._pipeline_name} for entry in entries
-            )
-        )[0]
-        await self.elastic.indices.refresh(index=self.index_name)
-        return count
+    async def _index_actions(  # noqa: PLR0913
+        self: Self,
+        file_name: str,
+        record_batches: AsyncIterable[list[LogRecord]],
+        summary: LogSummary | None = None,
+        append_id: str | None = None,
+        load_index: Callable[[str], Awaitable[None]] | None = None,
+    ) -> AsyncIterator[list[bytes]]:
+        pipeline = self._pipeline_name if self.use_pipeline else None
+        # entries are numbered by their row in the upload, which their IDs are made from
+        first_row = 0
+        async for batch in record_batches:
+            if summary is not None:
+                summary.add(batch)
+            rows = range(first_row, first_row + len(batch))
+            first_row += len(batch)
+            events = event_actions(self.events_index_name, file_name, batch, append_id, rows)
+            if self.index_layout is not IndexLayout.MONTH:
+                yield index_actions(self._data_index(file_name), file_name, batch, pipeline, append_id, rows) + events
+                continue
+            # each entry goes to the index of its month, created from the template when it's first written to
+            months: defaultdict[tuple[int, int], list[tuple[int, LogRecord]]] = defaultdict(list)
+            for row, record in zip(rows, batch, strict=True):
+                months[record.timestamp.year, record.timestamp.month].append((row, record))
+            if load_index is not None:
+                for year, month in months:
+                    await load_index(self._month_index(year, month))
+            yield [
+                action
+                for (year, month), month_rows in months.items()
+                for action in index_actions(
+                    self._month_index(year, month),
+                    file_name,
+                    [record for _, record in month_rows],
+                    pipeline,
+                    append_id,
+                    [row for row, _ in month_rows],
+                )
+            ] + events
+
+    async def _rollup_actions(
+        self: Self, file_name: str, rollups: Counter[RollupKey], append_id: str | None = None
+    ) -> AsyncIterator[list[bytes]]:
+        yield rollup_actions(self.rollup_index_name, file_name, rollups, append_id)
+
+    async def _refresh_indices(self: Self) -> None:
+        await self.elastic.indices.refresh(
+            index=[self.data_indices, self.events_index_name, self.rollup_index_name, self.registry_index_name]
+        )
+
+    async def refresh(self: Self) -> None:
+        """Makes the logs uploaded so far searchable."""
+        # with `wait_for_refresh`, uploads only return once the scheduled refreshes made their documents searchable
+        if not self.wait_for_refresh:
+            await self._refresh_indices()
+        self._data_changed()
+
+    def _is_entry_action(self: Self, action: bytes) -> bool:
+        # the copies of the events sent along with the entries aren't entries of the log
+        return not action.startswith(self._events_action_prefix)
+
+    async def _roll_back(self: Self, file_name: str) -> None:
+        await self._refresh_indices()
+        await self.delete_log(file_name)
+
+    @asynccontextmanager
+    async def _bulk_loading(self: Self, file_name: str) -> AsyncIterator[Callable[[str], Awaitable[None]] | None]:
+        # applies `bulk_load` to the indices the entries of `file_name` are written to, which with `MONTH` are only
+        # known along the way: the function yielded applies it to each month's index before it's first written to
+        if self.bulk_load is None:
+            yield None
+            return
+        bulk_load = self.bulk_load
+        async with AsyncExitStack() as stack:
+            loading: set[str] = set()
+
+            async def load(index: str) -> None:
+                if index in loading:
+                    return
+                loading.add(index)
+                if self.index_layout is not IndexLayout.SINGLE:
+                    # the index of a new log (or month) has to exist for its settings to be changed: it's created from
+                    # the template
+                    await self.elastic.options(ignore_status=400).indices.create(index=index)
+                await stack.enter_async_context(bulk_load.apply([index]))
+
+            await stack.enter_async_context(bulk_load.apply([self.events_index_name]))
+            if self.index_layout is not IndexLayout.MONTH:
+                await load(self._data_index(file_name))
+            yield load
+
+    async def upload(
+        self: Self,
+        file_name: str,
+        record_batches: AsyncIterable[list[LogRecord]],
+        *,
+        refresh: bool = True,
+        on_indexed: Callable[[int], None] | None = None,
+        content_hash: str | None = None,
+        append: bool = False,
+    ) -> IngestStats:
+        """Stores the log `file_name`, whose entries are parsed into `record_batches`.
+
+        With `append`, a log already stored is updated with a newer copy of it instead, indexing only its new entries.
+        If ElasticSearch is too overloaded to store the whole log, the entries stored so far are kept: uploading the
+        same log again then resumes the upload.
+        """
+        registered = await self._deletion_settled(file_name, await self._registered(file_name)) if append else None
+        if (
+            registered is not None
+            and not registered["_source"].get("interrupted")
+            and not self._stale_claim(registered["_source"])
+        ):
+            return await self._append(file_name, record_batches, registered, refresh, on_indexed, content_hash)
+        summary = LogSummary()
+        uploaded_at = datetime.now().astimezone()
+        await self._claim(file_name, registry_document(file_name, summary, uploaded_at, content_hash))
+        try:
+            async with self._bulk_loading(file_name) as load_index:
+                stats = _entry_stats(
+                    await self.bulk_indexer.index(
+                        self._index_actions(file_name, record_batches, summary, load_index=load_index),
+                        on_indexed,
+                        self.wait_for_refresh,
+                        self._is_entry_action,
+                    ),
+                    summary.entry_count,
+                )
+                # rollups are written once the whole file is stored, so they never count entries that get rolled back
+                await self.bulk_indexer.index(
+                    self._rollup_actions(file_name, summary.rollups), wait_for_refresh=self.wait_for_refresh
+                )
+                await self._register(
+                    file_name, registry_document(file_name, summary, uploaded_at, content_hash), overwrite=True
+                )
+        except Exception as e:
+            if (
+                is_overloaded(e)
+                and content_hash is not None
+                and await self._interrupt(file_name, uploaded_at, content_hash)
+            ):
+                raise LogDatabaseError("ElasticSearch overloaded, upload the log file again to resume!") from e
+            # entries are indexed while the file is still being parsed, so a malformed row (or a failed request) may
+            # show up after part of the file is already stored: drop it, otherwise the file couldn't be uploaded again
+            await self._roll_back(file_name)
+            raise
+        except BaseException:
+            # cancelled (like the running jobs when shutting down): cleaned up even if cancelled again meanwhile
+            await shield(self._abandon(file_name, uploaded_at, content_hash))
+            raise
+        finally:
+            # ElasticSearch refreshes the index on its own too, so some entries may be visible even without `refresh`
+            self._data_changed()
+        if refresh:
+            await self.refresh()
+        return stats
+
+    async def _append(  # noqa: PLR0913
+        self: Self,
+        file_name: str,
+        record_batches: AsyncIterable[list[LogRecord]],
+        registered: dict[str, Any],
+        refresh: bool,
+        on_indexed: Callable[[int], None] | None,
+        content_hash: str | None,
+    ) -> IngestStats:
+        stored = registered["_source"]
+        if stored["last_entry_timestamp"] is None:
+            raise LogDatabaseError("Log file still being uploaded!")
+        # several entries can share the newest timestamp, and only some of them may have been logged yet
+        stored_at_last = await self.elastic.count(
+            index=self._data_index(file_name),
+            query={
+                "bool": {
+                    "must": [
+                        {"term": {"file": {"value": file_name}}},
+                        {"term": {"@timestamp": {"value": stored["last_entry_timestamp"]}}},
+                    ]
+                }
+            },
+        )
+        summary = LogSummary(
+            entry_count=stored["entry_count"],
+            first_timestamp=_log_datetime(stored["first_entry_timestamp"]),
+            last_timestamp=_log_datetime(stored["last_entry_timestamp"]),
+            firmwares=set(stored["firmwares"]),
+        )
+        new_records = _newer_records(record_batches, summary.last_timestamp, stored_at_last["count"])  # type: ignore
+        # the new entries are tagged, so that a failed append can be undone without touching the stored ones
+        append_id = uuid4().hex
+        try:
+            async with self._bulk_loading(file_name) as load_index:
+                stats = _entry_stats(
+                    await self.bulk_indexer.index(
+                        self._index_actions(file_name, new_records, summary, append_id, load_index),
+                        on_indexed,
+                        self.wait_for_refresh,
+                        self._is_entry_action,
+                    ),
+                    summary.entry_count - stored["entry_count"],
+                )
+                await self.bulk_indexer.index(
+                    self._rollup_actions(file_name, summary.rollups, append_id), wait_for_refresh=self.wait_for_refresh
+                )
+            uploaded_at = stored["uploaded_at"] and datetime.fromisoformat(stored["uploaded_at"])
+            try:
+                # fails if another append of the same log got there first, since its entries would overlap with these
+                await self.elastic.index(
+                    index=self.registry_index_name,
+                    id=file_name,
+                    document=registry_document(file_name, summary, uploaded_at, content_hash),
+                    if_seq_no=registered["_seq_no"],
+                    if_primary_term=registered["_primary_term"],
+                    refresh=self._write_refresh,
+                )
+            except ConflictError as e:
+                raise LogDatabaseError("Log file updated by another upload!") from e
+        except BaseException:
+            # undone even when cancelled, and even if cancelled again meanwhile
+            await shield(self._undo_append(file_name, append_id))
+            raise
+        finally:
+            self._data_changed()
+        if refresh:
+            await self.refresh()
+        return stats
+
+    async def _undo_append(self: Self, file_name: str, append_id: str) -> None:
+        await self._refresh_indices()
+        query = {"bool": {"must": {"term": {"append_id": {"value": append_id}}}}}
+        await gather(
+            self.elastic.delete_by_query(index=self._data_index(file_name), query=query, refresh=True),
+            self.elastic.delete_by_query(index=self.events_index_name, query=query, refresh=True),
+            self.elastic.delete_by_query(index=self.rollup_index_name, query=query, refresh=True),
+        )
 
     async def delete_log(self: Self, log: str) -> int:
-        return (
-            await self.elastic.delete_by_query(
-                index=self.index_name, query={"bool": {"must": {"term": {"file": {"value": log}}}}}, refresh=True
+        query = {"bool": {"must": {"term": {"file": {"value": log}}}}}
+        try:
+            deleted, *_ = await gather(
+                self._delete_entries(log, query),
+                self.elastic.delete_by_query(index=self.events_index_name, query=query, refresh=True),
+                self.elastic.delete_by_query(index=self.rollup_index_name, query=query, refresh=True),
+                self.elastic.delete_by_query(index=self.registry_index_name, query=query, refresh=True),
+            )
+            return deleted
+        finally:
+            self._data_changed()
+
+    async def start_deletion(self: Self, log: str, requests_per_second: float | None = None) -> str:
+        """Starts deleting `log` in the background, returning the ID of the ElasticSearch task deleting it.
+
+        The log is hidden right away, but it can't be uploaded again until `deletion` reports the task as completed.
+        With `requests_per_second`, the deletion is throttled, so that it doesn't slow the other queries down.
+        """
+        registered = await self._registered(log)
+        if registered is None or "deleting" in registered["_source"]:
+            raise LogDatabaseError("Log file not found!")
+        query = {"bool": {"must": {"term": {"file": {"value": log}}}}}
+        indices = [self.events_index_name, self.rollup_index_name]
+        if self.index_layout is IndexLayout.FILE:
+            await self.elastic.indices.delete(index=self._data_index(log), ignore_unavailable=True)
+        else:
+            indices.append(self.data_indices)
+        task = await self.elastic.delete_by_query(
+            index=",".join(indices),
+            query=query,
+            wait_for_completion=False,
+            requests_per_second=requests_per_second or -1,
+            slices="auto",
+            refresh=True,
+        )
+        try:
+            await self.elastic.index(
+                index=self.registry_index_name,
+                id=log,
+                document=registered["_source"] | {"deleting": task["task"]},
+                if_seq_no=registered["_seq_no"],
+                if_primary_term=registered["_primary_term"],
+                refresh=True,
+            )
+        except ConflictError as e:
+            await self.elastic.tasks.cancel(task_id=task["task"])
+            raise LogDatabaseError("Log file updated by another upload!") from e
+        finally:
+            self._data_changed()
+        return task["task"]
+
+    async def deletion(self: Self, task_id: str) -> LogDeletion | None:
+        """Progress of the deletion started as `task_id`, None if there's no such task."""
+        try:
+            task = await self.elastic.tasks.get(task_id=task_id)
+        except (NotFoundError, BadRequestError):
+            return None
+        if task["task"].get("action") != _DELETE_BY_QUERY:
+            return None
+        status = task["task"]["status"]
+        errors = []
+        if "error" in task:
+            errors.append(task["error"]["reason"])
+        elif task["completed"]:
+            errors.extend(failure["cause"]["reason"] for failure in task["response"]["failures"])
+        if task["completed"]:
+            await self._finish_deletion(task_id, failed=bool(errors))
+        return LogDeletion(
+            task_id=task_id,
+            completed=task["completed"],
+            total=status["total"],
+            deleted=status["deleted"],
+            errors=errors,
+        )
+
+    async def _finish_deletion(self: Self, task_id: str, *, failed: bool) -> None:
+        query = {"bool": {"must": {"term": {"deleting": {"value": task_id}}}}}
+        if failed:
+            # the log is listed again, for its deletion to be retried
+            await self.elastic.update_by_query(
+                index=self.registry_index_name,
+                query=query,
+                script={"source": "ctx._source.remove('deleting')"},
+                refresh=True,
             )
-        )["total"]
+        else:
+            await self.elastic.delete_by_query(index=self.registry_index_name, query=query, refresh=True)
+        self._data_changed()
+
+    async def _delete_entries(self: Self, log: str, query: dict[str, Any]) -> int:
+        if self.index_layout is not IndexLayout.FILE:
+            deleted = await self.elastic.delete_by_query(index=self.data_indices, query=query, refresh=True)
+            return deleted["total"]
+        # dropping the whole index is immediate, and doesn't leave deleted documents behind until segments merge
+        index = self._data_index(log)
+        try:
+            stored = await self.elastic.count(index=index)
+        except NotFoundError:
+            return 0
+        await self.elastic.indices.delete(index=index, ignore_unavailable=True)
+        return stored["count"]
 
+    @cached_query
     async def log_overview(self: Self, start: datetime, end: datetime) -> LogOverview:
-        general_stats = await self.elastic.search(
-            index=self.index_name,
-            size=0,
-            query={"bool": {"must": {"range": {"@timestamp": {"gte": start.isoformat(), "lte": end.isoformat()}}}}},
-            aggregations={
-                "file": {"terms": {"field": "file", "size": 100000000}},
-                "max_count": {"max_bucket": {"buckets_path": "file>_count"}},
-                "ext_stats": {"extended_stats_bucket": {"buckets_path": "file>_count"}},
-            },
+        # the entries of each file are counted a page of files at a time, and the statistics folded in here, so that
+        # there's never a bucket for every file in memory at once
+        pages = self._composite_pages(
+            self._search_indices(start, end),
+            {"composite": {"sources": [{"file": {"terms": {"field": "file"}}}]}},
+            {"bool": {"must": {"range": {"@timestamp": {"gte": start.isoformat(), "lte": end.isoformat()}}}}},
         )
-        if general_stats["hits"]["total"]["value"] == 0:
+        file_count = total = squares = 0
+        max_file, max_count = "", 0
+        async for page in pages:
+            for bucket in page:
+                file, count = bucket["key"]["file"], bucket["doc_count"]
+                file_count += 1
+                total += count
+                squares += count * count
+                # like `max_bucket`, ties go to the first file in key order
+                if count > max_count or (count == max_count and file < max_file):
+                    max_file, max_count = file, count
+        if file_count == 0:
             return LogOverview.empty()
+        avg = total / file_count
         return LogOverview(
-            total_entries=general_stats["aggregations"]["ext_stats"]["sum"],
-            avg_entries=general_stats["aggregations"]["ext_stats"]["avg"],
-            max_count_entry=MaxCountEntry(
-                filename=general_stats["aggregations"]["max_count"]["keys"][0],
-                entry_count=general_stats["aggregations"]["max_count"]["value"],
-            ),
-            entries_std_dev=general_stats["aggregations"]["ext_stats"]["std_deviation"],
+            total_entries=total,
+            avg_entries=avg,
+            max_count_entry=MaxCountEntry(filename=max_file, entry_count=max_count),
+            # population standard deviation, like `extended_stats_bucket`'s
+            entries_std_dev=math.sqrt(max(squares / file_count - avg * avg, 0)),
         )
 
+    async def _events_composite(  # noqa: PLR0913
+        self: Self,
+        start: datetime,
+        end: datetime,
+        filters: list[dict[str, Any]],
+        sources: list[dict[str, Any]],
+        raw_aggs: dict[str, Any] | None = None,
+        rollup_aggs: dict[str, Any] | None = None,
+    ) -> tuple[list[Any], list[Any]]:
+        """Composite aggregation of the BIN events turning ON between `start` and `end` that match `filters`.
+
+        Whole hours are aggregated from the hourly rollups (with `rollup_aggs`, which have to sum their `count`), and
+        only the partial hours at the edges of the range from the events index (with `raw_aggs`).
+        """
+        raw_range, rollup_range = _split_time_range(start, end)
+        searches: list[tuple[str, dict[str, Any], dict[str, Any] | None]] = [
+            (
+                self.events_index_name,
+                {"composite": {"sources": sources}} | ({"aggs": raw_aggs} if raw_aggs else {}),
+                {"bool": {"must": [raw_range, *filters]}},
+            )
+        ]
+        if rollup_range is not None:
+            searches.append(
+                (
+                    self.rollup_index_name,
+                    {"composite": {"sources": sources}} | ({"aggs": rollup_aggs} if rollup_aggs else {}),
+                    {"bool": {"must": [rollup_range, *filters]}},
+                )
+            )
+        # the raw and the rolled up parts are fetched together
+        raw, *rolled_up = await self._composites(searches)
+        return raw, rolled_up[0] if rolled_up else []
+
+    @cached_query
     async def log_entries_frequency(
         self: Self, start: datetime, end: datetime, subunits: list[int]
     ) -> list[LogFrequencyEntry]:
-        frequency_stats = await self._composite_paginate(
-            self.index_name,
-            {
-                "composite": {
-                    "size": 1000,
-                    "sources": [{"fw": {"terms": {"field": "ini_filename"}}}, {"code": {"terms": {"field": "code"}}}],
-                }
-            },
-            {
-                "bool": {
-                    "must": [
-                        {"term": {"type_um": {"value": "BIN"}}},
-                        {"term": {"value": {"value": "ON"}}},
-                        {"range": {"@timestamp": {"gte": start.isoformat(), "lte": end.isoformat()}}},
-                        {"terms": {"unit_subunit_id": subunits}},
-                    ]
-                }
-            },
+        raw, rolled_up = await self._events_composite(
+            start,
+            end,
+            [{"terms": {"unit_subunit_id": subunits}}],
+            [{"fw": {"terms": {"field": "ini_filename"}}}, {"code": {"terms": {"field": "code"}}}],
+            rollup_aggs={"count": {"sum": {"field": "count"}}},
         )
+        counts: Counter[tuple[str, str]] = Counter()
+        for entry in raw:
+            counts[entry["key"]["fw"], entry["key"]["code"]] += entry["doc_count"]
+        for entry in rolled_up:
+            counts[entry["key"]["fw"], entry["key"]["code"]] += int(entry["count"]["value"])
         return [
-            LogFrequencyEntry(firmware=entry["key"]["fw"], event_code=entry["key"]["code"], count=entry["doc_count"])
-            for entry in frequency_stats
+            LogFrequencyEntry(firmware=firmware, event_code=code, count=count)
+            for (firmware, code), count in sorted(counts.items())
         ]
 
+    @cached_query
     async def chart_filters(self: Self, start: datetime, end: datetime) -> ChartFilterData:
-        query = {
-            "bool": {
-                "must": [
-                    {"term": {"type_um": {"value": "BIN"}}},
-                    {"term": {"value": {"value": "ON"}}},
-                    {"range": {"@timestamp": {"gte": start.isoformat(), "lte": end.isoformat()}}},
-                ]
-            }
-        }
-        codes, firmwares, subunits = await gather(
-            self._composite_paginate(
-                self.index_name,
-                {"composite": {"size": 1000, "sources": [{"code": {"terms": {"field": "code"}}}]}},
-                query,
-            ),
-            self._composite_paginate(
-                self.index_name,
-                {"composite": {"size": 1000, "sources": [{"firmware": {"terms": {"field": "ini_filename"}}}]}},
-                query,
-            ),
-            self._composite_paginate(
-                self.index_name,
-                {"composite": {"size": 1000, "sources": [{"subunit": {"terms": {"field": "unit_subunit_id"}}}]}},
-                query,
-            ),
-        )
-        return ChartFilterData(
-            codes=[code["key"]["code"] for code in codes],
-            firmwares=[firmware["key"]["firmware"] for firmware in firmwares],
-            subunits=[subunit["key"]["subunit"] for subunit in subunits],
+        query = {"bool": {"must": [{"range": {"@timestamp": {"gte": start.isoformat(), "lte": end.isoformat()}}}]}}
+        values = await self._terms(
+            self.events_index_name, query, {"code": "code", "firmware": "ini_filename", "subunit": "unit_subunit_id"}
         )
+        return ChartFilterData(codes=values["code"], firmwares=values["firmware"], subunits=values["subunit"])
 
-    async def time_chart_data(
+    async def _auto_histogram(
         self: Self, start: datetime, end: datetime, subunits: list[int], codes: list[str]
     ) -> list[HistogramEntry]:
         chart_data = await self.elastic.search(
-            index=self.index_name,
+            index=self.events_index_name,
             size=0,
             query={
                 "bool": {
                     "must": [
-                        {"term": {"type_um": {"value": "BIN"}}},
-                        {"term": {"value": {"value": "ON"}}},
                         {"range": {"@timestamp": {"gte": start.isoformat(), "lte": end.isoformat()}}},
                         {"terms": {"unit_subunit_id": subunits}},
                     ]
@@ -266,66 +1440,142 @@ class LogDatabase:
             aggs={
                 "events_over_time": {
                     "auto_date_histogram": {"field": "@timestamp", "buckets": 120},
-                    "aggs": {
-                        "filtered": {
-                            # `or 1` is needed to prevent Elastic complaining about failed query parsing in
-                            # case `codes` is empty (0 isn't a valid size)
-                            "aggs": {"code": {"terms": {"field": "code", "size": len(codes) or 1}}},
-                            "filter": {"terms": {"code": codes}},
-                        },
-                    },
+                    "aggs": _code_counts(codes),
                 }
             },
         )
         if chart_data["hits"]["total"]["value"] == 0:
             return []
-        default_zero = {code: "0" for code in codes}
-        return [
-            (
-                {"timestamp": bucket["key_as_string"], "total": bucket["doc_count"]}
-                | default_zero
-                | {code["key"]: code["doc_count"] for code in bucket["filtered"]["code"]["buckets"]}
-            )
-            for bucket in chart_data["aggregations"]["events_over_time"]["buckets"]
-        ]
+        return _histogram_entries(chart_data["aggregations"]["events_over_time"]["buckets"], codes)
 
-    async def firmware_chart_data(
-        self: Self, start: datetime, end: datetime, firmwares: list[str], codes: list[str]
+    @cached_query
+    async def _histogram_tile(  # noqa: PLR0913
+        self: Self,
+        start: datetime,
+        end: datetime,
+        closed: bool,
+        subunits: list[int],
+        codes: list[str],
+        interval_ms: int,
     ) -> list[HistogramEntry]:
-        chart_data = await self._composite_paginate(
-            self.index_name,
-            {
-                "composite": {
-                    "size": 1000,
-                    "sources": [{"firmware": {"terms": {"field": "ini_filename"}}}],
-                },
-                "aggs": {
-                    "filtered": {
-                        # `or 1` is needed to prevent Elastic complaining about failed query parsing in
-                        # case `codes` is empty (0 isn't a valid size)
-                        "aggs": {"code": {"terms": {"field": "code", "size": len(codes) or 1}}},
-                        "filter": {"terms": {"code": codes}},
-                    },
-                },
-            },
-            {
+        # `start`-`end` (up to `end` itself only if `closed`) is within a tile, whose buckets are all returned
+        start_ms, end_ms = _epoch_millis(start), _epoch_millis(end)
+        chart_data = await self.elastic.search(
+            index=self.events_index_name,
+            size=0,
+            query={
                 "bool": {
                     "must": [
-                        {"term": {"type_um": {"value": "BIN"}}},
-                        {"term": {"value": {"value": "ON"}}},
-                        {"range": {"@timestamp": {"gte": start.isoformat(), "lte": end.isoformat()}}},
-                        {"terms": {"ini_filename": firmwares}},
+                        {
+                            "range": {
+                                "@timestamp": {"gte": start.isoformat(), "lte" if closed else "lt": end.isoformat()}
+                            }
+                        },
+                        {"terms": {"unit_subunit_id": subunits}},
                     ]
                 }
             },
+            aggs={
+                "events_over_time": {
+                    "date_histogram": {
+                        "field": "@timestamp",
+                        "fixed_interval": f"{interval_ms}ms",
+                        "min_doc_count": 0,
+                        "extended_bounds": {"min": start_ms, "max": end_ms if closed else end_ms - 1},
+                    },
+                    "aggs": _code_counts(codes),
+                }
+            },
+        )
+        if "aggregations" not in chart_data:  # the events index doesn't exist yet
+            return []
+        return _histogram_entries(chart_data["aggregations"]["events_over_time"]["buckets"], codes)
+
+    async def _fixed_histogram(  # noqa: PLR0913
+        self: Self, start: datetime, end: datetime, subunits: list[int], codes: list[str], interval: timedelta
+    ) -> list[HistogramEntry]:
+        start, end = _utc(start), _utc(end)
+        if start > end:
+            return []
+        interval *= max(math.ceil((end - start) / interval / _MAX_HISTOGRAM_BUCKETS), 1)
+        semaphore = Semaphore(_TILE_CONCURRENCY)
+
+        async def tile(tile_start: datetime, tile_end: datetime, closed: bool) -> list[HistogramEntry]:
+            async with semaphore:
+                return await self._histogram_tile(
+                    tile_start, tile_end, closed, subunits, codes, interval // timedelta(milliseconds=1)
+                )
+
+        tiles = await gather(*(tile(*bounds) for bounds in _histogram_tiles(start, end, interval)))
+        entries = [entry for entries in tiles for entry in entries]
+        # like the automatic histogram, no events at all is no histogram at all
+        return entries if any(int(entry["total"]) > 0 for entry in entries) else []
+
+    @cached_query
+    async def time_chart_data(  # noqa: PLR0913
+        self: Self,
+        start: datetime,
+        end: datetime,
+        subunits: list[int],
+        codes: list[str],
+        interval: str | None = None,
+        points: int | None = None,
+        downsampling: Downsampling = Downsampling.MAX,
+    ) -> list[HistogramEntry]:
+        """Histogram of the BIN events turning ON between `start` and `end`, in total and for each of `codes`.
+
+        Without an `interval` ElasticSearch picks one giving about 120 buckets, otherwise the buckets are `interval`
+        wide (like `"1h"`) and aligned to the epoch, and are fetched and cached in tiles shared by all the ranges
+        overlapping them. Histograms with more than `points` buckets are downsampled to that many.
+        """
+        if interval is None:
+            entries = await self._auto_histogram(start, end, subunits, codes)
+        else:
+            entries = await self._fixed_histogram(start, end, subunits, codes, parse_interval(interval))
+        if points is None or len(entries) <= points:
+            return entries
+        totals = np.fromiter((int(entry["total"]) for entry in entries), dtype=np.int64, count=len(entries))
+        return [entries[index] for index in downsample(totals, points, downsampling)]
+
+    @cached_query
+    async def firmware_chart_data(
+        self: Self, start: datetime, end: datetime, firmwares: list[str], codes: list[str]
+    ) -> list[HistogramEntry]:
+        # `or 1` is needed to prevent Elastic complaining about failed query parsing in
+        # case `codes` is empty (0 isn't a valid size)
+        code_terms = {"field": "code", "size": len(codes) or 1}
+        raw, rolled_up = await self._events_composite(
+            start,
+            end,
+            [{"terms": {"ini_filename": firmwares}}],
+            [{"firmware": {"terms": {"field": "ini_filename"}}}],
+            raw_aggs={"filtered": {"aggs": {"code": {"terms": code_terms}}, "filter": {"terms": {"code": codes}}}},
+            rollup_aggs={
+                "total": {"sum": {"field": "count"}},
+                "filtered": {
+                    "aggs": {"code": {"terms": code_terms, "aggs": {"count": {"sum": {"field": "count"}}}}},
+                    "filter": {"terms": {"code": codes}},
+                },
+            },
         )
 
+        totals: Counter[str] = Counter()
+        code_counts: dict[str, Counter[str]] = {}
+        for bucket in raw:
+            firmware = bucket["key"]["firmware"]
+            totals[firmware] += bucket["doc_count"]
+            counts = code_counts.setdefault(firmware, Counter())
+            for code in bucket["filtered"]["code"]["buckets"]:
+                counts[code["key"]] += code["doc_count"]
+        for bucket in rolled_up:
+            firmware = bucket["key"]["firmware"]
+            totals[firmware] += int(bucket["total"]["value"])
+            counts = code_counts.setdefault(firmware, Counter())
+            for code in bucket["filtered"]["code"]["buckets"]:
+                counts[code["key"]] += int(code["count"]["value"])
+
         default_zero = {code: "0" for code in codes}
         return [
-            (
-                {"firmware": bucket["key"]["firmware"], "total": bucket["doc_count"]}
-                | default_zero
-                | {code["key"]: code["doc_count"] for code in bucket["filtered"]["code"]["buckets"]}
-            )
-            for bucket in chart_data
+            {"firmware": firmware, "total": total} | default_zero | dict(code_counts[firmware])  # type: ignore
+            for firmware, total in sorted(totals.items())
         ]
@@ -0,0 +1,198 @@
+import hashlib
+from collections import Counter
+from collections.abc import Iterable, Iterator, Sequence
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+import orjson
+from typing_extensions import Self
+
+from sl_statistics_backend.log_stream import LogRecord
+
+# UPS clocks run on italian local time
+LOG_TIMEZONE = ZoneInfo("Europe/Rome")
+
+
+@lru_cache(maxsize=8192)
+def _hour_timezone(hour: datetime) -> timezone:
+    # Europe/Rome only changes offset on the hour, so a per-hour table is exact. Times skipped or repeated by DST
+    # changes resolve like the pipeline's `date` processor does: to the offset in effect before the change.
+    return timezone(hour.replace(tzinfo=LOG_TIMEZONE).utcoffset())  # type: ignore
+
+
+def localize(timestamp: datetime) -> datetime:
+    return timestamp.replace(tzinfo=_hour_timezone(timestamp.replace(minute=0, second=0, microsecond=0)))
+
+
+def _source_tail(file_name: str, append_id: str | None) -> bytes:
+    # fields shared by all the documents of an upload, closing their JSON object
+    tail = b',"file":' + orjson.dumps(file_name)
+    if append_id is not None:
+        tail += b',"append_id":' + orjson.dumps(append_id)
+    return tail + b"}\n"
+
+
+def _id_prefix(file_name: str, append_id: str | None) -> str:
+    prefix = hashlib.sha1(file_name.encode()).hexdigest()[:16]
+    return prefix if append_id is None else f"{prefix}-{append_id}"
+
+
+def _create_metas(index: str, ids: Iterable[str], pipeline: str | None = None) -> Iterator[bytes]:
+    # `create` rather than `index`: sent again, after a failure, the documents already stored are just skipped
+    head = orjson.dumps({"create": {"_index": index} | ({"pipeline": pipeline} if pipeline else {})})[:-2]
+    return (head + b',"_id":' + orjson.dumps(doc_id) + b"}}\n" for doc_id in ids)
+
+
+def document_ids(
+    file_name: str, record_count: int, append_id: str | None = None, rows: Sequence[int] | None = None
+) -> list[str]:
+    """IDs of the entries at `rows` (the first `record_count` ones by default) of an upload of `file_name`.
+
+    The same rows of the same file always get the same IDs, which is what makes sending them again safe.
+    """
+    prefix = _id_prefix(file_name, append_id)
+    return [f"{prefix}-{row}" for row in (range(record_count) if rows is None else rows)]
+
+
+def index_actions(  # noqa: PLR0913
+    index: str,
+    file_name: str,
+    records: list[LogRecord],
+    pipeline: str | None = None,
+    append_id: str | None = None,
+    rows: Sequence[int] | None = None,
+) -> list[bytes]:
+    # bulk actions (metadata and source lines) encoded straight from the parsed records, at `rows` of the upload
+    tail = _source_tail(file_name, append_id)
+    metas = _create_metas(index, document_ids(file_name, len(records), append_id, rows), pipeline)
+    if pipeline is not None:
+        # the pipeline takes the whole record, plus the file it comes from
+        return [meta + orjson.dumps(record)[:-1] + tail for meta, record in zip(metas, records, strict=True)]
+    # same documents the `<index>-pipeline` ingest pipeline would produce, so without `color` and `snapshot`
+    return [
+        meta
+        + orjson.dumps(
+            {
+                "@timestamp": localize(record.timestamp),
+                "timestamp": record.timestamp,
+                "unit": record.unit,
+                "subunit": record.subunit,
+                "unit_subunit_id": record.unit_subunit_id,
+                "ini_filename": record.ini_filename,
+                "code": record.code,
+                "description": record.description,
+                "value": record.value,
+                "type_um": record.type_um,
+            }
+        )[:-1]
+        + tail
+        for meta, record in zip(metas, records, strict=True)
+    ]
+
+
+def is_event(record: LogRecord) -> bool:
+    # only BIN events turning ON are ever charted
+    return record.type_um == "BIN" and record.value == "ON"
+
+
+def event_actions(
+    index: str,
+    file_name: str,
+    records: list[LogRecord],
+    append_id: str | None = None,
+    rows: Sequence[int] | None = None,
+) -> list[bytes]:
+    # the events among `records`, with only the fields charts need and the IDs of their entries
+    ids = document_ids(file_name, len(records), append_id, rows)
+    tail = _source_tail(file_name, append_id)
+    return [
+        meta
+        + orjson.dumps(
+            {
+                "@timestamp": localize(record.timestamp),
+                "code": record.code,
+                "ini_filename": record.ini_filename,
+                "unit_subunit_id": record.unit_subunit_id,
+            }
+        )[:-1]
+        + tail
+        for meta, record in zip(_create_metas(index, ids), records, strict=True)
+        if is_event(record)
+    ]
+
+
+RollupKey = tuple[str, str, int, datetime]
+
+
+def count_rollups(records: list[LogRecord], counts: Counter[RollupKey]) -> None:
+    counts.update(
+        (
+            record.ini_filename,
+            record.code,
+            record.unit_subunit_id,
+            record.timestamp.replace(minute=0, second=0, microsecond=0),
+        )
+        for record in records
+        if is_event(record)
+    )
+
+
+def rollup_actions(index: str, file_name: str, counts: Counter[RollupKey], append_id: str | None = None) -> list[bytes]:
+    # one document per file, firmware, code, subunit and hour, with the number of events in it
+    prefix = _id_prefix(file_name, append_id)
+    ids = (f"{prefix}-{hashlib.sha1(orjson.dumps(key)).hexdigest()[:16]}" for key in counts)
+    tail = _source_tail(file_name, append_id)
+    return [
+        meta
+        + orjson.dumps(
+            {
+                "@timestamp": localize(hour),
+                "ini_filename": ini_filename,
+                "code": code,
+                "unit_subunit_id": unit_subunit_id,
+                "count": count,
+            }
+        )[:-1]
+        + tail
+        for meta, ((ini_filename, code, unit_subunit_id, hour), count) in zip(
+            _create_metas(index, ids), counts.items(), strict=True
+        )
+    ]
+
+
+@dataclass(slots=True)
+class LogSummary:
+    """Running totals of a log being uploaded, for its registry document and its rollups."""
+
+    entry_count: int = 0
+    first_timestamp: datetime | None = None
+    last_timestamp: datetime | None = None
+    firmwares: set[str] = field(default_factory=set)
+    rollups: Counter[RollupKey] = field(default_factory=Counter)
+
+    def add(self: Self, records: list[LogRecord]) -> None:
+        if not records:
+            return
+        self.entry_count += len(records)
+        first, last = min(record.timestamp for record in records), max(record.timestamp for record in records)
+        self.first_timestamp = first if self.first_timestamp is None else min(self.first_timestamp, first)
+        self.last_timestamp = last if self.last_timestamp is None else max(self.last_timestamp, last)
+        self.firmwares.update(record.ini_filename for record in records)
+        count_rollups(records, self.rollups)
+
+
+def registry_document(
+    file_name: str, summary: LogSummary, uploaded_at: datetime | None, content_hash: str | None = None
+) -> dict[str, object]:
+    # timestamps are stored like the entries' `@timestamp`
+    return {
+        "file": file_name,
+        "entry_count": summary.entry_count,
+        "first_entry_timestamp": summary.first_timestamp and localize(summary.first_timestamp).isoformat(),
+        "last_entry_timestamp": summary.last_timestamp and localize(summary.last_timestamp).isoformat(),
+        "firmwares": sorted(summary.firmwares),
+        "content_hash": content_hash,
+        "uploaded_at": uploaded_at and uploaded_at.isoformat(),
+    }
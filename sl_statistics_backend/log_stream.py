@@ -0,0 +1,187 @@
+import csv
+from asyncio import Future, get_running_loop
+from collections import deque
+from collections.abc import AsyncIterable, AsyncIterator
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from datetime import datetime
+
+from sl_parser import Unit
+from sl_parser.logentry import LOG_ENTRY_DATETIME_FORMAT
+from sl_parser.logfile import HEADER_DATETIME_FORMAT, INI_FILENAME_PREFIX, UNIT_SUBUNIT_RE
+from typing_extensions import Self
+
+# cp1252 is a single byte encoding, so every complete line can be decoded on its own
+LOG_ENCODING = "cp1252"
+
+
+class LogParseError(Exception):
+    message: str
+
+    def __init__(self: Self, message: str, *args: object) -> None:
+        # the message is also passed to `Exception` so that the error survives the trip back from a pool worker
+        super().__init__(message, *args)
+        self.message = message
+
+
+@dataclass(slots=True)
+class LogRecord:
+    # same fields as `sl_parser.LogEntry`, without the cost of validating a pydantic model for every row
+    timestamp: datetime
+    unit: int
+    subunit: int
+    unit_subunit_id: int
+    ini_filename: str
+    code: str
+    description: str
+    value: str
+    type_um: str
+    snapshot: str
+    color: str
+
+
+_DATE_LENGTH = len("dd/mm/yyyy")
+_TIME_LENGTH = len("hh:mm:ss.fff")
+
+
+def _parse_timestamp(date: str, time: str) -> datetime:
+    # `strptime` is by far the slowest part of parsing a row, so the usual `dd/mm/yyyy hh:mm:ss.fff` is done by hand
+    if (
+        len(date) == _DATE_LENGTH
+        and len(time) == _TIME_LENGTH
+        and date[2] == date[5] == "/"
+        and time[2] == time[5] == ":"
+        and time[8] == "."
+    ):
+        return datetime(
+            int(date[6:]),
+            int(date[3:5]),
+            int(date[:2]),
+            int(time[:2]),
+            int(time[3:5]),
+            int(time[6:8]),
+            int(time[9:]) * 1000,
+        )
+    return datetime.strptime(f"{date} {time}000", LOG_ENTRY_DATETIME_FORMAT)
+
+
+def _parse_row(row: list[str], units_subunits: dict[int, Unit]) -> LogRecord:
+    unit, subunit = int(row[2]), int(row[3])
+    return LogRecord(
+        timestamp=_parse_timestamp(row[0], row[1]),
+        unit=unit,
+        subunit=subunit,
+        unit_subunit_id=(unit << 4) | subunit,
+        ini_filename=units_subunits[unit].subunits[subunit],
+        code=row[4],
+        description=row[5],
+        value=row[6],
+        type_um=row[7],
+        snapshot=row[8],
+        color=row[9],
+    )
+
+
+def parse_rows(data: bytes, units_subunits: dict[int, Unit]) -> list[LogRecord]:
+    try:
+        return [
+            _parse_row([r.strip() for r in row], units_subunits)
+            for row in csv.reader(data.decode(LOG_ENCODING).splitlines(), delimiter=";")
+            if row
+            and row[0].strip() != "01/01/0001"
+            and row[1].strip() != "00:00:00.000"  # some logs contain "empty" rows with this timestamp
+        ]
+    except Exception as e:
+        raise LogParseError(repr(e)) from e
+
+
+class LogStreamParser:
+    """Incremental version of `LogFile.parse_log`.
+
+    The header is parsed as soon as it is fed, while the rows are handed back as blocks of complete lines for
+    `parse_rows`, which can then run anywhere (including another process).
+    """
+
+    filename: str
+    pc_datetime: datetime | None
+    ups_datetime: datetime | None
+    units_subunits: dict[int, Unit]
+    _header_done: bool
+    _buffer: bytes
+
+    def __init__(self: Self, filename: str) -> None:
+        self.filename = filename
+        self.pc_datetime = None
+        self.ups_datetime = None
+        self.units_subunits = {}
+        self._header_done = False
+        self._buffer = b""
+
+    def feed(self: Self, data: bytes) -> bytes:
+        self._buffer += data
+        end = self._buffer.rfind(b"\n")
+        if end == -1:
+            return b""
+        lines, self._buffer = self._buffer[: end + 1], self._buffer[end + 1 :]
+        return self._consume_header(lines)
+
+    def close(self: Self) -> bytes:
+        lines, self._buffer = self._buffer, b""
+        rows = self._consume_header(lines)
+        if not self._header_done:
+            raise LogParseError("Truncated log header")
+        return rows
+
+    def _consume_header(self: Self, data: bytes) -> bytes:
+        start = 0
+        while not self._header_done and start < len(data):
+            end = data.find(b"\n", start)
+            end = len(data) if end == -1 else end
+            try:
+                self._parse_header_line(data[start:end].decode(LOG_ENCODING).strip("\r\n"))
+            except Exception as e:
+                raise LogParseError(repr(e)) from e
+            start = end + 1
+        return data[start:]
+
+    def _parse_header_line(self: Self, line: str) -> None:
+        if self.pc_datetime is None:
+            self.pc_datetime = datetime.strptime(line.split(": ")[1], HEADER_DATETIME_FORMAT)
+        elif self.ups_datetime is None:
+            self.ups_datetime = datetime.strptime(line.split(": ")[1], HEADER_DATETIME_FORMAT)
+        elif line.startswith(INI_FILENAME_PREFIX):
+            ini_file, unit_subunit_str = line.removeprefix(INI_FILENAME_PREFIX).split(";")
+            unit, subunit = (
+                int(i) for i in UNIT_SUBUNIT_RE.fullmatch(unit_subunit_str.strip()).groups()  # type: ignore
+            )
+            if subunit == 0:
+                self.units_subunits[unit] = Unit(ini_file=ini_file)
+            self.units_subunits[unit].subunits[subunit] = ini_file
+        else:
+            self._header_done = True  # this is the column headers line
+
+
+async def parse_log_stream(
+    filename: str, chunks: AsyncIterable[bytes], executor: Executor | None = None, max_pending: int = 2
+) -> AsyncIterator[list[LogRecord]]:
+    # rows are parsed in `executor` (the loop's default one if None), with up to `max_pending` blocks being parsed
+    # while the caller consumes the previous ones; batches are still yielded in file order
+    parser = LogStreamParser(filename)
+    loop = get_running_loop()
+    pending: deque[Future[list[LogRecord]]] = deque()
+
+    def submit(rows: bytes) -> None:
+        if rows:
+            pending.append(loop.run_in_executor(executor, parse_rows, rows, parser.units_subunits))
+
+    try:
+        async for chunk in chunks:
+            submit(parser.feed(chunk))
+            while len(pending) >= max_pending:
+                yield await pending.popleft()
+        submit(parser.close())
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for future in pending:
+            future.cancel()
@@ -1,6 +1,11 @@
 from .chartfilterdata import ChartFilterData  # noqa: F401
 from .histogramentry import HistogramEntry  # noqa: F401
+from .ingestjob import IngestJob, IngestJobStatus  # noqa: F401
+from .ingeststats import IngestStats  # noqa: F401
+from .logdeletion import LogDeletion  # noqa: F401
 from .logfrequencyentry import LogFrequencyEntry  # noqa: F401
 from .logoverview import LogOverview, MaxCountEntry  # noqa: F401
+from .querycachestats import QueryCacheStats  # noqa: F401
+from .singleflightstats import SingleFlightStats  # noqa: F401
 from .storedlogfile import StoredLogFile  # noqa: F401
 from .storedloglist import StoredLogList  # noqa: F401
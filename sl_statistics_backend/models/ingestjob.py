@@ -0,0 +1,27 @@
+from datetime import datetime
+from enum import Enum
+
+from pydantic import BaseModel
+
+from .ingeststats import IngestStats
+
+
+class IngestJobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+class IngestJob(BaseModel):
+    job_id: str
+    file_name: str
+    status: IngestJobStatus = IngestJobStatus.QUEUED
+    rows_parsed: int = 0
+    docs_indexed: int = 0
+    docs_per_second: float = 0
+    errors: list[str] = []
+    submitted_at: datetime
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    stats: IngestStats | None = None
@@ -0,0 +1,20 @@
+from pydantic import BaseModel
+
+
+class IngestStats(BaseModel):
+    count: int
+    size_bytes: int
+    elapsed_seconds: float
+    docs_per_second: float
+    mb_per_second: float
+
+    @staticmethod
+    def from_measurements(count: int, size_bytes: int, elapsed_seconds: float) -> "IngestStats":
+        elapsed = elapsed_seconds or float("inf")
+        return IngestStats(
+            count=count,
+            size_bytes=size_bytes,
+            elapsed_seconds=elapsed_seconds,
+            docs_per_second=count / elapsed,
+            mb_per_second=size_bytes / (1024 * 1024) / elapsed,
+        )
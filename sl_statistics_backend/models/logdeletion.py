@@ -0,0 +1,9 @@
+from pydantic import BaseModel
+
+
+class LogDeletion(BaseModel):
+    task_id: str
+    completed: bool
+    total: int
+    deleted: int
+    errors: list[str] = []
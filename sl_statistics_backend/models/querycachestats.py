@@ -0,0 +1,10 @@
+from pydantic import BaseModel
+
+
+class QueryCacheStats(BaseModel):
+    entries: int
+    max_entries: int
+    generation: int
+    hits: int
+    misses: int
+    evictions: int
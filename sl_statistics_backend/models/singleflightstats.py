@@ -0,0 +1,7 @@
+from pydantic import BaseModel
+
+
+class SingleFlightStats(BaseModel):
+    calls: int
+    coalesced: int
+    in_flight: int
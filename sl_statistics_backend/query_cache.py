@@ -0,0 +1,299 @@
+import inspect
+import os
+import sqlite3
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable
+from datetime import datetime
+from functools import wraps
+from time import monotonic, time
+from typing import Any, TypeVar, get_args, get_type_hints
+
+import orjson
+from pydantic import BaseModel, parse_obj_as
+from pydantic.json import pydantic_encoder
+from typing_extensions import Self
+
+from sl_statistics_backend.models import QueryCacheStats
+
+T = TypeVar("T")
+
+
+class QueryCache:
+    """LRU cache of query results, holding up to `max_entries` results for at most `ttl` seconds.
+
+    Every cached result belongs to a data generation: `bump_generation` (called whenever logs are added or removed)
+    makes all of them stale at once.
+    """
+
+    max_entries: int
+    ttl: float
+    hits: int
+    misses: int
+    evictions: int
+    _generation: int
+    _entries: OrderedDict[Hashable, tuple[int, float, Any]]
+
+    def __init__(self: Self, max_entries: int = 1024, ttl: float = 300) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._generation = 0
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()
+
+    @property
+    def generation(self: Self) -> int:
+        return self._generation
+
+    def get(self: Self, key: Hashable, result_type: type = object) -> tuple[bool, Any]:
+        # `result_type` is only needed by caches holding serialized results
+        entry = self._entries.get(key)
+        if entry is not None:
+            generation, expires_at, value = entry
+            if generation == self.generation and expires_at > monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, value
+            del self._entries[key]
+        self.misses += 1
+        return False, None
+
+    def put(self: Self, key: Hashable, value: object, generation: int) -> None:
+        # `generation` is the one the query started in: results computed while the data was changing are dropped
+        if generation != self.generation:
+            return
+        self._entries[key] = (generation, monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def bump_generation(self: Self) -> None:
+        self._generation += 1
+        self._entries.clear()
+
+    @property
+    def stats(self: Self) -> QueryCacheStats:
+        return QueryCacheStats(
+            entries=len(self._entries),
+            max_entries=self.max_entries,
+            generation=self.generation,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+        )
+
+
+def _has_models(result_type: object) -> bool:
+    # plain JSON values decode back to themselves, while parsing them could coerce them (ints in `dict[str, str]`)
+    if isinstance(result_type, type) and issubclass(result_type, BaseModel):
+        return True
+    return any(_has_models(arg) for arg in get_args(result_type))
+
+
+# seconds workers wait for each other's writes, blocking their event loop, before skipping the cache
+_LOCK_TIMEOUT = 0.05
+# generation reported while the database is locked, which no result is ever cached in
+_UNKNOWN_GENERATION = -1
+# number of cached results reported while the database is locked
+_UNKNOWN_ENTRIES = -1
+
+_SHARED_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS generation (id INTEGER PRIMARY KEY CHECK (id = 0), value INTEGER NOT NULL);
+INSERT OR IGNORE INTO generation VALUES (0, 0);
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    value BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+"""
+
+
+class SharedQueryCache(QueryCache):
+    """`QueryCache` kept in the SQLite database at `path`, shared by all the worker processes using it.
+
+    Results are stored as JSON next to the data generation, so logs uploaded or deleted through one worker invalidate
+    the results cached by all of them. Hit, miss and eviction counters are per process. While other workers hold the
+    database for longer than `_LOCK_TIMEOUT`, queries just skip the cache.
+    """
+
+    path: str
+    _connection: sqlite3.Connection | None
+    _pid: int
+    _bump_pending: bool
+    _last_used: dict[str, float]
+
+    def __init__(self: Self, path: str, max_entries: int = 1024, ttl: float = 300) -> None:
+        super().__init__(max_entries, ttl)
+        self.path = path
+        self._connection = None
+        self._pid = 0
+        self._bump_pending = False
+        self._last_used = {}
+
+    def _db(self: Self) -> sqlite3.Connection:
+        # connections can't be shared with forked processes, and gunicorn may fork workers after importing the app
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=_LOCK_TIMEOUT, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(_SHARED_CACHE_SCHEMA)
+            self._pid = os.getpid()
+        return self._connection
+
+    @staticmethod
+    def _key(key: Hashable) -> str:
+        return orjson.dumps(key).decode()
+
+    def _bumped(self: Self) -> bool:
+        # a generation bump that couldn't get the lock is retried before anything else is read or written, so that
+        # this worker never serves results from before the data changed
+        if not self._bump_pending:
+            return True
+        try:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            return False
+        try:
+            db.execute("UPDATE generation SET value = value + 1")
+            db.execute("DELETE FROM results")
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        self._bump_pending = False
+        self._last_used.clear()
+        return True
+
+    @property
+    def generation(self: Self) -> int:
+        if not self._bumped():
+            return _UNKNOWN_GENERATION
+        try:
+            return self._db().execute("SELECT value FROM generation").fetchone()[0]
+        except sqlite3.OperationalError:
+            return _UNKNOWN_GENERATION
+
+    def get(self: Self, key: Hashable, result_type: type = object) -> tuple[bool, Any]:
+        now = time()
+        try:
+            row = (
+                self._db()
+                .execute(
+                    "SELECT results.value FROM results JOIN generation ON results.generation = generation.value"
+                    " WHERE results.key = ? AND results.expires_at > ?",
+                    (self._key(key), now),
+                )
+                .fetchone()
+                if self._bumped()
+                else None
+            )
+        except sqlite3.OperationalError:  # the database is locked by other workers: just query ElasticSearch
+            row = None
+        if row is None:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        # hits are only reads: the times they were used at are written along with the next result
+        self._last_used[self._key(key)] = now
+        value = orjson.loads(row[0])
+        return True, parse_obj_as(result_type, value) if _has_models(result_type) else value
+
+    def put(self: Self, key: Hashable, value: object, generation: int) -> None:
+        if generation == _UNKNOWN_GENERATION or not self._bumped():
+            return
+        now = time()
+        try:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            return
+        try:
+            if db.execute("SELECT value FROM generation").fetchone()[0] == generation:
+                db.executemany(
+                    "UPDATE results SET last_used = ? WHERE key = ?",
+                    [(last_used, used_key) for used_key, last_used in self._last_used.items()],
+                )
+                db.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                    (self._key(key), generation, now + self.ttl, now, orjson.dumps(value, default=pydantic_encoder)),
+                )
+                db.execute("DELETE FROM results WHERE expires_at <= ?", (now,))
+                (count,) = db.execute("SELECT COUNT(*) FROM results").fetchone()
+                if count > self.max_entries:
+                    self.evictions += db.execute(
+                        "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_used LIMIT ?)",
+                        (count - self.max_entries,),
+                    ).rowcount
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        self._last_used.clear()
+
+    def bump_generation(self: Self) -> None:
+        self._bump_pending = True
+        self._bumped()
+
+    @property
+    def stats(self: Self) -> QueryCacheStats:
+        try:
+            (entries,) = self._db().execute("SELECT COUNT(*) FROM results").fetchone()
+        except sqlite3.OperationalError:
+            entries = _UNKNOWN_ENTRIES
+        return QueryCacheStats(
+            entries=entries,
+            max_entries=self.max_entries,
+            generation=self.generation,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+        )
+
+    def close(self: Self) -> None:
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        self._connection = None
+
+
+def _normalize(arg: object) -> Hashable:
+    if isinstance(arg, datetime):
+        return arg.isoformat()
+    if isinstance(arg, list | tuple | set):
+        # lists of query parameters are only used as filters, so neither their order nor duplicates matter
+        return tuple(sorted(set(arg)))
+    return arg  # type: ignore
+
+
+def query_key(query: str, *args: object) -> tuple[Hashable, ...]:
+    """Key identifying a `LogDatabase` query with the given arguments."""
+    return (query, *(_normalize(arg) for arg in args))
+
+
+def cached_query(method: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    """Caches the results of a `LogDatabase` query method in its `query_cache`, keyed by the query's arguments."""
+
+    result_type = get_type_hints(method)["return"]
+    signature = inspect.signature(method)
+
+    @wraps(method)
+    async def wrapper(self: Any, *args: object, **kwargs: object) -> T:  # noqa: ANN401
+        cache: QueryCache | None = self.query_cache
+        if cache is None:
+            return await method(self, *args, **kwargs)
+        # the same query however its arguments are passed, and whether or not the defaults are spelled out
+        arguments = signature.bind(self, *args, **kwargs)
+        arguments.apply_defaults()
+        key = query_key(method.__name__, *list(arguments.arguments.values())[1:])
+        hit, value = cache.get(key, result_type)
+        if hit:
+            return value
+        generation = cache.generation
+        value = await method(self, *args, **kwargs)
+        cache.put(key, value, generation)
+        return value
+
+    return wrapper
@@ -2,7 +2,11 @@ from .countresponse import CountResponse  # noqa: F401
 from .errorresponse import ErrorResponse  # noqa: F401
 from .firmwarechartparams import FirmwareChartParams  # noqa: F401
 from .histogram import Histogram  # noqa: F401
+from .ingestjobresponse import IngestJobResponse  # noqa: F401
+from .logbatchupload import LogBatchUpload  # noqa: F401
+from .logbatchuploadresult import LogBatchFileResult, LogBatchUploadResult  # noqa: F401
 from .logdelete import LogDelete  # noqa: F401
+from .logdeletionresponse import LogDeletionResponse  # noqa: F401
 from .logfrequency import LogFrequency  # noqa: F401
 from .logfrequencyparams import LogFrequencyParams  # noqa: F401
 from .logoverviewparams import LogOverviewParams  # noqa: F401
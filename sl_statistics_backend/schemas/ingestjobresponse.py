@@ -0,0 +1,5 @@
+from pydantic import BaseModel
+
+
+class IngestJobResponse(BaseModel):
+    job_id: str
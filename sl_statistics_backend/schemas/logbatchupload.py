@@ -0,0 +1,6 @@
+from pydantic import BaseModel
+from spectree import BaseFile
+
+
+class LogBatchUpload(BaseModel):
+    archive: BaseFile
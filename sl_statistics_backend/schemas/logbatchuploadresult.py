@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+
+from sl_statistics_backend.models import IngestStats
+
+
+class LogBatchFileResult(BaseModel):
+    file_name: str
+    stats: IngestStats | None = None
+    error: str | None = None
+
+
+class LogBatchUploadResult(BaseModel):
+    results: list[LogBatchFileResult]
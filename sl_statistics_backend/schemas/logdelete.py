@@ -3,3 +3,5 @@ from pydantic import BaseModel
 
 class LogDelete(BaseModel):
     log: str
+    # throttles the deletion, so that it doesn't slow charts down; unlimited by default
+    requests_per_second: float | None = None
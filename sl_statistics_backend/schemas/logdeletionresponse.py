@@ -0,0 +1,5 @@
+from pydantic import BaseModel
+
+
+class LogDeletionResponse(BaseModel):
+    task_id: str
@@ -4,3 +4,6 @@ from spectree import BaseFile
 
 class LogUpload(BaseModel):
     log: BaseFile
+    background: bool = False
+    # update a log already uploaded with a newer copy of it, indexing only its new entries
+    append: bool = False
@@ -1,5 +1,14 @@
+from pydantic import Field
+
+from sl_statistics_backend.downsampling import MIN_POINTS, Downsampling
+
 from .logfrequencyparams import LogFrequencyParams
 
 
 class TimeChartParams(LogFrequencyParams):
     selected_codes: list[str]
+    # fixed width of the bars, like "30m" or "1h" (units are ms, s, m, h and d), picked automatically if missing
+    interval: str | None = Field(None, regex=r"^[1-9]\d*(ms|s|m|h|d)$")
+    # at most this many bars are returned, picked by `downsampling`
+    points: int | None = Field(None, ge=MIN_POINTS)
+    downsampling: Downsampling = Downsampling.MAX
@@ -0,0 +1,12 @@
+from sl_statistics_backend import log_db, query_flights
+from sl_statistics_backend.models import QueryCacheStats, SingleFlightStats
+
+
+def query_cache_stats() -> QueryCacheStats:
+    if log_db.query_cache is None:
+        return QueryCacheStats(entries=0, max_entries=0, generation=0, hits=0, misses=0, evictions=0)
+    return log_db.query_cache.stats
+
+
+def coalesced_query_stats() -> SingleFlightStats:
+    return query_flights.stats
@@ -1,20 +1,35 @@
+from functools import partial
+
 from starlette.datastructures import QueryParams
 
-from sl_statistics_backend import log_db
+from sl_statistics_backend import log_db, query_flights
 from sl_statistics_backend.models import ChartFilterData, HistogramEntry
+from sl_statistics_backend.query_cache import query_key
 from sl_statistics_backend.schemas import FirmwareChartParams, LogOverviewParams, TimeChartParams
 
 
 async def get_chart_filter_data(qp: QueryParams) -> ChartFilterData:
     params = LogOverviewParams(**qp)  # type: ignore
-    return await log_db.chart_filters(params.start, params.end)
+    return await query_flights.run(
+        query_key("chart_filters", params.start, params.end), partial(log_db.chart_filters, params.start, params.end)
+    )
 
 
 async def get_firmware_chart_data(data: dict) -> list[HistogramEntry]:
     params = FirmwareChartParams(**data)
-    return await log_db.firmware_chart_data(params.start, params.end, params.selected_firmwares, params.selected_codes)
+    args = (params.start, params.end, params.selected_firmwares, params.selected_codes)
+    return await query_flights.run(query_key("firmware_chart_data", *args), partial(log_db.firmware_chart_data, *args))
 
 
 async def get_time_chart_data(data: dict) -> list[HistogramEntry]:
     params = TimeChartParams(**data)
-    return await log_db.time_chart_data(params.start, params.end, params.selected_subunits, params.selected_codes)
+    args = (
+        params.start,
+        params.end,
+        params.selected_subunits,
+        params.selected_codes,
+        params.interval,
+        params.points,
+        params.downsampling,
+    )
+    return await query_flights.run(query_key("time_chart_data", *args), partial(log_db.time_chart_data, *args))
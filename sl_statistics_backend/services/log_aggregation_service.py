@@ -1,15 +1,23 @@
+from functools import partial
+
 from starlette.datastructures import QueryParams
 
-from sl_statistics_backend import log_db
+from sl_statistics_backend import log_db, query_flights
 from sl_statistics_backend.models import LogFrequencyEntry, LogOverview
+from sl_statistics_backend.query_cache import query_key
 from sl_statistics_backend.schemas import LogFrequencyParams, LogOverviewParams
 
 
 async def selected_log_overview(qp: QueryParams) -> LogOverview:
     params = LogOverviewParams(**qp)  # type: ignore
-    return await log_db.log_overview(params.start, params.end)
+    return await query_flights.run(
+        query_key("log_overview", params.start, params.end), partial(log_db.log_overview, params.start, params.end)
+    )
 
 
 async def log_frequency_analysis(data: dict) -> list[LogFrequencyEntry]:
     params = LogFrequencyParams(**data)
-    return await log_db.log_entries_frequency(params.start, params.end, params.selected_subunits)
+    args = (params.start, params.end, params.selected_subunits)
+    return await query_flights.run(
+        query_key("log_entries_frequency", *args), partial(log_db.log_entries_frequency, *args)
+    )
@@ -1,15 +1,48 @@
-from sl_parser import LogFile
+import hashlib
+from asyncio import Queue, create_task, gather
+from collections.abc import AsyncIterable, AsyncIterator, Awaitable, Callable
+from datetime import datetime
+from functools import partial
+from tempfile import SpooledTemporaryFile
+from typing import IO
+
+from starlette.concurrency import run_in_threadpool
 from starlette.datastructures import FormData, UploadFile
+from typing_extensions import Self
 
-from sl_statistics_backend import log_db
+from sl_statistics_backend import config, ingest_jobs, log_db, parser_pool
+from sl_statistics_backend.ingest_jobs import IngestQueueFullError
+from sl_statistics_backend.log_archive import LogArchive, LogArchiveError
 from sl_statistics_backend.log_database import LogDatabaseError
-from sl_statistics_backend.models import StoredLogList
-from sl_statistics_backend.schemas import LogDelete, LogUpload
+from sl_statistics_backend.log_stream import LogParseError, LogRecord, parse_log_stream
+from sl_statistics_backend.models import IngestJob, IngestStats, LogDeletion, StoredLogList
+from sl_statistics_backend.schemas import (
+    LogBatchFileResult,
+    LogBatchUpload,
+    LogBatchUploadResult,
+    LogDelete,
+    LogUpload,
+)
+
+
+class LogDeleteError(Exception):
+    message: str
+
+    def __init__(self, message: str, *args: object) -> None:
+        super().__init__(*args)
+        self.message = message
 
 
-async def delete_log_file(data: dict) -> int:
+async def delete_log_file(data: dict) -> str:
     delete_req = LogDelete(**data)
-    return await log_db.delete_log(delete_req.log)
+    try:
+        return await log_db.start_deletion(delete_req.log, delete_req.requests_per_second)
+    except LogDatabaseError as e:
+        raise LogDeleteError(e.message) from e
+
+
+async def get_log_deletion(task_id: str) -> LogDeletion | None:
+    return await log_db.deletion(task_id)
 
 
 async def list_log_files() -> StoredLogList:
@@ -24,7 +57,102 @@ class LogUploadError(Exception):
         self.message = message
 
 
-async def upload_log(form_data: FormData) -> int:
+def _upload_error(e: Exception) -> LogUploadError:
+    if isinstance(e, LogParseError):
+        return LogUploadError(f"Log parsing error: {e.message[:64]}")
+    if isinstance(e, LogDatabaseError):
+        return LogUploadError(e.message)
+    return LogUploadError(f"Error while uploading to ElasticSearch: {repr(e)[:64]}")
+
+
+async def _read_chunks(read: Callable[[int], Awaitable[bytes]]) -> AsyncIterator[bytes]:
+    # the multipart parser spools uploads to a temporary file, so this never holds more than a chunk in memory
+    while chunk := await read(config.UPLOAD_CHUNK_SIZE):
+        yield chunk
+
+
+def _hash_file(file: IO[bytes], copy_to: IO[bytes] | None = None) -> str:
+    # hashes the whole upload (copying it to `copy_to` on the way) and rewinds it, in a worker thread
+    content_hash = hashlib.sha256()
+    file.seek(0)
+    while chunk := file.read(config.UPLOAD_CHUNK_SIZE):
+        content_hash.update(chunk)
+        if copy_to is not None:
+            copy_to.write(chunk)
+    file.seek(0)
+    return content_hash.hexdigest()
+
+
+def _hash_archive(archive: LogArchive) -> dict[str, str | None]:
+    content_hashes: dict[str, str | None] = {}
+    for file_name in archive.names:
+        try:
+            with archive.open(file_name) as member:
+                content_hashes[file_name] = _hash_file(member)
+        except Exception:  # a corrupted archive member fails later on, while parsing
+            content_hashes[file_name] = None
+    return content_hashes
+
+
+async def _check_content(content_hash: str, append_to: str | None = None) -> None:
+    # the same log is often uploaded again under another name (appending a log to itself just doesn't add anything)
+    try:
+        uploaded = await log_db.uploaded_content([content_hash])
+    except Exception as e:
+        raise _upload_error(e) from e
+    if uploaded and uploaded[content_hash] != append_to:
+        raise LogUploadError(f"Log file already uploaded as {uploaded[content_hash]}!")
+
+
+def _parse(file_name: str, chunks: AsyncIterable[bytes]) -> AsyncIterator[list[LogRecord]]:
+    return parse_log_stream(file_name, chunks, parser_pool, max_pending=max(config.PARSER_POOL_SIZE, 1) + 1)
+
+
+async def _prepend(
+    first_batch: list[LogRecord], record_batches: AsyncIterable[list[LogRecord]]
+) -> AsyncIterator[list[LogRecord]]:
+    if first_batch:
+        yield first_batch
+    async for batch in record_batches:
+        yield batch
+
+
+async def _run_upload_job(log_file: IO[bytes], content_hash: str, append: bool, job: IngestJob) -> IngestStats:
+    def on_indexed(count: int) -> None:
+        job.docs_indexed += count
+        elapsed = (datetime.now() - (job.started_at or job.submitted_at)).total_seconds()
+        job.docs_per_second = job.docs_indexed / (elapsed or float("inf"))
+
+    async def count_rows(record_batches: AsyncIterable[list[LogRecord]]) -> AsyncIterator[list[LogRecord]]:
+        async for batch in record_batches:
+            job.rows_parsed += len(batch)
+            yield batch
+
+    record_batches = _parse(job.file_name, _read_chunks(partial(run_in_threadpool, log_file.read)))
+    try:
+        return await log_db.upload(
+            job.file_name, count_rows(record_batches), on_indexed=on_indexed, content_hash=content_hash, append=append
+        )
+    except Exception as e:
+        raise _upload_error(e) from e
+    finally:
+        log_file.close()
+
+
+async def _enqueue_upload(log_file: UploadFile, file_name: str, append: bool) -> IngestJob:
+    # the request's own copy of the upload is closed as soon as the response is sent
+    job_file = SpooledTemporaryFile(max_size=config.UPLOAD_CHUNK_SIZE)
+    try:
+        content_hash = await run_in_threadpool(_hash_file, log_file.file, job_file)
+        job_file.seek(0)
+        await _check_content(content_hash, file_name if append else None)
+        return ingest_jobs.submit(file_name, partial(_run_upload_job, job_file, content_hash, append))
+    except (LogUploadError, IngestQueueFullError):
+        job_file.close()
+        raise
+
+
+async def upload_log(form_data: FormData) -> IngestStats | IngestJob:
     form = LogUpload(**form_data)  # type: ignore
     log_file = form.log
     if not isinstance(log_file, UploadFile):
@@ -33,14 +161,142 @@ async def upload_log(form_data: FormData) -> int:
         raise LogUploadError("Invalid log file")
     if log_file.filename is None:
         raise LogUploadError("Missing log file name")
-    content = await log_file.read()
+    if form.background:
+        return await _enqueue_upload(log_file, log_file.filename, form.append)
+    content_hash = await run_in_threadpool(_hash_file, log_file.file)
+    await _check_content(content_hash, log_file.filename if form.append else None)
+    record_batches = _parse(log_file.filename, _read_chunks(log_file.read))
+    try:
+        # parse the first chunk before indexing anything, so that files that aren't logs at all fail fast
+        first_batch = await anext(record_batches, [])
+        return await log_db.upload(
+            log_file.filename, _prepend(first_batch, record_batches), content_hash=content_hash, append=form.append
+        )
+    except Exception as e:
+        raise _upload_error(e) from e
+
+
+def get_ingest_job(job_id: str) -> IngestJob | None:
+    return ingest_jobs.get(job_id)
+
+
+class _ParsedLog:
+    # hands the batches of a log parsed in the background over to the upload, one file ahead at most
+    file_name: str
+    _batches: Queue[list[LogRecord] | Exception | None]
+    _done: bool
+
+    def __init__(self: Self, file_name: str) -> None:
+        self.file_name = file_name
+        self._batches = Queue(maxsize=max(config.PARSER_POOL_SIZE, 1) + 1)
+        self._done = False
+
+    async def put(self: Self, batch: list[LogRecord] | Exception | None) -> None:
+        await self._batches.put(batch)
+
+    async def __aiter__(self: Self) -> AsyncIterator[list[LogRecord]]:
+        while (batch := await self._batches.get()) is not None:
+            if isinstance(batch, Exception):
+                raise batch
+            yield batch
+        self._done = True
+
+    async def drain(self: Self) -> None:
+        # unblocks the parser if the upload stopped reading halfway through the file
+        while not self._done:
+            self._done = await self._batches.get() is None
+
+
+async def _parse_archive(archive: LogArchive, file_names: list[str], parsed: Queue[_ParsedLog | None]) -> None:
+    for file_name in file_names:
+        log = _ParsedLog(file_name)
+        await parsed.put(log)
+        try:
+            member = await run_in_threadpool(archive.open, file_name)
+            try:
+                async for batch in _parse(file_name, _read_chunks(partial(run_in_threadpool, member.read))):
+                    await log.put(batch)
+            finally:
+                member.close()
+        except LogParseError as e:
+            await log.put(e)
+        except Exception as e:  # a corrupted archive member only fails its own log
+            await log.put(LogParseError(repr(e)))
+        await log.put(None)
+    await parsed.put(None)
+
+
+async def _archive_duplicates(
+    archive: LogArchive, content_hashes: dict[str, str | None]
+) -> dict[str, LogBatchFileResult]:
     try:
-        parsed_log = LogFile.parse_log(log_file.filename, content.decode("cp1252"))
+        already_uploaded = await log_db.uploaded_logs(archive.names)
+        uploaded_content = await log_db.uploaded_content(list({h for h in content_hashes.values() if h is not None}))
     except Exception as e:
-        raise LogUploadError(f"Log parsing error: {repr(e)[:64]}") from e
+        raise _upload_error(e) from e
+    duplicates = {}
+    for file_name in archive.names:
+        content_hash = content_hashes[file_name]
+        if file_name in already_uploaded:
+            error = "Log file already uploaded!"
+        elif content_hash in uploaded_content:
+            error = f"Log file already uploaded as {uploaded_content[content_hash]}!"
+        elif content_hash is None:
+            continue
+        else:
+            # later copies of the same log in the archive are duplicates too
+            uploaded_content[content_hash] = file_name
+            continue
+        duplicates[file_name] = LogBatchFileResult(file_name=file_name, error=error)
+    return duplicates
+
+
+async def _upload_archive(archive: LogArchive) -> dict[str, LogBatchFileResult]:
+    content_hashes = await run_in_threadpool(_hash_archive, archive)
+    results = await _archive_duplicates(archive, content_hashes)
+    duplicates = len(results)
+    # the next log is parsed while the current one is being indexed
+    parsed: Queue[_ParsedLog | None] = Queue(maxsize=1)
+    parser = create_task(_parse_archive(archive, [name for name in archive.names if name not in results], parsed))
     try:
-        return await log_db.upload(parsed_log)
-    except LogDatabaseError as e:
+        while (log := await parsed.get()) is not None:
+            try:
+                stats = await log_db.upload(
+                    log.file_name,
+                    log,
+                    refresh=False,
+                    content_hash=content_hashes[log.file_name],
+                )
+                results[log.file_name] = LogBatchFileResult(file_name=log.file_name, stats=stats)
+            except Exception as e:
+                results[log.file_name] = LogBatchFileResult(file_name=log.file_name, error=_upload_error(e).message)
+                await log.drain()
+    finally:
+        parser.cancel()
+        await gather(parser, return_exceptions=True)
+    if len(results) > duplicates:
+        await log_db.refresh()
+    return results
+
+
+async def upload_log_batch(form_data: FormData) -> LogBatchUploadResult:
+    form = LogBatchUpload(**form_data)  # type: ignore
+    upload = form.archive
+    if not isinstance(upload, UploadFile):
+        raise LogUploadError("Everything is pretty fucked up.")
+    try:
+        archive = await run_in_threadpool(LogArchive, upload.file)
+    except LogArchiveError as e:
         raise LogUploadError(e.message) from e
-    except Exception as e:
-        raise LogUploadError(f"Error while uploading to ElasticSearch: {repr(e)[:64]}") from e
+    try:
+        results = await _upload_archive(archive)
+    finally:
+        await run_in_threadpool(archive.close)
+    # logs named like another one can't be told apart once stored, so they aren't uploaded
+    return LogBatchUploadResult(
+        results=[results[file_name] for file_name in archive.names]
+        + [
+            LogBatchFileResult(file_name=path, error="Another log in the archive has the same name!")
+            for path in archive.duplicates
+        ]
+    )
@@ -0,0 +1,37 @@
+from asyncio import Task, create_task, shield
+from collections.abc import Callable, Coroutine, Hashable
+from typing import Any, TypeVar
+
+from typing_extensions import Self
+
+from sl_statistics_backend.models import SingleFlightStats
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Coalesces concurrent identical calls: while a call for a key is in flight, callers with the same key share it."""
+
+    calls: int
+    coalesced: int
+    _in_flight: dict[Hashable, Task[Any]]
+
+    def __init__(self: Self) -> None:
+        self.calls = self.coalesced = 0
+        self._in_flight = {}
+
+    async def run(self: Self, key: Hashable, call: Callable[[], Coroutine[Any, Any, T]]) -> T:
+        self.calls += 1
+        task = self._in_flight.get(key)
+        if task is None:
+            task = create_task(call())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # a caller going away (e.g. a client disconnecting) doesn't cancel the call for the others
+        return await shield(task)
+
+    @property
+    def stats(self: Self) -> SingleFlightStats:
+        return SingleFlightStats(calls=self.calls, coalesced=self.coalesced, in_flight=len(self._in_flight))
@@ -0,0 +1,142 @@
+# ruff: noqa: PLR2004
+
+import asyncio
+import json
+from collections.abc import AsyncIterator
+from typing import Any
+from unittest.mock import AsyncMock
+
+import pytest
+from elasticsearch import ConnectionTimeout
+from elasticsearch.helpers import BulkIndexError
+
+from sl_statistics_backend.bulk_indexer import BulkIndexer, is_overloaded
+
+
+async def actions(count: int, batch_size: int = 4) -> AsyncIterator[list[bytes]]:
+    meta = b'{"index":{"_index":"test","pipeline":"test-pipeline"}}\n'
+    for start in range(0, count, batch_size):
+        yield [meta + json.dumps({"row": i}).encode() + b"\n" for i in range(start, min(start + batch_size, count))]
+
+
+def bulk_response(**_: object) -> dict[str, Any]:
+    return {"errors": False}
+
+
+@pytest.mark.asyncio
+async def test_index_chunks_by_document_count() -> None:
+    elastic = AsyncMock()
+    elastic.bulk.side_effect = bulk_response
+    stats = await BulkIndexer(elastic, chunk_size=3).index(actions(10))
+    assert stats.count == 10
+    assert [len(call.kwargs["operations"]) for call in elastic.bulk.call_args_list] == [3, 3, 3, 1]
+    assert elastic.bulk.call_args_list[0].kwargs["filter_path"] == ["errors", "items.*.error"]
+    meta, source = elastic.bulk.call_args_list[0].kwargs["operations"][0].splitlines()
+    assert json.loads(meta) == {"index": {"_index": "test", "pipeline": "test-pipeline"}}
+    assert json.loads(source) == {"row": 0}
+    assert stats.size_bytes == sum(
+        len(line) for call in elastic.bulk.call_args_list for line in call.kwargs["operations"]
+    )
+
+
+@pytest.mark.asyncio
+async def test_index_chunks_by_size() -> None:
+    elastic = AsyncMock()
+    elastic.bulk.side_effect = bulk_response
+    await BulkIndexer(elastic, chunk_size=1000, max_chunk_bytes=200).index(actions(10))
+    assert all(sum(len(line) for line in call.kwargs["operations"]) <= 200 for call in elastic.bulk.call_args_list)
+    assert sum(len(call.kwargs["operations"]) for call in elastic.bulk.call_args_list) == 10
+
+
+@pytest.mark.asyncio
+async def test_index_bounds_concurrency() -> None:
+    in_flight = 0
+    max_in_flight = 0
+
+    async def bulk(**_: object) -> dict[str, Any]:
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return bulk_response()
+
+    elastic = AsyncMock()
+    elastic.bulk.side_effect = bulk
+    stats = await BulkIndexer(elastic, chunk_size=1, max_concurrency=3).index(actions(10))
+    assert stats.count == 10
+    assert max_in_flight == 3
+
+
+@pytest.mark.asyncio
+async def test_index_raises_on_errors() -> None:
+    elastic = AsyncMock()
+    elastic.bulk.return_value = {
+        "errors": True,
+        "items": [{"index": {"status": 400, "error": {"type": "mapper_parsing_exception"}}}],
+    }
+    with pytest.raises(BulkIndexError) as e:
+        await BulkIndexer(elastic).index(actions(2))
+    assert len(e.value.errors) == 1
+
+
+@pytest.mark.asyncio
+async def test_index_wait_for_refresh() -> None:
+    elastic = AsyncMock()
+    elastic.bulk.side_effect = bulk_response
+    await BulkIndexer(elastic, chunk_size=3).index(actions(4))
+    assert elastic.bulk.call_args.kwargs["refresh"] is None
+    await BulkIndexer(elastic, chunk_size=3).index(actions(4), wait_for_refresh=True)
+    assert all(call.kwargs["refresh"] == "wait_for" for call in elastic.bulk.call_args_list[2:])
+
+
+def rejected(**_: object) -> dict[str, Any]:
+    # stored documents are left out of the response by `filter_path`
+    return {
+        "errors": True,
+        "items": [
+            {"create": {"status": 429, "error": {"type": "es_rejected_execution_exception"}}},
+            {"create": {"status": 409, "error": {"type": "version_conflict_engine_exception"}}},
+        ],
+    }
+
+
+def conflict(**_: object) -> dict[str, Any]:
+    return {
+        "errors": True,
+        "items": [{"create": {"status": 409, "error": {"type": "version_conflict_engine_exception"}}}],
+    }
+
+
+@pytest.mark.asyncio
+async def test_index_retries_when_overloaded() -> None:
+    elastic = AsyncMock()
+    elastic.bulk.side_effect = [rejected(), ConnectionTimeout("timed out"), conflict()]
+    indexed: list[int] = []
+    stats = await BulkIndexer(elastic, initial_backoff=0).index(actions(3), indexed.append)
+    # documents stored by the earlier attempts count as indexed
+    assert stats.count == 3
+    assert indexed == [3]
+    assert elastic.bulk.call_count == 3
+    assert elastic.bulk.call_args_list[0] == elastic.bulk.call_args_list[2]
+
+
+@pytest.mark.asyncio
+async def test_index_gives_up_when_overloaded() -> None:
+    elastic = AsyncMock()
+    elastic.bulk.side_effect = rejected
+    with pytest.raises(BulkIndexError) as e:
+        await BulkIndexer(elastic, max_retries=2, initial_backoff=0).index(actions(2))
+    assert is_overloaded(e.value)
+    assert elastic.bulk.call_count == 3
+
+    # errors caused by the documents themselves are never retried
+    elastic.bulk.reset_mock(side_effect=True)
+    elastic.bulk.return_value = {
+        "errors": True,
+        "items": [{"create": {"status": 400, "error": {"type": "mapper_parsing_exception"}}}],
+    }
+    with pytest.raises(BulkIndexError) as e:
+        await BulkIndexer(elastic, initial_backoff=0).index(actions(2))
+    assert not is_overloaded(e.value)
+    assert elastic.bulk.call_count == 1
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from sl_statistics_backend.bulk_load import BulkLoadSettings
+from tests.fake_elastic import FakeElastic
+
+
+@pytest.mark.asyncio
+async def test_apply() -> None:
+    elastic = FakeElastic()
+    elastic.indices.indices |= {"data-1", "data-2", "events"}
+    elastic.indices.settings["data-2"]["index.number_of_replicas"] = "2"
+    bulk_load = BulkLoadSettings(elastic, disable_replicas=True)  # type: ignore
+
+    async with bulk_load.apply(["data-*", "events"]):
+        assert elastic.indices.settings["data-1"] == {"index.refresh_interval": "-1", "index.number_of_replicas": "0"}
+        assert elastic.indices.settings["data-2"] == {"index.refresh_interval": "-1", "index.number_of_replicas": "0"}
+    # settings that weren't there are reset to their default
+    assert elastic.indices.settings["data-1"] == {}
+    assert elastic.indices.settings["data-2"] == {"index.number_of_replicas": "2"}
+    assert elastic.indices.settings["events"] == {}
+
+
+@pytest.mark.asyncio
+async def test_apply_overlapping() -> None:
+    elastic = FakeElastic()
+    elastic.indices.indices |= {"data", "events"}
+    bulk_load = BulkLoadSettings(elastic)  # type: ignore
+    second_done = asyncio.Event()
+
+    async def first() -> None:
+        async with bulk_load.apply(["data", "events"]):
+            await second_done.wait()
+            # `second` is done, but this upload is still writing to the index
+            assert elastic.indices.settings["events"] == {"index.refresh_interval": "-1"}
+
+    async def second() -> None:
+        async with bulk_load.apply(["events"]):
+            await asyncio.sleep(0)
+        second_done.set()
+
+    await asyncio.gather(first(), second())
+    assert elastic.indices.settings["data"] == elastic.indices.settings["events"] == {}
+
+
+@pytest.mark.asyncio
+async def test_apply_leaves_settings_alone() -> None:
+    elastic = FakeElastic()
+    elastic.indices.indices.add("data")
+    # already loading in another process, which will restore it
+    elastic.indices.settings["data"]["index.refresh_interval"] = "-1"
+    bulk_load = BulkLoadSettings(elastic)  # type: ignore
+    with pytest.raises(RuntimeError):
+        async with bulk_load.apply(["data"]):
+            raise RuntimeError
+    assert elastic.indices.settings["data"] == {"index.refresh_interval": "-1"}
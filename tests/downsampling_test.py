@@ -0,0 +1,37 @@
+# ruff: noqa: PLR2004
+
+import numpy as np
+import pytest
+
+from sl_statistics_backend.downsampling import Downsampling, downsample, lttb, max_buckets
+
+
+def test_max_buckets() -> None:
+    values = [1, 5, 2, 2, 0, 3, 7, 7, 1, 4]
+    # runs of 2, 3, 2 and 3 values, ties going to the first
+    assert max_buckets(values, 4).tolist() == [1, 2, 6, 7]
+    assert max_buckets(values, 20).tolist() == list(range(10))
+
+
+def test_lttb() -> None:
+    x = np.arange(100)
+    y = np.zeros(100)
+    y[40] = 10
+    y[70] = -10
+    selected = lttb(x, y, 10)
+    assert len(selected) == 10
+    assert selected[0] == 0
+    assert selected[-1] == 99
+    assert np.all(np.diff(selected) > 0)
+    # the peaks are what gives the line its shape
+    assert {40, 70} <= set(selected.tolist())
+
+    assert lttb(x[:5], y[:5], 10).tolist() == list(range(5))
+    with pytest.raises(ValueError, match="at least"):
+        lttb(x, y, 2)
+
+
+def test_downsample() -> None:
+    values = np.arange(10)
+    assert downsample(values, 5).tolist() == [1, 3, 5, 7, 9]
+    assert downsample(values, 5, Downsampling.LTTB).tolist()[::4] == [0, 9]
@@ -0,0 +1,259 @@
+import json
+import time
+from collections import defaultdict
+from datetime import datetime
+from fnmatch import fnmatch
+from typing import Any
+
+from elasticsearch import ConflictError, NotFoundError
+from typing_extensions import Self
+
+
+def _comparable(value: Any) -> Any:  # noqa: ANN401
+    # dates, stored and queried as ISO strings, compare as instants, and other keywords as strings
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def _in_range(value: Any, bounds: dict[str, Any]) -> bool:  # noqa: ANN401
+    compare = {
+        "gt": lambda bound: value > bound,
+        "gte": lambda bound: value >= bound,
+        "lt": lambda bound: value < bound,
+        "lte": lambda bound: value <= bound,
+    }
+    value = _comparable(value)
+    return all(compare[op](_comparable(bound)) for op, bound in bounds.items())
+
+
+def _source_value(source: dict[str, Any], doc: dict[str, Any]) -> Any:  # noqa: ANN401
+    if "terms" in source:
+        return doc.get(source["terms"]["field"])
+    # hourly date histograms, keyed by epoch millis like ElasticSearch
+    timestamp = datetime.fromisoformat(doc[source["date_histogram"]["field"]])
+    return int(timestamp.timestamp()) // 3600 * 3600 * 1000
+
+
+def _composite(composite: dict[str, Any], documents: list[dict[str, Any]]) -> dict[str, Any]:
+    # pages of buckets sorted by key, with ElasticSearch's default of 10 buckets a page
+    counts: dict[tuple[Any, ...], int] = defaultdict(int)
+    names = [next(iter(source)) for source in composite["sources"]]
+    for doc in documents:
+        key = tuple(_source_value(source[name], doc) for name, source in zip(names, composite["sources"], strict=True))
+        if None not in key:
+            counts[key] += 1
+    keys = sorted(counts)
+    if "after" in composite:
+        after = tuple(composite["after"][name] for name in names)
+        keys = [key for key in keys if key > after]
+    buckets = [{"key": dict(zip(names, key, strict=True)), "doc_count": counts[key]} for key in keys]
+    page = buckets[: composite.get("size", 10)]
+    return {"buckets": page} | ({"after_key": page[-1]["key"]} if page else {})
+
+
+class FakeIndices:
+    indices: set[str]
+    documents: dict[str, list[dict[str, Any]]]
+    settings: dict[str, dict[str, Any]]
+    created: dict[str, int]
+
+    def __init__(self: Self, documents: dict[str, list[dict[str, Any]]]) -> None:
+        self.indices = set()
+        self.documents = documents
+        self.settings = defaultdict(dict)
+        self.created = {}
+
+    async def exists(self: Self, index: str, **_: object) -> bool:
+        return any(fnmatch(name, index) for name in self.indices | self.documents.keys())
+
+    async def create(self: Self, index: str, **_: object) -> None:
+        self.indices.add(index)
+        self.created[index] = int(time.time() * 1000)
+
+    async def put_index_template(self: Self, **_: object) -> None:
+        pass
+
+    async def delete(self: Self, index: str, **_: object) -> None:
+        self.indices.discard(index)
+        self.documents.pop(index, None)
+        self.created.pop(index, None)
+
+    async def refresh(self: Self, index: str | list[str]) -> None:
+        pass
+
+    async def get_settings(self: Self, index: str, **_: object) -> dict[str, Any]:
+        names = sorted(name for name in self.indices | self.documents.keys() if fnmatch(name, index))
+        created = {name: {"index.creation_date": str(millis)} for name, millis in self.created.items()}
+        return {name: {"settings": dict(self.settings[name]) | created.get(name, {})} for name in names}
+
+    async def put_settings(self: Self, index: str, settings: dict[str, Any]) -> None:
+        for setting, value in settings.items():
+            if value is None:
+                self.settings[index].pop(setting, None)
+            else:
+                self.settings[index][setting] = value
+
+
+class FakeTasks:
+    tasks: dict[str, dict[str, Any]]
+
+    def __init__(self: Self) -> None:
+        self.tasks = {}
+
+    async def get(self: Self, task_id: str) -> dict[str, Any]:
+        if task_id not in self.tasks:
+            raise NotFoundError("resource_not_found_exception", None, {})  # type: ignore
+        return self.tasks[task_id]
+
+    async def cancel(self: Self, task_id: str) -> None:
+        pass
+
+
+class FakeElastic:
+    """In-memory stand-in for the subset of `AsyncElasticsearch` used while ingesting logs."""
+
+    indices: FakeIndices
+    tasks: FakeTasks
+    documents: dict[str, list[dict[str, Any]]]
+    ids: dict[str, dict[str, dict[str, Any]]]
+    seq_nos: dict[str, dict[str, int]]
+
+    def __init__(self: Self) -> None:
+        self.documents = defaultdict(list)
+        self.indices = FakeIndices(self.documents)
+        self.tasks = FakeTasks()
+        self.ids = defaultdict(dict)
+        self.seq_nos = defaultdict(dict)
+
+    async def create(self: Self, index: str, id: str, document: dict[str, Any], **_: object) -> None:
+        if id in self.ids[index]:
+            raise ConflictError("version_conflict_engine_exception", None, {})  # type: ignore
+        await self.index(index, id, document)
+
+    async def index(
+        self: Self, index: str, id: str, document: dict[str, Any], if_seq_no: int | None = None, **_: object
+    ) -> None:
+        if if_seq_no is not None and if_seq_no != self.seq_nos[index].get(id):
+            raise ConflictError("version_conflict_engine_exception", None, {})  # type: ignore
+        if id in self.ids[index]:
+            self.documents[index].remove(self.ids[index][id])
+        self.ids[index][id] = document
+        self.seq_nos[index][id] = self.seq_nos[index].get(id, -1) + 1
+        self.documents[index].append(document)
+
+    async def get(self: Self, index: str, id: str) -> dict[str, Any]:
+        if id not in self.ids[index]:
+            raise NotFoundError("not_found", None, {})  # type: ignore
+        return {"_source": self.ids[index][id], "_seq_no": self.seq_nos[index][id], "_primary_term": 1}
+
+    async def count(self: Self, index: str, query: dict[str, Any] | None = None) -> dict[str, Any]:
+        return {"count": len(self._matching(index, query))}
+
+    async def bulk(self: Self, operations: list[bytes], **_: object) -> dict[str, Any]:
+        # like with `filter_path=["errors", "items.*.error"]`
+        items: list[dict[str, Any]] = []
+        for action in operations:
+            meta_line, source_line = action.splitlines()
+            ((op_type, meta),) = json.loads(meta_line).items()
+            index, document = meta["_index"], json.loads(source_line)
+            if "_id" not in meta:
+                self.documents[index].append(document)
+            elif op_type == "create" and meta["_id"] in self.ids[index]:
+                items.append({op_type: {"error": {"type": "version_conflict_engine_exception"}}})
+            else:
+                await self.index(index, meta["_id"], document)
+        return {"errors": bool(items)} | ({"items": items} if items else {})
+
+    def _names(self: Self, index: str) -> list[str]:
+        # concrete indices matching a comma separated list of names and patterns
+        if "*" not in index and "," not in index:
+            if index not in self.documents:
+                raise NotFoundError("index_not_found_exception", None, {})  # type: ignore
+            return [index]
+        patterns = index.split(",")
+        return [name for name in list(self.documents) if any(fnmatch(name, pattern) for pattern in patterns)]
+
+    def _matching(self: Self, index: str, query: dict[str, Any] | None) -> list[dict[str, Any]]:
+        documents = [doc for name in self._names(index) for doc in self.documents[name]]
+        if query is None:
+            return documents
+        if "bool" in query:
+            must = query["bool"].get("must", [])
+            for condition in must if isinstance(must, list) else [must]:
+                documents = [doc for doc in documents if doc in self._matching(index, condition)]
+            must_not = query["bool"].get("must_not", [])
+            for condition in must_not if isinstance(must_not, list) else [must_not]:
+                excluded = self._matching(index, condition)
+                documents = [doc for doc in documents if doc not in excluded]
+            return documents
+        if "term" in query:
+            ((field, term),) = query["term"].items()
+            return [doc for doc in documents if doc.get(field) == term["value"]]
+        if "terms" in query:
+            ((field, terms),) = query["terms"].items()
+            return [doc for doc in documents if doc.get(field) in terms]
+        if "exists" in query:
+            return [doc for doc in documents if doc.get(query["exists"]["field"]) is not None]
+        if "range" in query:
+            ((field, bounds),) = query["range"].items()
+            return [doc for doc in documents if doc.get(field) is not None and _in_range(doc[field], bounds)]
+        raise NotImplementedError(query)
+
+    async def search(  # noqa: PLR0913
+        self: Self,
+        index: str,
+        size: int = 10,
+        query: dict[str, Any] | None = None,
+        aggs: dict[str, Any] | None = None,
+        sort: list[str] | None = None,
+        search_after: list[Any] | None = None,
+        **_: object,
+    ) -> dict[str, Any]:
+        documents = self._matching(index, query)
+        if sort:
+            documents = sorted(documents, key=lambda doc: [doc[field] for field in sort])
+            if search_after:
+                documents = [doc for doc in documents if [doc[field] for field in sort] > search_after]
+        hits = [{"_source": doc} | ({"sort": [doc[field] for field in sort]} if sort else {}) for doc in documents]
+        response: dict[str, Any] = {"hits": {"total": {"value": len(documents)}, "hits": hits[:size]}}
+        if aggs:
+            response["aggregations"] = {}
+            for name, agg in aggs.items():
+                if "composite" in agg:
+                    response["aggregations"][name] = _composite(agg["composite"], documents)
+                    continue
+                counts: dict[Any, int] = defaultdict(int)
+                for doc in documents:
+                    counts[doc[agg["terms"]["field"]]] += 1
+                buckets = [{"key": key, "doc_count": count} for key, count in counts.items()]
+                response["aggregations"][name] = {"buckets": buckets}
+        return response
+
+    async def delete_by_query(
+        self: Self, index: str, query: dict[str, Any], wait_for_completion: bool = True, **_: object
+    ) -> dict[str, Any]:
+        deleted = self._matching(index, query)
+        for name in self._names(index):
+            self.documents[name] = [doc for doc in self.documents[name] if doc not in deleted]
+            self.ids[name] = {id_: doc for id_, doc in self.ids[name].items() if doc not in deleted}
+        if wait_for_completion:
+            return {"total": len(deleted)}
+        # runs right away, but is reported like a background task
+        task_id = f"fake:{len(self.tasks.tasks)}"
+        self.tasks.tasks[task_id] = {
+            "completed": True,
+            "task": {
+                "action": "indices:data/write/delete/byquery",
+                "status": {"total": len(deleted), "deleted": len(deleted)},
+            },
+            "response": {"failures": []},
+        }
+        return {"task": task_id}
+
+    def options(self: Self, **_: object) -> Self:
+        return self
+
+    async def close(self: Self) -> None:
+        pass
@@ -0,0 +1,78 @@
+from unittest.mock import AsyncMock, MagicMock, call
+
+import pytest
+from elasticsearch import NotFoundError
+
+from sl_statistics_backend.index_mappings import DATA_MAPPING_VERSION, DATA_MAPPINGS, mapping_version
+from sl_statistics_backend.index_migration import IndexMigrationError, migrate
+
+
+def mock_elastic(version: int | None, running_polls: int = 1, failures: list[object] | None = None) -> AsyncMock:
+    elastic = AsyncMock()
+    elastic.options = MagicMock(return_value=elastic)
+    mappings = {"properties": {}} | ({"_meta": {"version": version}} if version else {})
+    elastic.indices.get_mapping.return_value = {"smartlog": {"mappings": mappings}}
+    elastic.indices.get.return_value = {"smartlog": {}}
+    elastic.indices.get_settings.return_value = {"smartlog": {"settings": {"index": {"number_of_replicas": "1"}}}}
+    elastic.reindex.return_value = {"task": "node:1"}
+    running = {"completed": False, "task": {"status": {"created": 10, "total": 20}}}
+    done = {
+        "completed": True,
+        "task": {"status": {"created": 20, "total": 20}},
+        "response": {"failures": failures or []},
+    }
+    elastic.tasks.get.side_effect = [running] * running_polls + [done]
+    return elastic
+
+
+@pytest.mark.asyncio
+async def test_mapping_version() -> None:
+    assert await mapping_version(mock_elastic(None), "smartlog") == 1
+    assert await mapping_version(mock_elastic(DATA_MAPPING_VERSION), "smartlog") == DATA_MAPPING_VERSION
+
+
+@pytest.mark.asyncio
+async def test_migrate() -> None:
+    elastic = mock_elastic(None)
+    reports: list[str] = []
+    requests_per_second = 500.0
+    assert await migrate(elastic, "smartlog", requests_per_second, poll_interval=0, report=reports.append)
+
+    target = f"smartlog-v{DATA_MAPPING_VERSION}"
+    assert elastic.indices.create.call_args.kwargs["index"] == target
+    assert elastic.indices.create.call_args.kwargs["mappings"] == DATA_MAPPINGS
+    assert elastic.indices.put_settings.call_args_list[0] == call(
+        index="smartlog", settings={"index.blocks.write": True}
+    )
+    assert elastic.reindex.call_args.kwargs["requests_per_second"] == requests_per_second
+    assert elastic.reindex.call_args.kwargs["wait_for_completion"] is False
+    assert elastic.indices.put_settings.call_args_list[1] == call(
+        index=target, settings={"index": {"number_of_replicas": "1", "refresh_interval": None}}
+    )
+    elastic.indices.update_aliases.assert_called_once_with(
+        actions=[{"add": {"index": target, "alias": "smartlog"}}, {"remove_index": {"index": "smartlog"}}]
+    )
+    assert "reindexed 10 of 20 entries" in reports
+
+
+@pytest.mark.asyncio
+async def test_migrate_up_to_date() -> None:
+    elastic = mock_elastic(DATA_MAPPING_VERSION)
+    assert not await migrate(elastic, "smartlog")
+    elastic.indices.create.assert_not_called()
+
+    elastic.indices.get_mapping.side_effect = NotFoundError("index_not_found_exception", None, {})  # type: ignore
+    with pytest.raises(IndexMigrationError):
+        await migrate(elastic, "smartlog")
+
+
+@pytest.mark.asyncio
+async def test_migrate_failure() -> None:
+    elastic = mock_elastic(1, failures=[{"cause": "mapper_parsing_exception"}])
+    with pytest.raises(IndexMigrationError):
+        await migrate(elastic, "smartlog", poll_interval=0, report=lambda _: None)
+    elastic.indices.update_aliases.assert_not_called()
+    # the new index is dropped, and the old one accepts uploads again
+    elastic.indices.delete.assert_called_with(index=f"smartlog-v{DATA_MAPPING_VERSION}")
+    assert elastic.indices.put_settings.call_args == call(index="smartlog", settings={"index.blocks.write": None})
+    elastic.tasks.cancel.assert_not_called()
@@ -0,0 +1,84 @@
+# ruff: noqa: PLR2004
+
+import asyncio
+from collections.abc import AsyncIterator
+from pathlib import Path
+
+import pytest
+
+from sl_statistics_backend.ingest_jobs import IngestJobQueue, IngestQueueFullError
+from sl_statistics_backend.log_database import LogDatabase
+from sl_statistics_backend.log_stream import parse_log_stream
+from sl_statistics_backend.models import IngestJob, IngestJobStatus, IngestStats
+from tests.fake_elastic import FakeElastic
+
+log_bytes = Path(__file__).with_name("log.csv").read_bytes()
+
+
+async def chunks(data: bytes) -> AsyncIterator[bytes]:
+    yield data
+
+
+@pytest.mark.asyncio
+async def test_ingest_job_with_in_memory_elastic() -> None:
+    elastic = FakeElastic()
+    log_db = LogDatabase(elastic)  # type: ignore
+    queue = IngestJobQueue(concurrency=1)
+
+    async def run(job: IngestJob) -> IngestStats:
+        def on_indexed(count: int) -> None:
+            job.docs_indexed += count
+
+        return await log_db.upload(
+            job.file_name, parse_log_stream(job.file_name, chunks(log_bytes)), on_indexed=on_indexed
+        )
+
+    job = queue.submit("log.csv", run)
+    assert queue.get(job.job_id) is job
+    assert job.status == IngestJobStatus.QUEUED
+    while job.status in {IngestJobStatus.QUEUED, IngestJobStatus.RUNNING}:
+        await asyncio.sleep(0.01)
+    assert job.status == IngestJobStatus.COMPLETED
+    assert job.docs_indexed == 11
+    assert job.stats is not None and job.stats.count == 11
+    assert len(elastic.documents["smartlog"]) == 11
+
+    # uploading the same file again fails inside the job
+    job = queue.submit("log.csv", run)
+    while job.status in {IngestJobStatus.QUEUED, IngestJobStatus.RUNNING}:
+        await asyncio.sleep(0.01)
+    assert job.status == IngestJobStatus.FAILED
+    assert job.errors == ["Log file already uploaded!"]
+    await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_ingest_job_queue_backpressure() -> None:
+    release = asyncio.Event()
+
+    async def run(_: IngestJob) -> IngestStats:
+        await release.wait()
+        return IngestStats.from_measurements(0, 0, 0)
+
+    queue = IngestJobQueue(concurrency=1, max_queued=1)
+    running = queue.submit("a.csv", run)
+    await asyncio.sleep(0)  # let the worker pick up the first job
+    queue.submit("b.csv", run)
+    with pytest.raises(IngestQueueFullError):
+        queue.submit("c.csv", run)
+    assert running.status == IngestJobStatus.RUNNING
+    release.set()
+    await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_ingest_job_queue_forgets_old_jobs() -> None:
+    async def run(_: IngestJob) -> IngestStats:
+        return IngestStats.from_measurements(0, 0, 0)
+
+    queue = IngestJobQueue(concurrency=1, max_finished=2)
+    jobs = [queue.submit(f"{i}.csv", run) for i in range(4)]
+    while jobs[-1].status != IngestJobStatus.COMPLETED:
+        await asyncio.sleep(0.01)
+    assert [queue.get(job.job_id) for job in jobs] == [None, None, jobs[2], jobs[3]]
+    await queue.close()
@@ -1,30 +1,44 @@
 # ruff: noqa: ANN101, PLR2004
 
+import hashlib
+import io
 import json
+import zipfile
+from collections.abc import AsyncIterable, Iterator
 from datetime import datetime
 from pathlib import Path
-from unittest.mock import patch
+from unittest.mock import AsyncMock, patch
 
+import pytest
 from sl_parser import LogFile
 from starlette.testclient import TestClient
 
 from sl_statistics_backend import app
+from sl_statistics_backend.ingest_jobs import IngestJobQueue, IngestQueueFullError
 from sl_statistics_backend.log_database import LogDatabase, LogDatabaseError
-from sl_statistics_backend.models import StoredLogFile, StoredLogList
+from sl_statistics_backend.log_stream import LogRecord
+from sl_statistics_backend.models import IngestJob, IngestStats, LogDeletion, StoredLogFile, StoredLogList
 
 client = TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def no_uploaded_content() -> Iterator[AsyncMock]:
+    with patch.object(LogDatabase, "uploaded_content", return_value={}) as mock_uploaded_content:
+        yield mock_uploaded_content
+
+
 class TestUploadLog:
     # Simulate uploading of a valid file
-    @patch.object(LogDatabase, "upload", return_value=11)
+    @patch.object(LogDatabase, "upload", return_value=IngestStats.from_measurements(11, 2048, 0.5))
     def test_upload_log_valid_log(self, _: LogFile) -> None:
         response = client.put(
             "/api/log", files={"log": ("log.csv", Path(__file__).with_name("log.csv").read_text(), "text/csv")}
         )
 
         assert response.status_code == 200
-        assert response.json() == {"count": 11}
+        assert response.json()["count"] == 11
+        assert response.json()["docs_per_second"] == 22
 
     # Simulate uploading an invalid file (not a CSV)
     def test_upload_log_invalid_file(self) -> None:
@@ -43,7 +57,7 @@ class TestUploadLog:
 
     # Simulate uploading of an existing file (duplicate)
 
-    async def mock_upload_duplicate_error(self, _: LogFile) -> None:
+    async def mock_upload_duplicate_error(self, _: str, __: AsyncIterable[list[LogRecord]], **___: object) -> None:
         raise LogDatabaseError("Log file already uploaded!")
 
     @patch.object(LogDatabase, "upload", mock_upload_duplicate_error)
@@ -54,9 +68,34 @@ class TestUploadLog:
         assert response.status_code == 400
         assert response.json() == {"errors": ["Log file already uploaded!"]}
 
+    # Simulate uploading the content of a stored file under another name
+
+    @patch.object(LogDatabase, "upload")
+    def test_upload_log_duplicate_content(self, mock_upload: AsyncMock, no_uploaded_content: AsyncMock) -> None:
+        log_bytes = Path(__file__).with_name("log.csv").read_bytes()
+        content_hash = hashlib.sha256(log_bytes).hexdigest()
+        no_uploaded_content.return_value = {content_hash: "old.csv"}
+        response = client.put("/api/log", files={"log": ("new.csv", log_bytes, "text/csv")})
+        assert response.status_code == 400
+        assert response.json() == {"errors": ["Log file already uploaded as old.csv!"]}
+        no_uploaded_content.assert_called_once_with([content_hash])
+        mock_upload.assert_not_called()
+
+    # Simulate appending a newer copy of a stored file
+
+    @patch.object(LogDatabase, "upload")
+    def test_upload_log_append(self, mock_upload: AsyncMock, no_uploaded_content: AsyncMock) -> None:
+        log_bytes = Path(__file__).with_name("log.csv").read_bytes()
+        no_uploaded_content.return_value = {hashlib.sha256(log_bytes).hexdigest(): "log.csv"}
+        mock_upload.return_value = IngestStats.from_measurements(0, 0, 1)
+        response = client.put("/api/log", data={"append": "true"}, files={"log": ("log.csv", log_bytes, "text/csv")})
+        assert response.status_code == 200
+        assert response.json()["count"] == 0
+        assert mock_upload.call_args.kwargs["append"] is True
+
     # Simulate generic error
 
-    async def mock_upload_exception(self, _: LogFile) -> None:
+    async def mock_upload_exception(self, _: str, __: AsyncIterable[list[LogRecord]], **___: object) -> None:
         raise TypeError
 
     @patch.object(LogDatabase, "upload", mock_upload_exception)
@@ -67,6 +106,87 @@ class TestUploadLog:
         assert response.status_code == 400
 
 
+class TestUploadLogBackground:
+    @patch.object(IngestJobQueue, "submit")
+    def test_upload_log_background(self, mock_submit: AsyncMock) -> None:
+        mock_submit.return_value = IngestJob(job_id="abc", file_name="log.csv", submitted_at=datetime.now())
+        response = client.put(
+            "/api/log",
+            data={"background": "true"},
+            files={"log": ("log.csv", Path(__file__).with_name("log.csv").read_text(), "text/csv")},
+        )
+        assert response.status_code == 202
+        assert response.json() == {"job_id": "abc"}
+        assert mock_submit.call_args.args[0] == "log.csv"
+        mock_submit.call_args.args[1].args[0].close()
+
+    @patch.object(IngestJobQueue, "submit", side_effect=IngestQueueFullError("Too many uploads in progress"))
+    def test_upload_log_background_queue_full(self, _: AsyncMock) -> None:
+        response = client.put(
+            "/api/log",
+            data={"background": "true"},
+            files={"log": ("log.csv", Path(__file__).with_name("log.csv").read_text(), "text/csv")},
+        )
+        assert response.status_code == 503
+        assert response.json() == {"errors": ["Too many uploads in progress"]}
+
+    @patch.object(IngestJobQueue, "get")
+    def test_upload_job_status(self, mock_get: AsyncMock) -> None:
+        mock_get.return_value = IngestJob(job_id="abc", file_name="log.csv", submitted_at=datetime.now(), rows_parsed=5)
+        response = client.get("/api/log/jobs/abc")
+        assert response.status_code == 200
+        assert response.json()["rows_parsed"] == 5
+        mock_get.return_value = None
+        response = client.get("/api/log/jobs/abc")
+        assert response.status_code == 404
+
+
+class TestUploadLogBatch:
+    @staticmethod
+    def archive() -> bytes:
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            archive.write(Path(__file__).with_name("log.csv"), "log1.csv")
+            archive.write(Path(__file__).with_name("logErr.csv"), "logErr.csv")
+            archive.write(Path(__file__).with_name("log.csv"), "log2.csv")
+            archive.write(Path(__file__).with_name("log.csv"), "log3.csv")
+            archive.write(Path(__file__).with_name("log.csv"), "backup/log1.csv")
+        return buffer.getvalue()
+
+    async def mock_upload(
+        self, file_name: str, record_batches: AsyncIterable[list[LogRecord]], **_: bool
+    ) -> IngestStats:
+        entries = [entry async for batch in record_batches for entry in batch]
+        return IngestStats.from_measurements(len(entries), 0, 1)
+
+    @patch.object(LogDatabase, "refresh")
+    @patch.object(LogDatabase, "uploaded_logs", return_value={"log3.csv"})
+    @patch.object(LogDatabase, "upload", mock_upload)
+    def test_upload_log_batch(self, _: AsyncMock, mock_refresh: AsyncMock) -> None:
+        response = client.put("/api/log_batch", files={"archive": ("fleet.zip", self.archive(), "application/zip")})
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert [result["file_name"] for result in results] == [
+            "log1.csv",
+            "logErr.csv",
+            "log2.csv",
+            "log3.csv",
+            "backup/log1.csv",
+        ]
+        assert results[0]["stats"]["count"] == 11
+        assert "Log parsing error" in results[1]["error"]
+        # same content as log1.csv
+        assert results[2]["error"] == "Log file already uploaded as log1.csv!"
+        assert results[3]["error"] == "Log file already uploaded!"
+        assert results[4]["error"] == "Another log in the archive has the same name!"
+        mock_refresh.assert_called_once()
+
+    def test_upload_log_batch_invalid_archive(self) -> None:
+        response = client.put("/api/log_batch", files={"archive": ("fleet.zip", b"garbage", "application/zip")})
+        assert response.status_code == 400
+        assert response.json() == {"errors": ["Invalid log archive"]}
+
+
 log_files = [
     StoredLogFile(
         file_name="log_file_1",
@@ -98,3 +218,38 @@ def test_list_logs() -> None:
     assert response.headers["Content-Type"] == "application/json"
     expected_response = json.loads(log_list.json())
     assert response.json() == expected_response
+
+
+@patch.object(LogDatabase, "start_deletion", return_value="node:1")
+def test_delete_log(mock_start_deletion: AsyncMock) -> None:
+    response = client.request("DELETE", "/api/log", json={"log": "log.csv", "requests_per_second": 500})
+    assert response.status_code == 202
+    assert response.json() == {"task_id": "node:1"}
+    mock_start_deletion.assert_called_once_with("log.csv", 500)
+
+    mock_start_deletion.side_effect = LogDatabaseError("Log file not found!")
+    response = client.request("DELETE", "/api/log", json={"log": "missing.csv"})
+    assert response.status_code == 404
+    assert response.json() == {"errors": ["Log file not found!"]}
+
+
+def test_log_deletion_status() -> None:
+    deletion = LogDeletion(task_id="node:1", completed=False, total=100, deleted=40)
+    with patch.object(LogDatabase, "deletion", return_value=deletion):
+        response = client.get("/api/log/deletions/node:1")
+    assert response.status_code == 200
+    assert response.json()["deleted"] == 40
+    with patch.object(LogDatabase, "deletion", return_value=None):
+        assert client.get("/api/log/deletions/node:2").status_code == 404
+
+
+def test_query_cache_stats() -> None:
+    response = client.get("/api/cache/stats")
+    assert response.status_code == 200
+    assert {"hits", "misses", "evictions", "entries", "max_entries", "generation"} <= response.json().keys()
+
+
+def test_coalesced_query_stats() -> None:
+    response = client.get("/api/cache/coalescing")
+    assert response.status_code == 200
+    assert response.json().keys() == {"calls", "coalesced", "in_flight"}
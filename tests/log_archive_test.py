@@ -0,0 +1,55 @@
+import io
+import tarfile
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from sl_statistics_backend.log_archive import LogArchive, LogArchiveError
+
+log_bytes = Path(__file__).with_name("log.csv").read_bytes()
+
+
+def zip_archive(files: dict[str, bytes]) -> io.BytesIO:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def tar_archive(files: dict[str, bytes]) -> io.BytesIO:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.mark.parametrize("make_archive", [zip_archive, tar_archive])
+def test_log_archive(make_archive: type) -> None:
+    archive = LogArchive(
+        make_archive(
+            {
+                "fleet/ups1.csv": log_bytes,
+                "fleet/UPS2.CSV": log_bytes,
+                "backup/ups1.csv": log_bytes,
+                "fleet/readme.txt": b"not a log",
+                "__MACOSX/fleet/._ups1.csv": b"metadata",
+            }
+        )
+    )
+    assert archive.names == ["ups1.csv", "UPS2.CSV"]
+    assert archive.duplicates == ["backup/ups1.csv"]
+    with archive.open("ups1.csv") as member:
+        assert member.read() == log_bytes
+    archive.close()
+
+
+def test_log_archive_invalid() -> None:
+    with pytest.raises(LogArchiveError):
+        LogArchive(io.BytesIO(b"definitely not an archive"))
@@ -1,18 +1,40 @@
 # ruff: noqa: PLR2004
 
-from datetime import datetime
+import asyncio
+import json
+from collections import defaultdict
+from collections.abc import AsyncIterator, Awaitable, Callable
+from datetime import datetime, timedelta, timezone
+from itertools import pairwise
+from pathlib import Path
+from typing import Any
 from unittest.mock import AsyncMock, patch
 
 import pytest
-from elasticsearch import AsyncElasticsearch
+from elasticsearch import AsyncElasticsearch, ConflictError, NotFoundError
 from elasticsearch._async.client.ingest import IngestClient
 from sl_parser import LogEntry, LogFile, Unit
 
-from sl_statistics_backend.log_database import LogDatabase, LogDatabaseError
+from sl_statistics_backend.bulk_indexer import BulkIndexer
+from sl_statistics_backend.bulk_load import BulkLoadSettings
+from sl_statistics_backend.downsampling import Downsampling
+from sl_statistics_backend.log_database import (
+    IndexLayout,
+    LogDatabase,
+    LogDatabaseError,
+    _months_between,
+    _range_partitions,
+    _split_time_range,
+)
+from sl_statistics_backend.log_documents import LogSummary, registry_document
+from sl_statistics_backend.log_stream import LogParseError, LogRecord, parse_log_stream
 from sl_statistics_backend.models import (
+    IngestStats,
     LogFrequencyEntry,
     LogOverview,
 )
+from sl_statistics_backend.query_cache import QueryCache
+from tests.fake_elastic import FakeElastic
 
 mock_elastic = AsyncMock()
 
@@ -56,18 +78,60 @@ def log_file() -> LogFile:
     return log_file
 
 
+async def log_chunks() -> AsyncIterator[bytes]:
+    yield Path(__file__).with_name("log.csv").read_bytes()
+
+
+async def entry_batches(log_file: LogFile) -> AsyncIterator[list[LogRecord]]:
+    yield [LogRecord(**entry.dict()) for entry in log_file.log_entries]
+
+
 @pytest.mark.asyncio
 async def test_upload(log_database: LogDatabase, log_file: LogFile) -> None:
     # Test uploading a log file
-    with patch.object(log_database, "_log_already_uploaded", return_value=False), patch.object(
-        log_database, "_call_async_bulk", return_value=(1, 0)
-    ):
-        result = await log_database.upload(log_file)
-        assert result == 1
+    stats = IngestStats.from_measurements(1, 100, 0.5)
+    mock_elastic.create = AsyncMock()
+    mock_elastic.get = AsyncMock(side_effect=NotFoundError("not_found", None, {}))  # type: ignore
+
+    async def index(action_batches: AsyncIterator[list[bytes]], *_: object, **__: object) -> IngestStats:
+        async for _batch in action_batches:
+            pass
+        return stats
+
+    with patch.object(log_database.bulk_indexer, "index", side_effect=index):
+        result = await log_database.upload(log_file.filename, entry_batches(log_file))
+        assert result == stats
+    assert mock_elastic.create.call_args.kwargs["id"] == log_file.filename
 
     # Test that an exception is raised if the log file was already uploaded
+    mock_elastic.create.side_effect = ConflictError("version_conflict_engine_exception", None, {})  # type: ignore
     with pytest.raises(LogDatabaseError):
-        await log_database.upload(log_file)
+        await log_database.upload(log_file.filename, entry_batches(log_file))
+
+
+@pytest.mark.asyncio
+async def test_upload_parse_error_rolls_back(log_database: LogDatabase, log_file: LogFile) -> None:
+    async def broken_batches() -> AsyncIterator[list[LogRecord]]:
+        async for batch in entry_batches(log_file):
+            yield batch
+        raise LogParseError("broken row")
+
+    async def consume_actions(action_batches: AsyncIterator[list[bytes]], *_: object) -> IngestStats:
+        count = 0
+        async for actions in action_batches:
+            for action in actions:
+                assert json.loads(action.splitlines()[1])["file"] == log_file.filename
+                count += 1
+        return IngestStats.from_measurements(count, 0, 0)
+
+    mock_elastic.create = AsyncMock()
+    mock_elastic.get = AsyncMock(side_effect=NotFoundError("not_found", None, {}))  # type: ignore
+    with patch.object(log_database.bulk_indexer, "index", new=consume_actions), patch.object(
+        log_database, "delete_log", new_callable=AsyncMock
+    ) as mock_delete:
+        with pytest.raises(LogParseError):
+            await log_database.upload(log_file.filename, broken_batches())
+        mock_delete.assert_called_once_with(log_file.filename)
 
 
 @pytest.mark.asyncio
@@ -108,7 +172,9 @@ async def test_composite_paginate(log_database: LogDatabase) -> None:
             },
         ]
     )
-    result = await log_database._composite_paginate("my_index", {"composite": {"sources": [{"field": "my_field"}]}})
+    result = await log_database._composite_paginate(
+        "my_index", {"composite": {"size": 3, "sources": [{"field": "my_field"}]}}
+    )
     assert result == [
         {"key": "value1", "doc_count": 10},
         {"key": "value2", "doc_count": 5},
@@ -118,6 +184,84 @@ async def test_composite_paginate(log_database: LogDatabase) -> None:
     ]
 
 
+def partitioned_search(pages: dict[int, list[list[str]]]) -> Callable[..., Awaitable[dict[str, Any]]]:
+    # serves the pages of each partition of a composite aggregation of size 2, after the previous page's last key
+    async def search(query: dict[str, Any], aggs: dict[str, Any], **_: object) -> dict[str, Any]:
+        # partitioned by `_range_partitions("key", ["b"])`
+        partition = int("gte" in query["bool"]["filter"][0]["range"]["key"]) if query else 0
+        after = aggs["agg"]["composite"].get("after")
+        partition_pages = pages[partition]
+        page = next(i for i, keys in enumerate(partition_pages) if after is None or keys[0] > after)
+        await asyncio.sleep(0)
+        keys = partition_pages[page]
+        return {"aggregations": {"agg": {"buckets": [{"key": key} for key in keys], "after_key": keys[-1]}}}
+
+    return search
+
+
+@pytest.mark.asyncio
+async def test_composite_pages(log_database: LogDatabase) -> None:
+    mock_elastic.search = AsyncMock(side_effect=partitioned_search({0: [["a", "b"], ["c", "d"], ["e"]]}))
+    agg = {"composite": {"sources": [{"key": {"terms": {"field": "key"}}}]}}
+    pages = [page async for page in log_database._composite_pages("index", agg, page_size=2)]
+    assert pages == [[{"key": "a"}, {"key": "b"}], [{"key": "c"}, {"key": "d"}], [{"key": "e"}]]
+    # the caller's aggregation is left as it was
+    assert agg == {"composite": {"sources": [{"key": {"terms": {"field": "key"}}}]}}
+    assert mock_elastic.search.call_args.kwargs["aggs"]["agg"]["composite"]["size"] == 2
+
+    # stopping early stops fetching pages
+    mock_elastic.search.reset_mock()
+    async for _page in log_database._composite_pages("index", agg, page_size=2):
+        break
+    assert mock_elastic.search.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_composite_pages_partitions(log_database: LogDatabase) -> None:
+    pages = {0: [["a", "c"], ["e"]], 1: [["b", "d"], ["f", "h"], ["j"]]}
+    mock_elastic.search = AsyncMock(side_effect=partitioned_search(pages))
+    agg = {"composite": {"size": 2, "sources": [{"key": {"terms": {"field": "key"}}}]}}
+    partitions = _range_partitions("key", ["b"])
+    buckets = [
+        bucket async for page in log_database._composite_pages("index", agg, partitions=partitions) for bucket in page
+    ]
+    assert sorted(bucket["key"] for bucket in buckets) == ["a", "b", "c", "d", "e", "f", "h", "j"]
+    assert mock_elastic.search.call_count == 5
+    assert _range_partitions("key", []) == []
+
+    async def failing_search(query: dict[str, Any], **kwargs: object) -> dict[str, Any]:
+        # the other partition still has pages to fetch
+        if "lt" in query["bool"]["filter"][0]["range"]["key"]:
+            raise ConnectionError
+        return await partitioned_search(pages)(query=query, **kwargs)
+
+    mock_elastic.search = AsyncMock(side_effect=failing_search)
+    with pytest.raises(ConnectionError):
+        async for _page in log_database._composite_pages("index", agg, partitions=partitions):
+            pass
+
+
+@pytest.mark.asyncio
+async def test_key_partitions() -> None:
+    elastic = AsyncMock()
+    counts = {"a": 40, "b": 10, "c": 10, "d": 30, "e": 5, "f": 5}
+    buckets = [{"key": {"key": key}, "doc_count": count} for key, count in counts.items()]
+    elastic.search.return_value = {"aggregations": {"agg": {"buckets": buckets}}}
+    log_database = LogDatabase(elastic, "test_smartlog", composite_partitions=3)
+    # a third of the documents in each part, as far as the values allow
+    assert await log_database._key_partitions("index", "file") == [
+        {"range": {"file": {"lt": "b"}}},
+        {"range": {"file": {"gte": "b", "lt": "d"}}},
+        {"range": {"file": {"gte": "d"}}},
+    ]
+    assert elastic.search.call_args.kwargs["aggs"]["agg"]["composite"]["sources"] == [
+        {"key": {"terms": {"field": "file"}}}
+    ]
+
+    log_database.composite_partitions = 1
+    assert await log_database._key_partitions("index", "file") == []
+
+
 @pytest.mark.asyncio
 async def test_close(log_database: LogDatabase) -> None:
     mock_elastic.close.assert_not_called()
@@ -134,26 +278,33 @@ async def test_delete_log(log_database: LogDatabase) -> None:
 
 @pytest.mark.asyncio
 async def test_log_overview(log_database: LogDatabase) -> None:
+    # per-file counts come a page at a time, the last page not full
     mock_elastic.search.side_effect = [
         {
-            "hits": {"total": {"value": 1}},
             "aggregations": {
-                "file": {"buckets": [{"key": "file1", "doc_count": 100}, {"key": "file2", "doc_count": 50}]},
-                "max_count": {"value": 100, "keys": ["file1"]},
-                "ext_stats": {"count": 2, "sum": 150, "avg": 75, "std_deviation": 25},
-            },
-        }
+                "agg": {
+                    "buckets": [
+                        {"key": {"file": "file1"}, "doc_count": 100},
+                        {"key": {"file": "file2"}, "doc_count": 50},
+                    ],
+                    "after_key": {"file": "file2"},
+                }
+            }
+        },
+        {"aggregations": {"agg": {"buckets": [{"key": {"file": "file3"}, "doc_count": 100}]}}},
     ]
+    log_database.composite_page_size = 2
 
     start = datetime(2023, 4, 1)
     end = datetime(2023, 4, 30)
 
     result = await log_database.log_overview(start, end)
-    assert result.total_entries == 150
-    assert result.avg_entries == 75
+    assert result.total_entries == 250
+    assert result.avg_entries == 83
     assert result.max_count_entry.filename == "file1"
     assert result.max_count_entry.entry_count == 100
-    assert result.entries_std_dev == 25
+    assert result.entries_std_dev == 23
+    assert mock_elastic.search.call_args.kwargs["aggs"]["agg"]["composite"]["after"] == {"file": "file2"}
 
     mock_elastic.search.side_effect = [
         {
@@ -177,7 +328,7 @@ async def test_log_entries_frequency(log_database: LogDatabase) -> None:
         {"key": {"fw": "firmware2", "code": "event2"}, "doc_count": 20},
         {"key": {"fw": "firmware3", "code": "event3"}, "doc_count": 30},
     ]
-    with patch.object(log_database, "_composite_paginate", return_value=mock_response):
+    with patch.object(log_database, "_composites", return_value=[mock_response, []]):
         start = datetime(2023, 5, 1)
         end = datetime(2023, 5, 5)
         subunits = [1, 2, 3]
@@ -191,22 +342,91 @@ async def test_chart_filters(log_database: LogDatabase) -> None:
     end = datetime(2023, 5, 2)
     expected_codes = ["code1", "code2", "code3"]
     expected_firmwares = ["firmware1", "firmware2", "firmware3"]
-    expected_subunits = [2, 1, 2]
+    expected_subunits = [1, 2, 3]
 
-    mock_paginate = AsyncMock(
-        side_effect=[
-            [{"key": {"code": code}} for code in expected_codes],
-            [{"key": {"firmware": firmware}} for firmware in expected_firmwares],
-            [{"key": {"subunit": subunit}} for subunit in expected_subunits],
-        ]
-    )
+    def terms(keys: list[Any], sum_other_doc_count: int = 0) -> dict[str, Any]:
+        return {"buckets": [{"key": key} for key in keys], "sum_other_doc_count": sum_other_doc_count}
 
-    with patch.object(log_database, "_composite_paginate", new=mock_paginate):
-        result = await log_database.chart_filters(start, end)
+    mock_elastic.search = AsyncMock(
+        return_value={
+            "aggregations": {
+                "code": terms(expected_codes),
+                "firmware": terms(expected_firmwares),
+                # more subunits than fit in a `terms` aggregation
+                "subunit": terms(expected_subunits[:2], 1),
+            }
+        }
+    )
+    mock_elastic.msearch = AsyncMock(
+        return_value={
+            "responses": [
+                {"aggregations": {"agg": {"buckets": [{"key": {"subunit": subunit}} for subunit in expected_subunits]}}}
+            ]
+        }
+    )
+    result = await log_database.chart_filters(start, end)
 
     assert result.codes == expected_codes
     assert result.firmwares == expected_firmwares
     assert result.subunits == expected_subunits
+    mock_elastic.search.assert_called_once()
+    ((_, subunits_search),) = pairwise(mock_elastic.msearch.call_args.kwargs["searches"])
+    assert subunits_search["aggs"]["agg"]["composite"]["sources"] == [
+        {"subunit": {"terms": {"field": "unit_subunit_id"}}}
+    ]
+
+
+@pytest.mark.asyncio
+async def test_composites(log_database: LogDatabase) -> None:
+    def page(keys: list[str], after_key: str) -> dict[str, Any]:
+        return {"aggregations": {"agg": {"buckets": [{"key": key} for key in keys], "after_key": after_key}}}
+
+    mock_elastic.msearch = AsyncMock(return_value={"responses": [page(["a", "b"], "b"), page(["c"], "c"), {}]})
+    mock_elastic.search = AsyncMock(return_value=page(["d"], "d"))
+    aggs = [{"composite": {"size": 2, "sources": []}} for _ in range(3)]
+    result = await log_database._composites([("one", aggs[0], None), ("two", aggs[1], None), ("three", aggs[2], None)])
+    # only the first aggregation fills its first page
+    assert result == [[{"key": "a"}, {"key": "b"}, {"key": "d"}], [{"key": "c"}], []]
+    assert mock_elastic.search.call_args.kwargs["index"] == "one"
+    assert mock_elastic.search.call_args.kwargs["aggs"]["agg"]["composite"]["after"] == "b"
+    header, body = mock_elastic.msearch.call_args.kwargs["searches"][:2]
+    assert header == {"index": "one", "ignore_unavailable": True}
+    assert body == {"size": 0, "aggs": {"agg": aggs[0]}}
+
+    mock_elastic.msearch = AsyncMock(return_value={"responses": [{"error": {"reason": "boom"}, "status": 400}]})
+    with pytest.raises(LogDatabaseError):
+        await log_database._composites([("one", aggs[0], None)])
+
+
+def composite_search(buckets: list[dict[str, Any]]) -> Callable[..., Awaitable[dict[str, Any]]]:
+    # pages through `buckets` like ElasticSearch, with its default of 10 buckets a page when no size is given
+    async def search(aggs: dict[str, Any], **_: object) -> dict[str, Any]:
+        composite = aggs["agg"]["composite"]
+        size = composite.get("size", 10)
+        start = int(composite.get("after", {}).get("index", -1)) + 1
+        page = buckets[start : start + size]
+        after = {"after_key": {"index": start + len(page) - 1}} if page else {}
+        return {"aggregations": {"agg": {"buckets": page} | after}}
+
+    return search
+
+
+@pytest.mark.asyncio
+async def test_log_entries_frequency_pages() -> None:
+    buckets = [{"key": {"fw": "firmware", "code": f"code{i:02}"}, "doc_count": 1} for i in range(50)]
+    search = composite_search(buckets)
+    elastic = AsyncMock()
+    elastic.search = AsyncMock(side_effect=search)
+
+    async def msearch(searches: list[dict[str, Any]]) -> dict[str, Any]:
+        return {"responses": [await search(**body) for body in searches[1::2]]}
+
+    elastic.msearch = AsyncMock(side_effect=msearch)
+    log_db = LogDatabase(elastic, "test_smartlog", composite_page_size=20)
+    # within a single hour, so all the events come from the raw composite
+    result = await log_db.log_entries_frequency(datetime(2023, 5, 1, 10, 10), datetime(2023, 5, 1, 10, 20), [1])
+    assert len(result) == 50
+    assert elastic.msearch.call_args.kwargs["searches"][1]["aggs"]["agg"]["composite"]["size"] == 20
 
 
 @pytest.mark.asyncio
@@ -248,6 +468,95 @@ async def test_time_chart_data(log_database: LogDatabase) -> None:
     assert result == []
 
 
+def histogram_search(spikes: dict[int, int] | None = None) -> AsyncMock:
+    # a fixed interval histogram with an event in every bucket, plus `spikes` (epoch millis of a bucket: events)
+    async def search(**kwargs: Any) -> dict[str, Any]:  # noqa: ANN401
+        histogram = kwargs["aggs"]["events_over_time"]["date_histogram"]
+        interval = int(histogram["fixed_interval"].removesuffix("ms"))
+        bounds = histogram["extended_bounds"]
+        keys = range(bounds["min"] // interval * interval, bounds["max"] + 1, interval)
+        buckets = [
+            {
+                "key_as_string": datetime.fromtimestamp(key / 1000, timezone.utc).isoformat(),
+                "doc_count": 1 + (spikes or {}).get(key, 0),
+                "filtered": {"code": {"buckets": []}},
+            }
+            for key in keys
+        ]
+        return {"hits": {"total": {"value": len(buckets)}}, "aggregations": {"events_over_time": {"buckets": buckets}}}
+
+    return AsyncMock(side_effect=search)
+
+
+@pytest.mark.asyncio
+async def test_time_chart_data_fixed_interval() -> None:
+    elastic = AsyncMock()
+    elastic.search = histogram_search()
+    log_db = LogDatabase(elastic, "test_smartlog", query_cache=QueryCache())
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    start, end = epoch + timedelta(hours=464500), epoch + timedelta(hours=467500)
+
+    result = await log_db.time_chart_data(start, end, [1], ["CODE1"], "1h")
+    # tiles of 1000 buckets, aligned to the epoch: half of one, two whole ones, and half of another, up to `end` itself
+    assert elastic.search.call_count == 4
+    timestamps = [datetime.fromisoformat(entry["timestamp"]) for entry in result]
+    assert timestamps == [start + timedelta(hours=hour) for hour in range(3001)]
+    assert result[0] == {"timestamp": start.isoformat(), "total": 1, "CODE1": "0"}
+    ranges = [call.kwargs["query"]["bool"]["must"][0]["range"]["@timestamp"] for call in elastic.search.call_args_list]
+    assert ranges[1] == {
+        "gte": (epoch + timedelta(hours=465000)).isoformat(),
+        "lt": (epoch + timedelta(hours=466000)).isoformat(),
+    }
+    assert ranges[3] == {"gte": (epoch + timedelta(hours=467000)).isoformat(), "lte": end.isoformat()}
+
+    # panning only fetches the tiles at the edges again
+    elastic.search.reset_mock()
+    await log_db.time_chart_data(start + timedelta(hours=200), end + timedelta(hours=200), [1], ["CODE1"], "1h")
+    assert elastic.search.call_count == 2
+
+    # far too fine an interval is widened
+    elastic.search.reset_mock()
+    result = await log_db.time_chart_data(start, end, [1], ["CODE1"], "1m")
+    assert len(result) <= 50_001
+    assert elastic.search.call_args.kwargs["aggs"]["events_over_time"]["date_histogram"]["fixed_interval"] == "240000ms"
+
+    # an empty range, or one without any events
+    elastic.search.reset_mock()
+    assert await log_db.time_chart_data(end, start, [1], ["CODE1"], "1h") == []
+    elastic.search.assert_not_called()
+    elastic.search.side_effect = None
+    elastic.search.return_value = {
+        "aggregations": {
+            "events_over_time": {
+                "buckets": [
+                    {"key_as_string": start.isoformat(), "doc_count": "0", "filtered": {"code": {"buckets": []}}}
+                ]
+            }
+        }
+    }
+    assert await log_db.time_chart_data(start, start + timedelta(hours=1), [2], ["CODE1"], "1h") == []
+
+
+@pytest.mark.asyncio
+async def test_time_chart_data_downsampling() -> None:
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    start = epoch + timedelta(hours=465000)
+    spike = start + timedelta(hours=123)
+    elastic = AsyncMock()
+    elastic.search = histogram_search({(spike - epoch) // timedelta(milliseconds=1): 99})
+    log_db = LogDatabase(elastic, "test_smartlog")
+
+    result = await log_db.time_chart_data(start, start + timedelta(hours=999), [1], [], "1h", 50, Downsampling.MAX)
+    assert len(result) == 50
+    # the spike is never dropped
+    assert {"timestamp": spike.isoformat(), "total": 100} in result
+
+    result = await log_db.time_chart_data(start, start + timedelta(hours=999), [1], [], "1h", 50, Downsampling.LTTB)
+    assert len(result) == 50
+    assert result[0]["timestamp"] == start.isoformat()
+    assert {"timestamp": spike.isoformat(), "total": 100} in result
+
+
 @pytest.mark.asyncio
 async def test_firmware_chart_data(log_database: LogDatabase) -> None:
     expected_result = [
@@ -289,7 +598,7 @@ async def test_firmware_chart_data(log_database: LogDatabase) -> None:
     firmwares = ["firmware1", "firmware2"]
     codes = ["code1", "code2", "code3"]
 
-    with patch.object(log_database, "_composite_paginate", return_value=mock_response):
+    with patch.object(log_database, "_composites", return_value=[mock_response, []]):
         result = await log_database.firmware_chart_data(start, end, firmwares, codes)
 
     assert result == expected_result
@@ -304,19 +613,673 @@ async def test_ensure_index_exists_creates_index() -> None:
     ) as mock_create, patch.object(IngestClient, "put_pipeline", new_callable=AsyncMock) as mock_put_pipeline:
         mock_exists.return_value = False
         await log_database.ensure_index_exists()
-        mock_exists.assert_called_once_with(index=log_database.index_name)
-        mock_create.assert_called_once()
+        mock_exists.assert_any_call(index=log_database.index_name)
+        mock_exists.assert_any_call(index=log_database.rollup_index_name)
+        assert mock_create.call_count == 4
         mock_put_pipeline.assert_called_once()
 
 
 @pytest.mark.asyncio
-async def test_ensure_index_exists_doesnt_create_index() -> None:
+async def test_ensure_index_exists_doesnt_create_index(capsys: pytest.CaptureFixture[str]) -> None:
     es = AsyncElasticsearch(hosts=["http://fakeurl:9200/"])
     log_database = LogDatabase(es)
     with patch.object(es.indices, "exists", new_callable=AsyncMock) as mock_exists, patch.object(
         es.indices, "create"
-    ) as mock_create:
+    ) as mock_create, patch.object(
+        es.indices, "get_mapping", AsyncMock(return_value={"smartlog": {"mappings": {"properties": {}}}})
+    ):
         mock_exists.return_value = True
         await log_database.ensure_index_exists()
-        mock_exists.assert_called_once_with(index=log_database.index_name)
+        mock_exists.assert_any_call(index=log_database.index_name)
         mock_create.assert_not_called()
+    # indices created before mappings were versioned need migrating
+    assert "smartlog mappings are at version 1 of" in capsys.readouterr().out
+
+
+@pytest.mark.asyncio
+async def test_uploaded_logs(log_database: LogDatabase) -> None:
+    mock_elastic.search = AsyncMock(return_value={"hits": {"hits": [{"_source": {"file": "b.csv"}}]}})
+    assert await log_database.uploaded_logs(["a.csv", "b.csv"]) == {"b.csv"}
+    assert mock_elastic.search.call_args.kwargs["index"] == log_database.registry_index_name
+    assert mock_elastic.search.call_args.kwargs["query"]["bool"]["must"] == {"terms": {"file": ["a.csv", "b.csv"]}}
+    assert await log_database.uploaded_logs([]) == set()
+
+
+@pytest.mark.asyncio
+async def test_index_actions(log_file: LogFile) -> None:
+    client_side = LogDatabase(mock_elastic, "test_smartlog")
+    ((action,),) = [batch async for batch in client_side._index_actions("test.log", entry_batches(log_file))]
+    meta, document = (json.loads(line) for line in action.splitlines())
+    assert "pipeline" not in meta["create"]
+    assert "@timestamp" in document
+    assert "color" not in document
+
+    pipeline = LogDatabase(mock_elastic, "test_smartlog", use_pipeline=True)
+    ((action,),) = [batch async for batch in pipeline._index_actions("test.log", entry_batches(log_file))]
+    meta, document = (json.loads(line) for line in action.splitlines())
+    assert meta["create"]["pipeline"] == "test_smartlog-pipeline"
+    assert "@timestamp" not in document
+
+
+def test_split_time_range() -> None:
+    raw, rollups = _split_time_range(datetime(2023, 5, 1, 10, 30), datetime(2023, 5, 1, 14, 15))
+    assert raw["bool"]["should"] == [
+        {"range": {"@timestamp": {"gte": "2023-05-01T10:30:00+00:00", "lt": "2023-05-01T11:00:00+00:00"}}},
+        {"range": {"@timestamp": {"gte": "2023-05-01T14:00:00+00:00", "lte": "2023-05-01T14:15:00+00:00"}}},
+    ]
+    assert rollups == {"range": {"@timestamp": {"gte": "2023-05-01T11:00:00+00:00", "lt": "2023-05-01T14:00:00+00:00"}}}
+
+    # hours are whole in UTC, whatever the time zone of the range
+    _, rollups = _split_time_range(
+        datetime(2023, 5, 1, 10, 30, tzinfo=timezone(timedelta(hours=5, minutes=30))),
+        datetime(2023, 5, 1, 14, tzinfo=timezone(timedelta(hours=5, minutes=30))),
+    )
+    assert rollups == {"range": {"@timestamp": {"gte": "2023-05-01T05:00:00+00:00", "lt": "2023-05-01T08:00:00+00:00"}}}
+
+    raw, rollups = _split_time_range(datetime(2023, 5, 1, 10, 30), datetime(2023, 5, 1, 11, 15))
+    assert raw == {"range": {"@timestamp": {"gte": "2023-05-01T10:30:00+00:00", "lte": "2023-05-01T11:15:00+00:00"}}}
+    assert rollups is None
+
+
+@pytest.mark.asyncio
+async def test_log_entries_frequency_merges_rollups(log_database: LogDatabase) -> None:
+    raw = [{"key": {"fw": "firmware1", "code": "event1"}, "doc_count": 2}]
+    rolled_up = [
+        {"key": {"fw": "firmware1", "code": "event1"}, "doc_count": 3, "count": {"value": 40.0}},
+        {"key": {"fw": "firmware0", "code": "event2"}, "doc_count": 1, "count": {"value": 5.0}},
+    ]
+    with patch.object(log_database, "_composites", return_value=[raw, rolled_up]) as mock_composites:
+        result = await log_database.log_entries_frequency(datetime(2023, 5, 1, 10, 30), datetime(2023, 5, 2), [1])
+    assert result == [
+        LogFrequencyEntry(firmware="firmware0", event_code="event2", count=5),
+        LogFrequencyEntry(firmware="firmware1", event_code="event1", count=42),
+    ]
+    # both parts are fetched together
+    (raw_search, rollup_search) = mock_composites.call_args.args[0]
+    assert raw_search[0] == log_database.events_index_name
+    assert rollup_search[0] == log_database.rollup_index_name
+
+
+@pytest.mark.asyncio
+async def test_firmware_chart_data_merges_rollups(log_database: LogDatabase) -> None:
+    raw = [
+        {
+            "key": {"firmware": "firmware1"},
+            "doc_count": 10,
+            "filtered": {"code": {"buckets": [{"key": "code1", "doc_count": 4}]}},
+        }
+    ]
+    rolled_up = [
+        {
+            "key": {"firmware": "firmware1"},
+            "doc_count": 2,
+            "total": {"value": 90.0},
+            "filtered": {"code": {"buckets": [{"key": "code1", "doc_count": 1, "count": {"value": 6.0}}]}},
+        }
+    ]
+    with patch.object(log_database, "_composites", return_value=[raw, rolled_up]):
+        result = await log_database.firmware_chart_data(
+            datetime(2023, 5, 1, 10, 30), datetime(2023, 5, 2), ["firmware1"], ["code1", "code2"]
+        )
+    assert result == [{"firmware": "firmware1", "total": 100, "code1": 10, "code2": "0"}]
+
+
+@pytest.mark.asyncio
+async def test_upload_writes_rollups() -> None:
+    elastic = FakeElastic()
+    log_db = LogDatabase(elastic)  # type: ignore
+    await log_db.upload("log.csv", parse_log_stream("log.csv", log_chunks()))
+    rollups = elastic.documents[log_db.rollup_index_name]
+    entries = [doc for doc in elastic.documents[log_db.index_name] if doc["type_um"] == "BIN" and doc["value"] == "ON"]
+    assert entries
+    assert sum(rollup["count"] for rollup in rollups) == len(entries)
+    assert all(rollup["file"] == "log.csv" for rollup in rollups)
+
+    await log_db.delete_log("log.csv")
+    assert elastic.documents[log_db.rollup_index_name] == []
+
+
+@pytest.mark.asyncio
+async def test_upload_writes_events() -> None:
+    elastic = FakeElastic()
+    log_db = LogDatabase(elastic)  # type: ignore
+    stats = await log_db.upload("log.csv", parse_log_stream("log.csv", log_chunks()))
+    assert stats.count == 11
+    events = elastic.documents[log_db.events_index_name]
+    entries = elastic.documents[log_db.index_name]
+    assert sorted(event["@timestamp"] for event in events) == sorted(
+        entry["@timestamp"] for entry in entries if entry["type_um"] == "BIN" and entry["value"] == "ON"
+    )
+    assert set(events[0]) == {"@timestamp", "code", "file", "ini_filename", "unit_subunit_id"}
+
+    await log_db.delete_log("log.csv")
+    assert elastic.documents[log_db.events_index_name] == []
+
+
+@pytest.mark.asyncio
+async def test_backfill_events(log_database: LogDatabase) -> None:
+    mock_elastic.reindex = AsyncMock(return_value={"task": "node:1"})
+    mock_elastic.tasks.get = AsyncMock(return_value={"completed": True, "response": {"failures": []}})
+    mock_elastic.indices.refresh = AsyncMock()
+    await log_database._backfill_events()
+    assert mock_elastic.reindex.call_args.kwargs["source"]["index"] == "test_smartlog"
+    assert mock_elastic.reindex.call_args.kwargs["dest"] == {"index": "test_smartlog-events"}
+    mock_elastic.tasks.get.assert_called_once_with(task_id="node:1")
+    mock_elastic.indices.refresh.assert_called_once_with(index="test_smartlog-events")
+
+
+@pytest.mark.asyncio
+async def test_ensure_index_exists_marks_backfills(capsys: pytest.CaptureFixture[str]) -> None:
+    log_database = LogDatabase(mock_elastic, "test_smartlog")
+    mock_elastic.indices.exists = AsyncMock(side_effect=[True, False, True, True])
+    mock_elastic.indices.create = AsyncMock()
+    mock_elastic.indices.get_mapping = AsyncMock(
+        return_value={"test_smartlog": {"mappings": {"_meta": {"version": 2}}}}
+    )
+    with patch.object(log_database, "_backfill_rollups", new_callable=AsyncMock) as mock_backfill:
+        await log_database.ensure_index_exists()
+    mock_elastic.indices.create.assert_called_once()
+    assert mock_elastic.indices.create.call_args.kwargs["index"] == "test_smartlog-rollup"
+    # the logs already stored are left to the backfill, which isn't run while starting up
+    assert mock_elastic.indices.create.call_args.kwargs["mappings"]["_meta"] == {"backfilled": False}
+    mock_backfill.assert_not_called()
+    assert "test_smartlog-rollup miss the logs already uploaded" in capsys.readouterr().out
+
+
+@pytest.mark.asyncio
+async def test_drop_indices() -> None:
+    elastic = AsyncMock()
+    elastic.indices.get.return_value = {"test_smartlog-data-2022.01": {}, "test_smartlog-data-2022.02": {}}
+    log_database = LogDatabase(elastic, "test_smartlog", index_layout=IndexLayout.MONTH)
+    await log_database.drop_indices()
+    assert elastic.indices.get.call_args.kwargs["index"] == "test_smartlog-data-*"
+    assert elastic.indices.delete.call_args.kwargs["index"].split(",") == [
+        "test_smartlog-data-2022.01",
+        "test_smartlog-data-2022.02",
+        "test_smartlog-rollup",
+        "test_smartlog-events",
+        "test_smartlog-files",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_backfill() -> None:
+    elastic = AsyncMock()
+    elastic.indices.get_mapping.return_value = {
+        "test_smartlog-rollup": {"mappings": {"_meta": {"backfilled": False}}},
+        "test_smartlog-events": {"mappings": {}},
+        "test_smartlog-files": {"mappings": {"_meta": {"backfilled": False}}},
+    }
+    log_database = LogDatabase(elastic, "test_smartlog")
+    with patch.object(log_database, "_backfill_rollups", new_callable=AsyncMock) as backfill_rollups, patch.object(
+        log_database, "_backfill_registry", AsyncMock(side_effect=TimeoutError)
+    ) as backfill_registry:
+        with pytest.raises(TimeoutError):
+            await log_database.backfill(report=lambda _: None)
+        backfill_rollups.assert_called_once()
+        # only the backfill that got to the end is marked as done, the other one runs again next time
+        elastic.indices.put_mapping.assert_called_once_with(index="test_smartlog-rollup", meta={"backfilled": True})
+
+        elastic.indices.get_mapping.return_value = {
+            "test_smartlog-rollup": {"mappings": {"_meta": {"backfilled": True}}},
+            "test_smartlog-files": {"mappings": {"_meta": {"backfilled": False}}},
+        }
+        backfill_registry.side_effect = None
+        assert await log_database.backfill(report=lambda _: None) == ["test_smartlog-files"]
+        backfill_rollups.assert_called_once()
+        assert elastic.indices.put_mapping.call_args.kwargs["index"] == "test_smartlog-files"
+
+
+@pytest.mark.asyncio
+async def test_backfill_rollups_after_upload() -> None:
+    elastic = FakeElastic()
+    log_db = LogDatabase(elastic, composite_partitions=2)  # type: ignore
+    await log_db.upload("old.csv", parse_log_stream("old.csv", log_chunks()))
+    rolled_up = sum(rollup["count"] for rollup in elastic.documents[log_db.rollup_index_name])
+    assert rolled_up > 0
+    # the rollup index created after the first log was uploaded, and then another log uploaded
+    await elastic.indices.delete(index=log_db.rollup_index_name)
+    await asyncio.sleep(0.01)
+    await elastic.indices.create(index=log_db.rollup_index_name)
+    await log_db.upload("new.csv", parse_log_stream("new.csv", log_chunks()))
+    await log_db._backfill_rollups()
+
+    counts: dict[str, int] = defaultdict(int)
+    for rollup in elastic.documents[log_db.rollup_index_name]:
+        counts[rollup["file"]] += rollup["count"]
+    # the new log's rollups, written by its upload, aren't backfilled again
+    assert counts == {"old.csv": rolled_up, "new.csv": rolled_up}
+
+
+@pytest.mark.asyncio
+async def test_registry() -> None:
+    elastic = FakeElastic()
+    log_db = LogDatabase(elastic)  # type: ignore
+    await log_db.upload("log.csv", parse_log_stream("log.csv", log_chunks()))
+    entries = elastic.documents[log_db.index_name]
+    (registered,) = elastic.documents[log_db.registry_index_name]
+    assert registered["entry_count"] == len(entries) == 11
+    assert registered["firmwares"] == sorted({entry["ini_filename"] for entry in entries})
+    assert registered["first_entry_timestamp"] == min(entry["@timestamp"] for entry in entries)
+    assert registered["last_entry_timestamp"] == max(entry["@timestamp"] for entry in entries)
+
+    log_list = await log_db.uploaded_file_list
+    (log_file,) = log_list.log_files
+    assert (log_file.file_name, log_file.entry_count) == ("log.csv", 11)
+    assert log_list.min_timestamp == log_file.first_entry_timestamp
+    assert await log_db.uploaded_logs(["log.csv", "other.csv"]) == {"log.csv"}
+
+    with pytest.raises(LogDatabaseError):
+        await log_db.upload("log.csv", parse_log_stream("log.csv", log_chunks()))
+    assert len(elastic.documents[log_db.index_name]) == 11
+
+    await log_db.delete_log("log.csv")
+    assert elastic.documents[log_db.registry_index_name] == []
+    assert (await log_db.uploaded_file_list).log_files == []
+
+
+@pytest.mark.asyncio
+async def test_registry_hides_uploads_in_progress() -> None:
+    elastic = FakeElastic()
+    log_db = LogDatabase(elastic)  # type: ignore
+    release = asyncio.Event()
+
+    async def slow_chunks() -> AsyncIterator[bytes]:
+        await release.wait()
+        async for chunk in log_chunks():
+            yield chunk
+
+    upload = asyncio.create_task(log_db.upload("log.csv", parse_log_stream("log.csv", slow_chunks())))
+    await asyncio.sleep(0)
+    assert await log_db.uploaded_logs(["log.csv"]) == {"log.csv"}
+    assert (await log_db.uploaded_file_list).log_files == []
+    release.set()
+    await upload
+    assert len((await log_db.uploaded_file_list).log_files) == 1
+
+
+@pytest.mark.asyncio
+async def test_uploaded_content() -> None:
+    elastic = FakeElastic()
+    log_db = LogDatabase(elastic)  # type: ignore
+    await log_db.upload("log.csv", parse_log_stream("log.csv", log_chunks()), content_hash="abc")
+    assert elastic.documents[log_db.registry_index_name][0]["content_hash"] == "abc"
+    assert await log_db.uploaded_content(["abc", "def"]) == {"abc": "log.csv"}
+    assert await log_db.uploaded_content([]) == {}
+
+
+def grown_log(*, drop: int = 0, new_rows: bytes = b"") -> AsyncIterator[bytes]:
+    # the log as it was `drop` rows ago, or with `new_rows` logged since then (logs are written newest first)
+    header, rows = Path(__file__).with_name("log.csv").read_bytes().split(b"Color\n", 1)
+
+    async def chunks() -> AsyncIterator[bytes]:
+        yield header + b"Color\n" + new_rows + b"\n".join(rows.split(b"\n")[drop:])
+
+    return chunks()
+
+
+NEW_ROW = b"25/02/2022 ; 14:25:00.000 ; 1 ; 0 ; code4 ; code4 ; ON ; BIN ; 0 ; 0xFFE0FFFF\n"
+
+
+@pytest.mark.asyncio
+async def test_upload_append() -> None:
+    elastic = FakeElastic()
+    log_db = LogDatabase(elastic)  # type: ignore
+    # the first upload misses one of the three entries logged at its newest timestamp
+    await log_db.upload("log.csv", parse_log_stream("log.csv", grown_log(drop=1)), content_hash="old")
+    assert len(elastic.documents[log_db.index_name]) == 10
+    (registered,) = elastic.documents[log_db.registry_index_name]
+
+    stats = await log_db.upload(
+        "log.csv", parse_log_stream("log.csv", grown_log(new_rows=NEW_ROW)), content_hash="new", append=True
+    )
+    assert stats.count == 2
+    entries = elastic.documents[log_db.index_name]
+    assert sorted(entry["code"] for entry in entries if "append_id" in entry) == ["code1", "code4"]
+    (updated,) = elastic.documents[log_db.registry_index_name]
+    assert updated["entry_count"] == len(entries) == 12
+    assert updated["first_entry_timestamp"] == registered["first_entry_timestamp"]
+    assert updated["last_entry_timestamp"] == "2022-02-25T14:25:00+01:00"
+    assert (updated["content_hash"], updated["uploaded_at"]) == ("new", registered["uploaded_at"])
+    assert sum(rollup["count"] for rollup in elastic.documents[log_db.rollup_index_name]) == 3
+
+    # appending the same copy again doesn't add anything
+    stats = await log_db.upload("log.csv", parse_log_stream("log.csv", grown_log(new_rows=NEW_ROW)), append=True)
+    assert stats.count == 0
+    assert len(elastic.documents[log_db.index_name]) == 12
+
+
+@pytest.mark.asyncio
+async def test_upload_append_new_log() -> None:
+    elastic = FakeElastic()
+    log_db = LogDatabase(elastic)  # type: ignore
+    await log_db.upload("log.csv", parse_log_stream("log.csv", log_chunks()), append=True)
+    assert elastic.documents[log_db.registry_index_name][0]["entry_count"] == 11
+
+
+@pytest.mark.asyncio
+async def test_upload_append_rolls_back() -> None:
+    elastic = FakeElastic()
+    log_db = LogDatabase(elastic)  # type: ignore
+    await log_db.upload("log.csv", parse_log_stream("log.csv", log_chunks()))
+    (registered,) = elastic.documents[log_db.registry_index_name]
+
+    async def failing_batches() -> AsyncIterator[list[LogRecord]]:
+        # the file breaks right after its new entry
+        async for batch in parse_log_stream("log.csv", grown_log(new_rows=NEW_ROW)):
+            yield batch[:1]
+        raise LogParseError("broken row")
+
+    with pytest.raises(LogParseError):
+        await log_db.upload("log.csv", failing_batches(), append=True)
+    assert len(elastic.documents[log_db.index_name]) == 11
+    assert all("append_id" not in entry for entry in elastic.documents[log_db.index_name])
+    assert elastic.documents[log_db.registry_index_name] == [registered]
+
+
+@pytest.mark.asyncio
+async def test_upload_append_conflict() -> None:
+    elastic = FakeElastic()
+    log_db = LogDatabase(elastic)  # type: ignore
+    await log_db.upload("log.csv", parse_log_stream("log.csv", log_chunks()))
+    registered = await elastic.get(log_db.registry_index_name, "log.csv")
+    # another append updates the registry while this one is indexing
+    await elastic.index(log_db.registry_index_name, "log.csv", registered["_source"])
+    with patch.object(elastic, "get", AsyncMock(return_value=registered)), pytest.raises(LogDatabaseError):
+        await log_db.upload("log.csv", parse_log_stream("log.csv", grown_log(new_rows=NEW_ROW)), append=True)
+    assert len(elastic.documents[log_db.index_name]) == 11
+
+
+@pytest.mark.asyncio
+async def test_file_index_layout() -> None:
+    elastic = FakeElastic()
+    log_db = LogDatabase(elastic, index_layout=IndexLayout.FILE)  # type: ignore
+    await log_db.upload("Log 1.csv", parse_log_stream("Log 1.csv", log_chunks()))
+    await log_db.upload("log-1.csv", parse_log_stream("log-1.csv", log_chunks()))
+    # names that only differ in case or punctuation still get their own index
+    first, second = log_db._data_index("Log 1.csv"), log_db._data_index("log-1.csv")
+    assert first != second
+    assert first.startswith("smartlog-data-log-1-csv-") and second.startswith("smartlog-data-log-1-csv-")
+    assert len(elastic.documents[first]) == len(elastic.documents[second]) == 11
+    assert await elastic.indices.exists(log_db.data_indices)
+    assert len((await log_db.uploaded_file_list).log_files) == 2
+
+    assert await log_db.delete_log("Log 1.csv") == 11
+    assert [name for name in elastic.documents if name.startswith("smartlog-data-")] == [second]
+    assert await log_db.delete_log("Log 1.csv") == 0
+    assert [log_file.file_name for log_file in (await log_db.uploaded_file_list).log_files] == ["log-1.csv"]
+
+
+@pytest.mark.asyncio
+async def test_ensure_index_exists_installs_template() -> None:
+    es = AsyncElasticsearch(hosts=["http://fakeurl:9200/"])
+    log_database = LogDatabase(es, index_layout=IndexLayout.FILE)
+    with patch.object(es.indices, "exists", new_callable=AsyncMock) as mock_exists, patch.object(
+        es.indices, "create", new_callable=AsyncMock
+    ) as mock_create, patch.object(
+        es.indices, "put_index_template", new_callable=AsyncMock
+    ) as mock_put_template, patch.object(
+        IngestClient, "put_pipeline", new_callable=AsyncMock
+    ):
+        mock_exists.return_value = False
+        await log_database.ensure_index_exists()
+        mock_exists.assert_any_call(index="smartlog-data-*", allow_no_indices=False)
+        assert mock_put_template.call_args.kwargs["index_patterns"] == ["smartlog-data-*"]
+        # only the rollup, events and registry indices are created upfront
+        assert [call.kwargs["index"] for call in mock_create.call_args_list] == [
+            "smartlog-rollup",
+            "smartlog-events",
+            "smartlog-files",
+        ]
+
+
+def test_months_between() -> None:
+    # naive datetimes are UTC, and months are in log time
+    assert _months_between(datetime(2022, 1, 31, 23, 30), datetime(2022, 3, 1)) == [(2022, 2), (2022, 3)]
+    assert _months_between(datetime(2021, 12, 15), datetime(2022, 1, 15)) == [(2021, 12), (2022, 1)]
+    assert _months_between(datetime(2022, 5, 1), datetime(2022, 5, 2)) == [(2022, 5)]
+
+
+def test_search_indices() -> None:
+    log_db = LogDatabase(mock_elastic, index_layout=IndexLayout.MONTH)
+    assert log_db._search_indices(datetime(2022, 2, 1), datetime(2022, 2, 10)) == "smartlog-data-2022.02"
+    assert log_db._search_indices(datetime(2021, 11, 10), datetime(2023, 1, 10)) == (
+        "smartlog-data-2022.*,smartlog-data-2021.11,smartlog-data-2021.12,smartlog-data-2023.01"
+    )
+    assert LogDatabase(mock_elastic)._search_indices(datetime(2022, 2, 1), datetime(2022, 2, 10)) == "smartlog"
+
+
+@pytest.mark.asyncio
+async def test_month_index_layout() -> None:
+    elastic = FakeElastic()
+    log_db = LogDatabase(elastic, index_layout=IndexLayout.MONTH)  # type: ignore
+
+    async def batches() -> AsyncIterator[list[LogRecord]]:
+        async for batch in parse_log_stream("log.csv", log_chunks()):
+            # the oldest entry is moved back to the previous month
+            batch[-1].timestamp = datetime(2022, 1, 31, 23, 59)
+            yield batch
+
+    await log_db.upload("log.csv", batches())
+    assert len(elastic.documents["smartlog-data-2022.02"]) == 10
+    assert len(elastic.documents["smartlog-data-2022.01"]) == 1
+    (registered,) = elastic.documents[log_db.registry_index_name]
+    assert registered["first_entry_timestamp"] == "2022-01-31T23:59:00+01:00"
+
+    search = AsyncMock(return_value={"hits": {"total": {"value": 0}}})
+    with patch.object(elastic, "search", search):
+        assert await log_db.log_overview(datetime(2022, 2, 10), datetime(2022, 2, 20)) == LogOverview.empty()
+    assert search.call_args.kwargs["index"] == "smartlog-data-2022.02"
+
+    assert await log_db.delete_log("log.csv") == 11
+    assert elastic.documents["smartlog-data-2022.01"] == elastic.documents["smartlog-data-2022.02"] == []
+
+
+@pytest.mark.asyncio
+async def test_upload_bulk_load() -> None:
+    elastic = FakeElastic()
+    bulk_load = BulkLoadSettings(elastic, disable_replicas=True)  # type: ignore
+    log_db = LogDatabase(elastic, index_layout=IndexLayout.FILE, bulk_load=bulk_load)  # type: ignore
+    index = log_db._data_index("log.csv")
+    settings: list[dict[str, object]] = []
+
+    async def batches() -> AsyncIterator[list[LogRecord]]:
+        async for batch in parse_log_stream("log.csv", log_chunks()):
+            settings.append(dict(elastic.indices.settings[index]))
+            yield batch
+
+    await log_db.upload("log.csv", batches())
+    assert settings[0] == {"index.refresh_interval": "-1", "index.number_of_replicas": "0"}
+    assert elastic.indices.settings[index] == elastic.indices.settings[log_db.events_index_name] == {}
+    assert len(elastic.documents[index]) == 11
+
+
+@pytest.mark.asyncio
+async def test_upload_bulk_load_months() -> None:
+    elastic = FakeElastic()
+    log_db = LogDatabase(elastic, index_layout=IndexLayout.MONTH, bulk_load=BulkLoadSettings(elastic))  # type: ignore
+    # a month of older logs, which this upload doesn't write to
+    await elastic.indices.create(index="smartlog-data-2021.12")
+    settings: dict[str, dict[str, object]] = {}
+
+    async def batches() -> AsyncIterator[list[LogRecord]]:
+        async for batch in parse_log_stream("log.csv", log_chunks()):
+            yield batch
+        settings.update({index: dict(elastic.indices.settings[index]) for index in elastic.indices.indices})
+
+    await log_db.upload("log.csv", batches())
+    # only the month written to stops refreshing while the log is uploaded
+    assert settings == {
+        "smartlog-data-2021.12": {},
+        "smartlog-data-2022.02": {"index.refresh_interval": "-1"},
+    }
+    assert elastic.indices.settings["smartlog-data-2022.02"] == {}
+    assert len(elastic.documents["smartlog-data-2022.02"]) == 11
+
+
+@pytest.mark.asyncio
+async def test_upload_wait_for_refresh() -> None:
+    with pytest.raises(ValueError):
+        LogDatabase(mock_elastic, bulk_load=BulkLoadSettings(mock_elastic), wait_for_refresh=True)
+    elastic = FakeElastic()
+    log_db = LogDatabase(elastic, wait_for_refresh=True)  # type: ignore
+    with patch.object(elastic.indices, "refresh", new_callable=AsyncMock) as mock_refresh:
+        await log_db.upload("log.csv", parse_log_stream("log.csv", log_chunks()))
+    # the entries were searchable once their bulk requests returned
+    mock_refresh.assert_not_called()
+    assert (await log_db.uploaded_file_list).log_files[0].entry_count == 11
+
+
+def overloaded_after(elastic: FakeElastic, calls: int) -> None:
+    # bulk requests get rejected (after the first `calls` of them) as if ElasticSearch couldn't keep up
+    bulk = elastic.bulk
+
+    async def rejecting_bulk(operations: list[bytes], **kwargs: object) -> dict[str, Any]:
+        nonlocal calls
+        calls -= 1
+        if calls < 0:
+            return {"errors": True, "items": [{"create": {"error": {"type": "es_rejected_execution_exception"}}}]}
+        return await bulk(operations, **kwargs)
+
+    elastic.bulk = rejecting_bulk  # type: ignore
+
+
+@pytest.mark.asyncio
+async def test_upload_resumes_when_overloaded() -> None:
+    elastic = FakeElastic()
+    log_db = LogDatabase(elastic, bulk_indexer=BulkIndexer(elastic, chunk_size=4, max_retries=0))  # type: ignore
+    overloaded_after(elastic, 1)
+    with pytest.raises(LogDatabaseError):
+        await log_db.upload("log.csv", parse_log_stream("log.csv", log_chunks()), content_hash="hash")
+    # the entries stored so far are kept, but the log is neither listed nor considered uploaded
+    assert 0 < len(elastic.documents[log_db.index_name]) < 11
+    assert not (await log_db.uploaded_file_list).log_files
+    assert await log_db.uploaded_content(["hash"]) == {}
+    assert await log_db.uploaded_logs(["log.csv"]) == set()
+
+    elastic.bulk = FakeElastic.bulk.__get__(elastic)  # type: ignore
+    stats = await log_db.upload("log.csv", parse_log_stream("log.csv", log_chunks()), content_hash="hash")
+    assert stats.count == 11
+    assert len(elastic.documents[log_db.index_name]) == 11
+    assert await log_db.uploaded_content(["hash"]) == {"hash": "log.csv"}
+
+
+@pytest.mark.asyncio
+async def test_upload_replaces_interrupted_upload() -> None:
+    elastic = FakeElastic()
+    log_db = LogDatabase(elastic, bulk_indexer=BulkIndexer(elastic, chunk_size=4, max_retries=0))  # type: ignore
+    await log_db.upload("other.csv", parse_log_stream("other.csv", log_chunks()))
+    overloaded_after(elastic, 1)
+    with pytest.raises(LogDatabaseError):
+        await log_db.upload("log.csv", parse_log_stream("log.csv", grown_log(new_rows=NEW_ROW)), content_hash="old")
+    elastic.bulk = FakeElastic.bulk.__get__(elastic)  # type: ignore
+    # a different file under the same name: what was stored of the old one is dropped
+    await log_db.upload("log.csv", parse_log_stream("log.csv", log_chunks()), content_hash="new")
+    entries = [doc for doc in elastic.documents[log_db.index_name] if doc["file"] == "log.csv"]
+    assert len(entries) == 11
+    assert "2022-02-25T14:25:00" not in {doc["timestamp"] for doc in entries}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("content_hash", [None, "hash"])
+async def test_cancelled_upload_releases_log(content_hash: str | None) -> None:
+    elastic = FakeElastic()
+    log_db = LogDatabase(elastic)  # type: ignore
+    await log_db.upload("other.csv", parse_log_stream("other.csv", log_chunks()))
+    started = asyncio.Event()
+
+    async def endless_chunks() -> AsyncIterator[bytes]:
+        async for chunk in log_chunks():
+            yield chunk
+        started.set()
+        await asyncio.Future()
+
+    upload = asyncio.create_task(
+        log_db.upload("log.csv", parse_log_stream("log.csv", endless_chunks()), content_hash=content_hash)
+    )
+    await started.wait()
+    upload.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await upload
+    # no claim left behind: marked interrupted when the file can be recognized again, otherwise rolled back
+    claims = [doc for doc in elastic.documents[log_db.registry_index_name] if doc["file"] == "log.csv"]
+    assert [claim.get("interrupted") for claim in claims] == [True] * (content_hash is not None)
+    stats = await log_db.upload("log.csv", parse_log_stream("log.csv", log_chunks()), content_hash=content_hash)
+    assert stats.count == 11
+
+
+@pytest.mark.asyncio
+async def test_upload_reclaims_stale_claim() -> None:
+    elastic = FakeElastic()
+    log_db = LogDatabase(elastic, stale_claim_timeout=timedelta(hours=1))  # type: ignore
+    await log_db.upload("other.csv", parse_log_stream("other.csv", log_chunks()))
+    # left behind by an upload killed along with its process
+    claimed_at = datetime.now().astimezone() - timedelta(minutes=30)
+    await elastic.create(log_db.registry_index_name, "log.csv", registry_document("log.csv", LogSummary(), claimed_at))
+    with pytest.raises(LogDatabaseError):
+        await log_db.upload("log.csv", parse_log_stream("log.csv", log_chunks()))
+
+    elastic.ids[log_db.registry_index_name]["log.csv"]["uploaded_at"] = (claimed_at - timedelta(hours=1)).isoformat()
+    stats = await log_db.upload("log.csv", parse_log_stream("log.csv", log_chunks()), append=True)
+    assert stats.count == 11
+    assert elastic.ids[log_db.registry_index_name]["log.csv"]["entry_count"] == 11
+
+
+@pytest.mark.asyncio
+async def test_start_deletion() -> None:
+    elastic = FakeElastic()
+    log_db = LogDatabase(elastic)  # type: ignore
+    await log_db.upload("log.csv", parse_log_stream("log.csv", log_chunks()), content_hash="hash")
+    task_id = await log_db.start_deletion("log.csv", requests_per_second=100)
+    assert not elastic.documents[log_db.index_name]
+    # hidden right away, but still registered until the deletion is known to be over
+    assert not (await log_db.uploaded_file_list).log_files
+    assert await log_db.uploaded_content(["hash"]) == {}
+    with pytest.raises(LogDatabaseError):
+        await log_db.start_deletion("log.csv")
+
+    elastic.tasks.tasks[task_id]["completed"] = False
+    for append in (False, True):
+        with pytest.raises(LogDatabaseError) as e:
+            await log_db.upload("log.csv", parse_log_stream("log.csv", log_chunks()), append=append)
+        assert e.value.message == "Log file still being deleted!"
+    assert await log_db.uploaded_logs(["log.csv"]) == set()
+    assert "deleting" in elastic.ids[log_db.registry_index_name]["log.csv"]
+    elastic.tasks.tasks[task_id]["completed"] = True
+    # finished by whichever comes first, without waiting for its progress to be polled
+    assert await log_db.uploaded_logs(["log.csv"]) == set()
+    assert not elastic.documents[log_db.registry_index_name]
+    deletion = await log_db.deletion(task_id)
+    assert deletion is not None
+    assert deletion.completed
+    # entries, events and rollups
+    assert deletion.deleted == deletion.total > 11
+    assert not elastic.documents[log_db.registry_index_name]
+    assert await log_db.deletion("fake:unknown") is None
+
+    await log_db.upload("log.csv", parse_log_stream("log.csv", log_chunks()))
+    assert len(elastic.documents[log_db.index_name]) == 11
+
+
+@pytest.mark.asyncio
+async def test_deletion_failure() -> None:
+    elastic = AsyncMock()
+    log_db = LogDatabase(elastic)
+    elastic.tasks.get.return_value = {
+        "completed": True,
+        "task": {"action": "indices:data/write/delete/byquery", "status": {"total": 10, "deleted": 9}},
+        "response": {"failures": [{"cause": {"type": "search_phase_execution_exception", "reason": "boom"}}]},
+    }
+    deletion = await log_db.deletion("node:1")
+    assert deletion is not None
+    assert deletion.errors == ["boom"]
+    # the log is listed again, rather than forgotten with some of its entries still stored
+    elastic.update_by_query.assert_called_once()
+    assert elastic.update_by_query.call_args.kwargs["query"] == {
+        "bool": {"must": {"term": {"deleting": {"value": "node:1"}}}}
+    }
+    elastic.delete_by_query.assert_not_called()
+
+    # not a deletion
+    elastic.tasks.get.return_value = {"completed": True, "task": {"action": "indices:data/write/reindex"}}
+    assert await log_db.deletion("node:2") is None
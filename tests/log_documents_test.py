@@ -0,0 +1,118 @@
+# ruff: noqa: PLR2004
+
+import json
+from collections import Counter
+from dataclasses import replace
+from datetime import datetime, timedelta
+
+from sl_statistics_backend.log_documents import (
+    RollupKey,
+    count_rollups,
+    document_ids,
+    event_actions,
+    index_actions,
+    localize,
+    rollup_actions,
+)
+from sl_statistics_backend.log_stream import LogRecord
+
+
+def test_localize() -> None:
+    assert localize(datetime(2022, 2, 25, 14, 23, 17, 75000)).isoformat() == "2022-02-25T14:23:17.075000+01:00"
+    assert localize(datetime(2022, 7, 1, 9, 0)).utcoffset() == timedelta(hours=2)
+
+
+def test_localize_dst_changes() -> None:
+    # 02:30 doesn't exist on 2022-03-27: ElasticSearch maps it to 03:30+02:00, which is the same instant
+    assert localize(datetime(2022, 3, 27, 2, 30)).isoformat() == "2022-03-27T02:30:00+01:00"
+    assert localize(datetime(2022, 3, 27, 3, 30)).isoformat() == "2022-03-27T03:30:00+02:00"
+    # 02:30 happens twice on 2022-10-30: like ElasticSearch, the earlier offset is used
+    assert localize(datetime(2022, 10, 30, 2, 30)).isoformat() == "2022-10-30T02:30:00+02:00"
+    assert localize(datetime(2022, 10, 30, 3, 30)).isoformat() == "2022-10-30T03:30:00+01:00"
+
+
+record = LogRecord(
+    timestamp=datetime(2022, 2, 25, 14, 23, 17),
+    code="code1",
+    description="code1",
+    ini_filename="unit.ini",
+    subunit=0,
+    type_um="BIN",
+    unit=1,
+    unit_subunit_id=16,
+    value="ON",
+    snapshot="0",
+    color="0xFFADFF2F",
+)
+
+
+def test_index_actions() -> None:
+    (action,) = index_actions("smartlog", "log.csv", [record])
+    meta, document = (json.loads(line) for line in action.decode().splitlines())
+    assert meta == {"create": {"_index": "smartlog", "_id": document_ids("log.csv", 1)[0]}}
+    assert "color" not in document
+    assert "snapshot" not in document
+    assert document["file"] == "log.csv"
+    assert document["timestamp"] == "2022-02-25T14:23:17"
+    assert document["@timestamp"] == "2022-02-25T14:23:17+01:00"
+    assert document["unit_subunit_id"] == 16
+
+
+def test_event_actions() -> None:
+    off = replace(record, value="OFF")
+    (action,) = event_actions("smartlog-events", "log.csv", [record, off], append_id="abc")
+    meta, document = (json.loads(line) for line in action.decode().splitlines())
+    # events share the IDs of their entries
+    assert meta == {"create": {"_index": "smartlog-events", "_id": document_ids("log.csv", 1, "abc")[0]}}
+    assert document == {
+        "@timestamp": "2022-02-25T14:23:17+01:00",
+        "code": "code1",
+        "ini_filename": "unit.ini",
+        "unit_subunit_id": 16,
+        "file": "log.csv",
+        "append_id": "abc",
+    }
+
+
+def test_index_actions_pipeline() -> None:
+    (action,) = index_actions("smartlog", "log.csv", [record], pipeline="smartlog-pipeline")
+    meta, document = (json.loads(line) for line in action.decode().splitlines())
+    assert meta["create"]["pipeline"] == "smartlog-pipeline"
+    # the pipeline drops `color` and `snapshot` and sets `@timestamp` itself
+    assert document["color"] == "0xFFADFF2F"
+    assert "@timestamp" not in document
+    assert document["file"] == "log.csv"
+
+
+def test_rollups() -> None:
+    counts: Counter[RollupKey] = Counter()
+    count_rollups(
+        [record, replace(record, timestamp=datetime(2022, 2, 25, 14, 59)), replace(record, value="OFF")], counts
+    )
+    count_rollups([replace(record, timestamp=datetime(2022, 2, 25, 15, 0))], counts)
+    assert counts == {
+        ("unit.ini", "code1", 16, datetime(2022, 2, 25, 14)): 2,
+        ("unit.ini", "code1", 16, datetime(2022, 2, 25, 15)): 1,
+    }
+    action, other = rollup_actions("smartlog-rollup", "log.csv", counts)
+    meta, document = (json.loads(line) for line in action.decode().splitlines())
+    assert meta["create"]["_index"] == "smartlog-rollup"
+    assert meta["create"]["_id"] != json.loads(other.splitlines()[0])["create"]["_id"]
+    assert action == rollup_actions("smartlog-rollup", "log.csv", counts)[0]
+    assert document == {
+        "@timestamp": "2022-02-25T14:00:00+01:00",
+        "file": "log.csv",
+        "ini_filename": "unit.ini",
+        "code": "code1",
+        "unit_subunit_id": 16,
+        "count": 2,
+    }
+
+
+def test_document_ids() -> None:
+    ids = document_ids("log.csv", 3)
+    assert len(set(ids)) == 3
+    assert document_ids("log.csv", 3) == ids
+    assert document_ids("log.csv", 2, rows=[2, 0]) == [ids[2], ids[0]]
+    assert not set(document_ids("other.csv", 3)) & set(ids)
+    assert not set(document_ids("log.csv", 3, "abc")) & set(ids)
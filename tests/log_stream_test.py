@@ -0,0 +1,101 @@
+# ruff: noqa: PLR2004
+
+import pickle
+from collections.abc import AsyncIterator
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from sl_parser import LogFile
+
+from sl_statistics_backend.log_stream import (
+    LogParseError,
+    LogStreamParser,
+    _parse_timestamp,
+    parse_log_stream,
+    parse_rows,
+)
+
+log_bytes = Path(__file__).with_name("log.csv").read_bytes()
+
+
+async def chunked(data: bytes, size: int) -> AsyncIterator[bytes]:
+    for i in range(0, len(data), size):
+        yield data[i : i + size]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1024 * 1024])
+async def test_parse_log_stream_matches_parse_log(chunk_size: int) -> None:
+    expected = LogFile.parse_log("log.csv", log_bytes.decode("cp1252"))
+    records = [
+        asdict(record)
+        async for batch in parse_log_stream("log.csv", chunked(log_bytes, chunk_size))
+        for record in batch
+    ]
+    assert records == [entry.dict() for entry in expected.log_entries]
+
+
+@pytest.mark.asyncio
+async def test_parse_log_stream_process_pool() -> None:
+    expected = LogFile.parse_log("log.csv", log_bytes.decode("cp1252"))
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        batches = [batch async for batch in parse_log_stream("log.csv", chunked(log_bytes, 512), executor)]
+    assert [asdict(record) for batch in batches for record in batch] == [entry.dict() for entry in expected.log_entries]
+
+
+@pytest.mark.asyncio
+async def test_parse_log_stream_process_pool_error() -> None:
+    error_bytes = Path(__file__).with_name("logErr.csv").read_bytes()
+    with ProcessPoolExecutor(max_workers=1) as executor, pytest.raises(LogParseError):
+        _ = [batch async for batch in parse_log_stream("logErr.csv", chunked(error_bytes, 512), executor)]
+
+
+def test_parse_error_pickles() -> None:
+    error = pickle.loads(pickle.dumps(LogParseError("broken row")))
+    assert error.message == "broken row"
+
+
+def test_parse_timestamp() -> None:
+    assert _parse_timestamp("25/02/2022", "14:23:17.075") == datetime(2022, 2, 25, 14, 23, 17, 75000)
+    # anything unusual goes through `strptime`, which also validates the fields
+    assert _parse_timestamp("5/2/2022", "14:23:17.075") == datetime(2022, 2, 5, 14, 23, 17, 75000)
+    with pytest.raises(ValueError):
+        _parse_timestamp("31/02/2022", "14:23:17.075")
+
+
+def test_parser_header() -> None:
+    parser = LogStreamParser("log.csv")
+    entries = parse_rows(parser.feed(log_bytes) + parser.close(), parser.units_subunits)
+    expected = LogFile.parse_log("log.csv", log_bytes.decode("cp1252"))
+    assert parser.pc_datetime == expected.pc_datetime
+    assert parser.ups_datetime == expected.ups_datetime
+    assert parser.units_subunits == expected.units_subunits
+    assert len(entries) == 11
+
+
+def test_parser_handles_missing_final_newline() -> None:
+    parser = LogStreamParser("log.csv")
+    entries = parse_rows(parser.feed(log_bytes.rstrip(b"\r\n")) + parser.close(), parser.units_subunits)
+    assert len(entries) == 11
+
+
+def test_parser_malformed_row() -> None:
+    parser = LogStreamParser("logErr.csv")
+    rows = parser.feed(Path(__file__).with_name("logErr.csv").read_bytes())
+    with pytest.raises(LogParseError):
+        parse_rows(rows, parser.units_subunits)
+
+
+def test_parser_malformed_header() -> None:
+    with pytest.raises(LogParseError):
+        LogStreamParser("log.csv").feed(b"PC DateTime: yesterday\r\n")
+
+
+def test_parser_truncated_header() -> None:
+    parser = LogStreamParser("log.csv")
+    parser.feed(log_bytes[:40])
+    with pytest.raises(LogParseError):
+        parser.close()
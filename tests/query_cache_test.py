@@ -0,0 +1,183 @@
+# ruff: noqa: PLR2004
+
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from time import time
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from sl_statistics_backend.downsampling import Downsampling
+from sl_statistics_backend.log_database import LogDatabase
+from sl_statistics_backend.models import ChartFilterData
+from sl_statistics_backend.query_cache import QueryCache, SharedQueryCache
+
+start = datetime(2022, 2, 25)
+end = datetime(2022, 2, 26)
+
+
+def test_get_put() -> None:
+    cache = QueryCache()
+    assert cache.get("key") == (False, None)
+    cache.put("key", 42, cache.generation)
+    assert cache.get("key") == (True, 42)
+    stats = cache.stats
+    assert (stats.hits, stats.misses, stats.entries) == (1, 1, 1)
+
+
+def test_lru_eviction() -> None:
+    cache = QueryCache(max_entries=2)
+    cache.put("a", 1, 0)
+    cache.put("b", 2, 0)
+    cache.get("a")
+    cache.put("c", 3, 0)
+    assert cache.get("b") == (False, None)
+    assert cache.get("a") == (True, 1)
+    assert cache.get("c") == (True, 3)
+    assert cache.stats.evictions == 1
+
+
+def test_ttl() -> None:
+    cache = QueryCache(ttl=10)
+    with patch("sl_statistics_backend.query_cache.monotonic", return_value=100):
+        cache.put("key", 42, 0)
+    with patch("sl_statistics_backend.query_cache.monotonic", return_value=105):
+        assert cache.get("key") == (True, 42)
+    with patch("sl_statistics_backend.query_cache.monotonic", return_value=111):
+        assert cache.get("key") == (False, None)
+    assert cache.stats.entries == 0
+
+
+def test_generation() -> None:
+    cache = QueryCache()
+    cache.put("key", 42, cache.generation)
+    started_in = cache.generation
+    cache.bump_generation()
+    assert cache.get("key") == (False, None)
+    # results of queries that started before the data changed aren't cached
+    cache.put("key", 42, started_in)
+    assert cache.get("key") == (False, None)
+    assert cache.stats.generation == 1
+
+
+def test_shared_cache(tmp_path: Path) -> None:
+    # two workers using the same database
+    first, second = SharedQueryCache(str(tmp_path / "cache.sqlite3")), SharedQueryCache(str(tmp_path / "cache.sqlite3"))
+    filters = ChartFilterData(codes=["code1"], firmwares=["firmware1"], subunits=[16])
+    first.put(("chart_filters", "2022-02-25T00:00:00"), filters, first.generation)
+    assert second.get(("chart_filters", "2022-02-25T00:00:00"), ChartFilterData) == (True, filters)
+    assert second.get(("chart_filters", "2022-02-26T00:00:00"), ChartFilterData) == (False, None)
+
+    # an upload through the second worker invalidates the results cached by the first one
+    started_in = first.generation
+    second.bump_generation()
+    assert first.generation == 1
+    assert first.get(("chart_filters", "2022-02-25T00:00:00"), ChartFilterData) == (False, None)
+    first.put(("chart_filters", "2022-02-25T00:00:00"), filters, started_in)
+    assert first.stats.entries == 0
+    first.close()
+    second.close()
+
+
+@pytest.mark.asyncio
+async def test_shared_cache_keeps_types(tmp_path: Path) -> None:
+    elastic = AsyncMock()
+    bucket = {"key_as_string": "2022-02-25T00:00:00.000Z", "doc_count": 5, "filtered": {"code": {"buckets": []}}}
+    elastic.search.return_value = {
+        "hits": {"total": {"value": 5}},
+        "aggregations": {"events_over_time": {"buckets": [bucket]}},
+    }
+    cache = SharedQueryCache(str(tmp_path / "cache.sqlite3"))
+    log_db = LogDatabase(elastic, "test_smartlog", query_cache=cache)
+    missed = await log_db.time_chart_data(start, end, [16], ["code1"])
+    hit = await log_db.time_chart_data(start, end, [16], ["code1"])
+    assert elastic.search.call_count == 1
+    assert hit == missed == [{"timestamp": "2022-02-25T00:00:00.000Z", "total": 5, "code1": "0"}]
+    cache.close()
+
+
+def test_shared_cache_locked(tmp_path: Path) -> None:
+    cache = SharedQueryCache(str(tmp_path / "cache.sqlite3"))
+    cache.put("a", 1, cache.generation)
+    other_worker = sqlite3.connect(str(tmp_path / "cache.sqlite3"), isolation_level=None)
+    other_worker.execute("BEGIN IMMEDIATE")
+    # reads don't wait for the other worker's write, and writes are skipped rather than waited for
+    assert cache.get("a", int) == (True, 1)
+    cache.put("b", 2, cache.generation)
+    # the bump waits for the lock, and the results from before it are never served in the meantime
+    cache.bump_generation()
+    assert cache.get("a", int) == (False, None)
+    assert cache.generation == -1
+    other_worker.execute("ROLLBACK")
+    assert cache.generation == 1
+    assert cache.stats.entries == 0
+    other_worker.close()
+    # stats are still reported, without the numbers that can't be read
+    with patch.object(cache, "_db", side_effect=sqlite3.OperationalError("database is locked")):
+        assert (cache.stats.entries, cache.stats.generation) == (-1, -1)
+    cache.close()
+
+
+def test_shared_cache_lru_eviction(tmp_path: Path) -> None:
+    cache = SharedQueryCache(str(tmp_path / "cache.sqlite3"), max_entries=2)
+    now = time()
+    with patch("sl_statistics_backend.query_cache.time", side_effect=[now, now + 1, now + 2, now + 3]):
+        cache.put("a", 1, 0)
+        cache.put("b", 2, 0)
+        cache.get("a", int)
+        cache.put("c", 3, 0)
+    assert cache.get("b", int) == (False, None)
+    assert cache.get("a", int) == (True, 1)
+    assert cache.stats.evictions == 1
+    cache.close()
+
+
+@pytest.mark.asyncio
+async def test_log_database_caches_queries() -> None:
+    elastic = AsyncMock()
+    elastic.search.return_value = {"hits": {"total": {"value": 0}}}
+    elastic.delete_by_query.return_value = {"total": 0}
+    log_db = LogDatabase(elastic, "test_smartlog", query_cache=QueryCache())
+
+    await log_db.time_chart_data(start, end, [16, 17], ["code1"])
+    # lists of filters are normalized
+    assert await log_db.time_chart_data(start, end, [17, 16, 16], ["code1"]) == []
+    assert elastic.search.call_count == 1
+    await log_db.time_chart_data(start, end, [16], ["code1"])
+    assert elastic.search.call_count == 2
+
+    await log_db.delete_log("log.csv")
+    await log_db.time_chart_data(start, end, [16, 17], ["code1"])
+    assert elastic.search.call_count == 3
+
+    # keyword arguments, and defaults whether spelled out or not, make the same query
+    await log_db.time_chart_data(start, end, [16, 17], ["code1"], None, None, Downsampling.MAX)
+    await log_db.time_chart_data(start, end, subunits=[16, 17], codes=["code1"], downsampling=Downsampling.MAX)
+    assert elastic.search.call_count == 3
+
+
+@pytest.mark.asyncio
+async def test_log_database_without_cache() -> None:
+    elastic = AsyncMock()
+    elastic.search.return_value = {"hits": {"total": {"value": 0}}}
+    log_db = LogDatabase(elastic, "test_smartlog")
+    await log_db.log_overview(start, end)
+    await log_db.log_overview(start, end)
+    assert elastic.search.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_log_database_shared_cache(tmp_path: Path) -> None:
+    elastic = AsyncMock()
+    elastic.msearch.return_value = {
+        "responses": [
+            {"aggregations": {"agg": {"buckets": [{"key": {"fw": "firmware1", "code": "code1"}, "doc_count": 3}]}}}
+        ]
+    }
+    log_db = LogDatabase(elastic, "test_smartlog", query_cache=SharedQueryCache(str(tmp_path / "cache.sqlite3")))
+    # within the same hour, so that there is a single (raw) query
+    first = await log_db.log_entries_frequency(start, start.replace(minute=30), [16])
+    # results are decoded back into models
+    assert await log_db.log_entries_frequency(start, start.replace(minute=30), [16]) == first
+    assert elastic.msearch.call_count == 1
@@ -0,0 +1,60 @@
+# ruff: noqa: PLR2004
+
+import asyncio
+
+import pytest
+
+from sl_statistics_backend.single_flight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_are_coalesced() -> None:
+    flights = SingleFlight()
+    release = asyncio.Event()
+    calls = 0
+
+    async def query() -> int:
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return 42
+
+    waiters = [asyncio.create_task(flights.run("key", query)) for _ in range(5)]
+    other = asyncio.create_task(flights.run("other", query))
+    await asyncio.sleep(0)
+    release.set()
+    assert await asyncio.gather(*waiters, other) == [42] * 6
+    assert calls == 2
+    assert flights.stats.dict() == {"calls": 6, "coalesced": 4, "in_flight": 0}
+
+    # once done, the next call runs again
+    assert await flights.run("key", query) == 42
+    assert calls == 3
+
+
+@pytest.mark.asyncio
+async def test_errors_reach_every_caller() -> None:
+    flights = SingleFlight()
+
+    async def query() -> int:
+        await asyncio.sleep(0.01)
+        raise ValueError("broken query")
+
+    results = await asyncio.gather(*(flights.run("key", query) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_doesnt_cancel_the_others() -> None:
+    flights = SingleFlight()
+
+    async def query() -> int:
+        await asyncio.sleep(0.01)
+        return 42
+
+    first = asyncio.create_task(flights.run("key", query))
+    second = asyncio.create_task(flights.run("key", query))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == 42
+    assert first.cancelled()